@@ -0,0 +1,263 @@
+"""Writes Anki packages (.apkg) directly, so that decks don't have to go through Anki's CSV importer.
+
+An .apkg file is a zip archive holding:
+    collection.anki2: An SQLite database with the notes and cards, in the schema Anki has used since version 2.0
+        (version 11), which every version of Anki can import.
+    0, 1, 2, ...: The media files.
+    media: A JSON dictionary of {archive name: media filename}.
+
+`ApkgWriter` inserts notes and cards in bulk, a chunk at a time, so memory doesn't grow with the size of the deck. When
+it's closed, media files are streamed into the archive from where they already are, without staging copies.
+
+Each note has the fields English, Translation, Image, Audio, and Extra, and a single card that shows the image and the
+English word, and asks for the translation. Each note's GUID is derived from its deck and English word, so importing a
+newer version of a deck updates its notes instead of duplicating them.
+"""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import time
+import zipfile
+
+import anki_import_csv
+import metrics
+
+
+SCHEMA_VERSION = 11
+FIELD_NAMES = ('English', 'Translation', 'Image', 'Audio', 'Extra')
+_FIELD_SEPARATOR = u'\x1f'
+_DEFAULT_DECK_ID = 1
+_DECK_CONFIG_ID = 1
+
+_SCHEMA = """
+CREATE TABLE col (
+    id integer primary key, crt integer not null, mod integer not null, scm integer not null, ver integer not null,
+    dty integer not null, usn integer not null, ls integer not null, conf text not null, models text not null,
+    decks text not null, dconf text not null, tags text not null);
+CREATE TABLE notes (
+    id integer primary key, guid text not null, mid integer not null, mod integer not null, usn integer not null,
+    tags text not null, flds text not null, sfld integer not null, csum integer not null, flags integer not null,
+    data text not null);
+CREATE TABLE cards (
+    id integer primary key, nid integer not null, did integer not null, ord integer not null, mod integer not null,
+    usn integer not null, type integer not null, queue integer not null, due integer not null, ivl integer not null,
+    factor integer not null, reps integer not null, lapses integer not null, left integer not null,
+    odue integer not null, odid integer not null, flags integer not null, data text not null);
+CREATE TABLE revlog (
+    id integer primary key, cid integer not null, usn integer not null, ease integer not null, ivl integer not null,
+    lastIvl integer not null, factor integer not null, time integer not null, type integer not null);
+CREATE TABLE graves (usn integer not null, oid integer not null, type integer not null);
+CREATE INDEX ix_notes_usn ON notes (usn);
+CREATE INDEX ix_cards_usn ON cards (usn);
+CREATE INDEX ix_revlog_usn ON revlog (usn);
+CREATE INDEX ix_cards_nid ON cards (nid);
+CREATE INDEX ix_cards_sched ON cards (did, queue, due);
+CREATE INDEX ix_revlog_cid ON revlog (cid);
+CREATE INDEX ix_notes_csum ON notes (csum);
+"""
+
+_QUESTION_FORMAT = u'{{Image}}<div class="english">{{English}}</div>'
+_ANSWER_FORMAT = (u'{{FrontSide}}<hr id="answer"><div class="translation">{{Translation}}</div>{{Audio}}'
+                  u'<div class="extra">{{Extra}}</div>')
+_CSS = u'.card { font-family: arial; font-size: 24px; text-align: center; }\n.translation { font-size: 36px; }\n'
+
+
+def _to_unicode(value):
+    return value.decode('utf-8') if isinstance(value, str) else unicode(value)
+
+
+def _id_from(*parts):
+    """Returns a stable positive ID, derived from `parts`."""
+    return int(hashlib.sha1('\0'.join(parts)).hexdigest()[:13], 16)
+
+
+def _checksum(sort_field):
+    """Anki's checksum of a note's first field, which it uses to find duplicates."""
+    return int(hashlib.sha1(sort_field.encode('utf-8')).hexdigest()[:8], 16)
+
+
+def _deck(deck_id, name, mod):
+    return {
+        'id': deck_id, 'name': name, 'desc': '', 'mod': mod, 'usn': -1, 'conf': _DECK_CONFIG_ID, 'dyn': 0,
+        'collapsed': False, 'extendNew': 10, 'extendRev': 50, 'newToday': [0, 0], 'revToday': [0, 0],
+        'lrnToday': [0, 0], 'timeToday': [0, 0],
+    }
+
+
+def _model(model_id, deck_id, name, mod):
+    return {
+        'id': model_id, 'name': name, 'type': 0, 'mod': mod, 'usn': -1, 'did': deck_id, 'sortf': 0, 'tags': [],
+        'vers': [],
+        'flds': [{'name': field_name, 'ord': i, 'sticky': False, 'rtl': False, 'font': 'Arial', 'size': 20,
+                  'media': []} for i, field_name in enumerate(FIELD_NAMES)],
+        'tmpls': [{'name': 'Card 1', 'ord': 0, 'qfmt': _QUESTION_FORMAT, 'afmt': _ANSWER_FORMAT, 'did': None,
+                   'bqfmt': '', 'bafmt': ''}],
+        # The card is generated if either the English word or the image is non-empty.
+        'req': [[0, 'any', [FIELD_NAMES.index('English'), FIELD_NAMES.index('Image')]]],
+        'css': _CSS,
+        'latexPre': '\\documentclass[12pt]{article}\n\\special{papersize=3in,5in}\n\\usepackage[utf8]{inputenc}\n'
+                    '\\usepackage{amssymb,amsmath}\n\\pagestyle{empty}\n\\setlength{\\parindent}{0in}\n'
+                    '\\begin{document}\n',
+        'latexPost': '\\end{document}',
+    }
+
+
+_DECK_CONFIG = {
+    'id': _DECK_CONFIG_ID, 'name': 'Default', 'mod': 0, 'usn': 0, 'maxTaken': 60, 'autoplay': True, 'timer': 0,
+    'replayq': True,
+    'new': {'bury': True, 'delays': [1, 10], 'initialFactor': 2500, 'ints': [1, 4, 7], 'order': 1, 'perDay': 20,
+            'separate': True},
+    'rev': {'bury': True, 'ease4': 1.3, 'fuzz': 0.05, 'ivlFct': 1, 'maxIvl': 36500, 'minSpace': 1, 'perDay': 100},
+    'lapse': {'delays': [10], 'leechAction': 0, 'leechFails': 8, 'minInt': 1, 'mult': 0},
+}
+
+
+class ApkgWriter(object):
+    """Writes notes, and the media they refer to, to an Anki package.
+
+    Use it as a context manager, or call `close` when done. Nothing is written to `filename` until then.
+
+    Args:
+        filename: The .apkg file to write.
+        deck_name: The name of the deck the cards go in. Use '::' for subdecks.
+        chunk_size: The number of notes to insert into the database at once.
+    """
+
+    def __init__(self, filename, deck_name, chunk_size=10000):
+        self._filename = filename
+        self._chunk_size = chunk_size
+        self._deck_name = _to_unicode(deck_name)
+        self._deck_id = _id_from('deck', self._deck_name.encode('utf-8'))
+        self._model_id = _id_from('model', self._deck_name.encode('utf-8'))
+        self._now = int(time.time())
+        self._tmp_dir = tempfile.mkdtemp()
+        self._collection_filename = os.path.join(self._tmp_dir, 'collection.anki2')
+        self._connection = sqlite3.connect(self._collection_filename)
+        # The database is a build artifact that's thrown away on failure, so it doesn't need to survive a crash.
+        self._connection.execute('PRAGMA journal_mode = OFF')
+        self._connection.execute('PRAGMA synchronous = OFF')
+        self._connection.executescript(_SCHEMA)
+        self._pending_notes = []
+        self._pending_cards = []
+        self._guids = set()
+        self._media_filenames = {}
+        self._num_notes = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+    def __len__(self):
+        return self._num_notes
+
+    def add_note(self, english, translation, image_filename, audio_filename, extra_info=()):
+        """Adds a note, and its card.
+
+        Args:
+            english: The English word.
+            translation: The translated word.
+            image_filename: The full filename of the image.
+            audio_filename: The full filename of the audio.
+            extra_info: A list of anything else to show on the back of the card.
+        """
+        english = _to_unicode(english)
+        guid = u'%x' % _id_from('note', self._deck_name.encode('utf-8'), english.encode('utf-8'))
+        if guid in self._guids:
+            logging.warning('Skipping duplicate note: %s', english)
+            return
+        self._guids.add(guid)
+        fields = (
+            english,
+            _to_unicode(translation),
+            _to_unicode(anki_import_csv.JPEG_FORMAT % os.path.basename(image_filename)),
+            _to_unicode(anki_import_csv.MP3_FORMAT % os.path.basename(audio_filename)),
+            u'<br>'.join(_to_unicode(info) for info in extra_info if info),
+        )
+        for filename in (image_filename, audio_filename):
+            self._media_filenames.setdefault(os.path.basename(filename), filename)
+        self._num_notes += 1
+        # Anki uses IDs as creation times, in milliseconds.
+        note_id = self._now * 1000 + self._num_notes
+        self._pending_notes.append((
+            note_id, guid, self._model_id, self._now, -1, u'', _FIELD_SEPARATOR.join(fields), english,
+            _checksum(english), 0, u''))
+        # New cards are shown in the order they were added.
+        self._pending_cards.append((
+            note_id, note_id, self._deck_id, 0, self._now, -1, 0, 0, self._num_notes, 0, 0, 0, 0, 0, 0, 0, 0, u''))
+        if len(self._pending_notes) >= self._chunk_size:
+            self._flush()
+
+    def _flush(self):
+        with metrics.timer('apkg_insert'):
+            with self._connection:
+                self._connection.executemany('INSERT INTO notes VALUES (?,?,?,?,?,?,?,?,?,?,?)', self._pending_notes)
+                self._connection.executemany(
+                    'INSERT INTO cards VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)', self._pending_cards)
+        self._pending_notes = []
+        self._pending_cards = []
+
+    def _write_collection(self):
+        mod_millis = self._now * 1000
+        decks = {
+            str(_DEFAULT_DECK_ID): _deck(_DEFAULT_DECK_ID, 'Default', self._now),
+            str(self._deck_id): _deck(self._deck_id, self._deck_name, self._now),
+        }
+        models = {str(self._model_id): _model(self._model_id, self._deck_id, self._deck_name, self._now)}
+        conf = {
+            'activeDecks': [self._deck_id], 'curDeck': self._deck_id, 'curModel': str(self._model_id), 'nextPos':
+            self._num_notes + 1, 'newSpread': 0, 'collapseTime': 1200, 'timeLim': 0, 'estTimes': True,
+            'dueCounts': True, 'sortType': 'noteFld', 'sortBackwards': False, 'addToCur': True,
+        }
+        with self._connection:
+            self._connection.execute('INSERT INTO col VALUES (1,?,?,?,?,0,0,0,?,?,?,?,?)', (
+                self._now, mod_millis, mod_millis, SCHEMA_VERSION, json.dumps(conf), json.dumps(models),
+                json.dumps(decks), json.dumps({str(_DECK_CONFIG_ID): _DECK_CONFIG}), '{}'))
+        self._connection.close()
+
+    def close(self):
+        """Writes the package."""
+        temp_filename = self._filename + '.tmp'
+        media_map = {}
+        try:
+            self._flush()
+            self._write_collection()
+            with metrics.timer('apkg_zip'):
+                with zipfile.ZipFile(temp_filename, 'w', zipfile.ZIP_STORED, allowZip64=True) as package:
+                    package.write(self._collection_filename, 'collection.anki2', zipfile.ZIP_DEFLATED)
+                    for basename, filename in sorted(self._media_filenames.items()):
+                        if not os.path.isfile(filename):
+                            logging.warning('Leaving %s out of the package, since it doesn\'t exist.', filename)
+                            continue
+                        # Images and MP3s are already compressed, so they're stored as they are.
+                        package.write(filename, str(len(media_map)))
+                        media_map[str(len(media_map))] = _to_unicode(basename)
+                    package.writestr('media', json.dumps(media_map), zipfile.ZIP_DEFLATED)
+            os.rename(temp_filename, self._filename)
+        except:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+            raise
+        finally:
+            self.discard()
+        logging.info('Wrote %i notes and %i media files to %s.', self._num_notes, len(media_map), self._filename)
+
+    def discard(self):
+        """Throws away the notes added so far, without writing the package."""
+        try:
+            self._connection.close()
+        except sqlite3.ProgrammingError:
+            pass
+        shutil.rmtree(self._tmp_dir, ignore_errors=True)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""Test apkg writer module."""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import zipfile
+
+import apkg_writer
+
+
+class TestApkgWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _media_file(self, basename, contents):
+        filename = os.path.join(self.tmp_dir, basename)
+        with open(filename, 'wb') as f:
+            f.write(contents)
+        return filename
+
+    def test_write_package(self):
+        water_image = self._media_file('water.png', 'water image')
+        shared_audio = self._media_file('מים.mp3', 'audio')
+        apkg_filename = os.path.join(self.tmp_dir, 'deck.apkg')
+        with apkg_writer.ApkgWriter(apkg_filename, 'Hebrew::Nouns', chunk_size=2) as package:
+            package.add_note('water', 'מים', water_image, shared_audio, ['מַיִם'])
+            package.add_note('fire', 'אש', os.path.join(self.tmp_dir, 'missing.png'), shared_audio)
+            package.add_note('earth', 'אדמה', water_image, shared_audio)
+            package.add_note('water', 'מים', water_image, shared_audio)
+        self.assertEqual(3, len(package))
+        self.assertFalse(os.path.exists(apkg_filename + '.tmp'))
+
+        with zipfile.ZipFile(apkg_filename) as archive:
+            media = json.loads(archive.read('media'))
+            # Each distinct media file is stored once, and missing files are left out.
+            self.assertEqual(sorted([u'water.png', u'מים.mp3']), sorted(media.values()))
+            for archive_name, basename in media.items():
+                with open(os.path.join(self.tmp_dir, basename.encode('utf-8')), 'rb') as f:
+                    self.assertEqual(f.read(), archive.read(archive_name))
+            collection_filename = os.path.join(self.tmp_dir, 'collection.anki2')
+            with open(collection_filename, 'wb') as f:
+                f.write(archive.read('collection.anki2'))
+
+        connection = sqlite3.connect(collection_filename)
+        ver, decks, models = connection.execute('SELECT ver, decks, models FROM col').fetchone()
+        self.assertEqual(11, ver)
+        self.assertIn(u'Hebrew::Nouns', [deck['name'] for deck in json.loads(decks).values()])
+        model, = json.loads(models).values()
+        self.assertEqual(list(apkg_writer.FIELD_NAMES), [field['name'] for field in model['flds']])
+        notes = connection.execute('SELECT id, flds, sfld FROM notes ORDER BY id').fetchall()
+        self.assertEqual([u'water', u'fire', u'earth'], [sfld for _, _, sfld in notes])
+        self.assertEqual(u'water\x1fמים\x1f<img src="water.png">\x1f[sound:מים.mp3]\x1fמַיִם'.split(u'\x1f'),
+                         notes[0][1].split(u'\x1f'))
+        cards = connection.execute('SELECT nid, did, due FROM cards ORDER BY due').fetchall()
+        self.assertEqual([note_id for note_id, _, _ in notes], [nid for nid, _, _ in cards])
+        self.assertEqual([1, 2, 3], [due for _, _, due in cards])
+        connection.close()
+
+    def test_guids_are_stable(self):
+        guids = []
+        for i in xrange(2):
+            apkg_filename = os.path.join(self.tmp_dir, 'deck%i.apkg' % i)
+            with apkg_writer.ApkgWriter(apkg_filename, 'Deck') as package:
+                package.add_note('water', 'mayim', 'water.png', 'mayim.mp3')
+            collection_filename = os.path.join(self.tmp_dir, 'collection%i.anki2' % i)
+            with zipfile.ZipFile(apkg_filename) as archive, open(collection_filename, 'wb') as f:
+                f.write(archive.read('collection.anki2'))
+            connection = sqlite3.connect(collection_filename)
+            guids.append(connection.execute('SELECT guid FROM notes').fetchone()[0])
+            connection.close()
+        self.assertEqual(guids[0], guids[1])
+
+    def test_nothing_is_written_on_error(self):
+        apkg_filename = os.path.join(self.tmp_dir, 'deck.apkg')
+        with self.assertRaises(ValueError):
+            with apkg_writer.ApkgWriter(apkg_filename, 'Deck') as package:
+                package.add_note('water', 'mayim', 'water.png', 'mayim.mp3')
+                raise ValueError()
+        self.assertFalse(os.path.exists(apkg_filename))
+
+
+if __name__ == '__main__':
+    unittest.main()
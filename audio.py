@@ -9,15 +9,29 @@ TODO(joelshor): Add support for Google TTS.
 __author__ = 'shor.joel@gmail.com (Joel Shor)'
 
 
+import httplib
 import logging
 import os
-import shutil
-import urllib
+import Queue
+import sys
+import threading
 
+import bulk_copy
+import download_utils
 import forvo_utils
+import metrics
 
 
-def get_audio(filenames_to_write_imgs, credentials, method='Forvo'):
+# How audio is named in a directory of already downloaded media, with one spot for the translated word.
+DOWNLOADED_FILENAME_FORMAT = 'pronunciation_he_%s.mp3'
+
+
+def downloaded_filename_format(language='he'):
+    """Like `DOWNLOADED_FILENAME_FORMAT`, for audio in the Forvo language `language`."""
+    return 'pronunciation_%s_%%s.mp3' % language
+
+
+def get_audio(filenames_to_write_imgs, credentials, method='Forvo', **kwargs):
     """Fetch audio from the web.
 
     Args:
@@ -25,42 +39,176 @@ def get_audio(filenames_to_write_imgs, credentials, method='Forvo'):
         credentials: A credentials object.
         method: A string describing how to fetch audio. It's basically a switch
             between entirely different codepathes.
+        **kwargs: Extra keyword arguments for the chosen method.
 
     Returns:
         A list of words for which audio fetching didn't work.
     """
     return {
         'Forvo': get_audio_from_forvo,
-    }[method](filenames_to_write_imgs, credentials)
+        'ForvoPipelined': get_audio_from_forvo_pipelined,
+    }[method](filenames_to_write_imgs, credentials, **kwargs)
+
+
+def _download_from_forvo(word, mp3_link, destination_fn, credentials, mp3_link_cache, session, language):
+    """Downloads the audio of `word` from `mp3_link`, and returns whether there was any.
+
+    Links from `mp3_link_cache` may have expired since they were cached. If the download fails, this forgets the cached
+    link, looks the word up on Forvo again, and downloads from the new link.
+    """
+    try:
+        with metrics.timer('audio_download'):
+            session.download_to_file(mp3_link, destination_fn)
+        return True
+    except (IOError, httplib.HTTPException) as e:
+        if mp3_link_cache is None:
+            raise
+        logging.warning('Couldn\'t download the audio for `%s`, so looking it up again: %s' % (word, e))
+    mp3_link_cache.forget(word, language)
+    mp3_link = forvo_utils.get_mp3_link(word, credentials.audio.forvoAPIKey, language=language, cache=mp3_link_cache)
+    if not mp3_link:
+        return False
+    with metrics.timer('audio_download'):
+        session.download_to_file(mp3_link, destination_fn)
+    return True
 
 
-def get_audio_from_forvo(filenames_to_write_imgs, credentials):
-    """Fetch audio from Forvo online word dictionary."""
+def get_audio_from_forvo(filenames_to_write_imgs, credentials, mp3_link_cache=None, session=None, language='he'):
+    """Fetch audio from Forvo online word dictionary.
+
+    If `mp3_link_cache` is a `forvo_utils.Mp3LinkCache`, it's used to avoid repeating Forvo lookups. Downloads use
+    `session`, or the shared `download_utils.HttpSession` by default. `language` is Forvo's code for the language of
+    the words.
+    """
+    session = session or download_utils.get_session()
     words_without_audio = []
     for word, destination_fn in filenames_to_write_imgs.items():
-        mp3_link = forvo_utils.get_mp3_link(word, credentials.audio.forvoAPIKey)
-        if mp3_link:
-            urllib.urlretrieve(mp3_link, destination_fn)
-        else:
+        mp3_link = forvo_utils.get_mp3_link(
+            word, credentials.audio.forvoAPIKey, language=language, cache=mp3_link_cache)
+        if not mp3_link or not _download_from_forvo(
+                word, mp3_link, destination_fn, credentials, mp3_link_cache, session, language):
             logging.warning('Couldn\'t find audio on Forvo for `%s`.' % word)
             words_without_audio.append(word)
     return words_without_audio
 
 
-def copy_audio_from_disk(filenames_to_write_auds, media_dir, filename_regexp="pronunciation_he_%s.mp3"):
+def get_audio_from_forvo_pipelined(filenames_to_write_auds, credentials, num_lookup_workers=4,
+                                   num_download_workers=4, queue_size=16, mp3_link_cache=None, session=None,
+                                   language='he'):
+    """Fetch audio from Forvo, overlapping link lookups and MP3 downloads.
+
+    Lookup threads query Forvo for the MP3 link of each word and feed a bounded queue. Download threads drain the queue
+    and write the MP3s to disk. The bound keeps lookups from running arbitrarily far ahead of downloads.
+
+    Args:
+        filenames_to_write_auds: A dictionary of {translated word: full filename to copy audio to}.
+        credentials: A credentials object.
+        num_lookup_workers: The number of simultaneous Forvo lookups.
+        num_download_workers: The number of simultaneous MP3 downloads.
+        queue_size: The maximum number of links waiting to be downloaded.
+        mp3_link_cache: An optional `forvo_utils.Mp3LinkCache`, used to avoid repeating Forvo lookups.
+        session: The `download_utils.HttpSession` to download with, which also limits connections per host. Defaults
+            to the shared session.
+        language: Forvo's code for the language of the words.
+
+    Returns:
+        A list of words for which audio fetching didn't work.
+
+    Raises:
+        The first exception raised by a lookup or download, after all threads have stopped.
+    """
+    words_to_look_up = Queue.Queue()
+    for word_and_destination_fn in filenames_to_write_auds.items():
+        words_to_look_up.put(word_and_destination_fn)
+    links_to_download = Queue.Queue(maxsize=queue_size)
+    session = session or download_utils.get_session()
+
+    words_without_audio = []
+    errors = []
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def _record_error():
+        with lock:
+            errors.append(sys.exc_info())
+        stop.set()
+
+    def _lookup_worker():
+        while not stop.is_set():
+            try:
+                word, destination_fn = words_to_look_up.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                mp3_link = forvo_utils.get_mp3_link(
+                    word, credentials.audio.forvoAPIKey, language=language, cache=mp3_link_cache)
+            except Exception:
+                _record_error()
+                return
+            if mp3_link:
+                links_to_download.put((word, mp3_link, destination_fn))
+            else:
+                logging.warning('Couldn\'t find audio on Forvo for `%s`.' % word)
+                with lock:
+                    words_without_audio.append(word)
+
+    def _download_worker():
+        while True:
+            item = links_to_download.get()
+            if item is None:
+                return
+            if stop.is_set():
+                # Keep draining the queue so that lookup threads never block on a full queue.
+                continue
+            word, mp3_link, destination_fn = item
+            try:
+                has_audio = _download_from_forvo(
+                    word, mp3_link, destination_fn, credentials, mp3_link_cache, session, language)
+            except Exception:
+                _record_error()
+                continue
+            if not has_audio:
+                logging.warning('Couldn\'t find audio on Forvo for `%s`.' % word)
+                with lock:
+                    words_without_audio.append(word)
+
+    lookup_threads = [threading.Thread(target=_lookup_worker) for _ in xrange(num_lookup_workers)]
+    download_threads = [threading.Thread(target=_download_worker) for _ in xrange(num_download_workers)]
+    for thread in lookup_threads + download_threads:
+        thread.daemon = True
+        thread.start()
+    for thread in lookup_threads:
+        thread.join()
+    for _ in download_threads:
+        links_to_download.put(None)
+    for thread in download_threads:
+        thread.join()
+
+    if errors:
+        exc_type, exc_value, exc_traceback = errors[0]
+        raise exc_type, exc_value, exc_traceback
+    return words_without_audio
+
+
+def copy_audio_from_disk(filenames_to_write_auds, media_dir, filename_regexp=DOWNLOADED_FILENAME_FORMAT,
+                         num_workers=8, methods=bulk_copy.METHODS):
     """Copies audio from one directory to another.
 
     Args:
         filenames_to_write_imgs: A dictionary of {English word: full filename to copy audio to}.
         media_dir: The location on disk we expect to find the files.
         filename_regexp: The expected filename, with one spot for the word.
+        num_workers: The number of files to copy at once.
+        methods: The ways to copy each file, in order of preference. See `bulk_copy.py`.
 
     Raises:
         ValueError: If any audio file doesn't exist.
     """
+    sources_and_destinations = []
     for word, target_location in filenames_to_write_auds.items():
         existing_filename = os.path.join(media_dir, filename_regexp % word)
         if not os.path.exists(existing_filename):
             raise ValueError("Word %s was expecting audio file %s, but it didn't "
                              "exist." % (word, existing_filename))
-        shutil.copyfile(existing_filename, target_location)
\ No newline at end of file
+        sources_and_destinations.append((existing_filename, target_location))
+    bulk_copy.copy_files(sources_and_destinations, num_workers=num_workers, methods=methods)
\ No newline at end of file
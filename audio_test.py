@@ -5,9 +5,19 @@ __author__ = 'shor.joel@gmail.com (Joel Shor)'
 
 import unittest
 import os
+import shutil
 import tempfile
 
 import audio
+from credentials import credentials
+import forvo_utils
+
+
+class _FakeSession(object):
+    """Stands in for `download_utils.HttpSession`, treating URLs as local filenames."""
+
+    def download_to_file(self, url, destination_fn):
+        shutil.copyfile(url, destination_fn)
 
 
 class TestAudio(unittest.TestCase):
@@ -29,6 +39,52 @@ class TestAudio(unittest.TestCase):
         for filename in filenames_to_write_auds.values():
             self.assertTrue(os.path.exists(filename))
 
+    def test_get_audio_from_forvo_pipelined(self):
+        def _fake_get_mp3_link(word, api_key, language='he', cache=None):
+            if word == 'word3':
+                return None
+            return os.path.join(self.dir_path, 'testdata', 'test_audio_%s.mp3' % word)
+        real_get_mp3_link = forvo_utils.get_mp3_link
+        forvo_utils.get_mp3_link = _fake_get_mp3_link
+        try:
+            filenames_to_write_auds = {
+                'word1': tempfile.mktemp(),
+                'word2': tempfile.mktemp(),
+                'word3': tempfile.mktemp(),
+            }
+            words_without_audio = audio.get_audio(
+                filenames_to_write_auds, credentials, method='ForvoPipelined', num_download_workers=2,
+                queue_size=1, session=_FakeSession())
+        finally:
+            forvo_utils.get_mp3_link = real_get_mp3_link
+        self.assertListEqual(['word3'], words_without_audio)
+        self.assertTrue(os.path.exists(filenames_to_write_auds['word1']))
+        self.assertTrue(os.path.exists(filenames_to_write_auds['word2']))
+
+    def test_get_audio_from_forvo_looks_up_expired_links_again(self):
+        fresh_link = os.path.join(self.dir_path, 'testdata', 'test_audio_word1.mp3')
+        lookups = []
+        def _fake_get_forvo_xml(word, api_key, language='he'):
+            lookups.append(word)
+            return '<items><item><pathmp3>%s</pathmp3><rate>1</rate></item></items>' % fresh_link
+        real_get_forvo_xml = forvo_utils._get_forvo_xml
+        forvo_utils._get_forvo_xml = _fake_get_forvo_xml
+        try:
+            for method in ('Forvo', 'ForvoPipelined'):
+                del lookups[:]
+                cache = forvo_utils.Mp3LinkCache(os.path.join(tempfile.mkdtemp(), 'forvo.sqlite'))
+                cache.set('word1', 'he', os.path.join(tempfile.mkdtemp(), 'expired.mp3'))
+                destination_fn = tempfile.mktemp()
+                words_without_audio = audio.get_audio(
+                    {'word1': destination_fn}, credentials, method=method, mp3_link_cache=cache,
+                    session=_FakeSession())
+                self.assertListEqual([], words_without_audio)
+                self.assertListEqual(['word1'], lookups)
+                self.assertTrue(os.path.exists(destination_fn))
+                self.assertEqual(fresh_link, cache.get('word1', 'he'))
+        finally:
+            forvo_utils._get_forvo_xml = real_get_forvo_xml
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,180 @@
+"""Fast copying of many media files at once.
+
+Importing a library of already downloaded media can mean copying tens of thousands of files. `copy_files` copies
+them with several threads, skips files whose destination already has the same size and modification time, and avoids
+copying bytes through Python where it can. Each file is copied with the first of these methods that works:
+
+    hardlink: Links the destination to the source, so nothing is copied. Nothing in this program edits media in place
+        (resizing and cleaning replace the file), but other programs might, which is why this can be turned off.
+    reflink: Clones the source on filesystems that support copy-on-write, like Btrfs and XFS.
+    copy_file_range, sendfile: Copy inside the kernel. They're only available in Python 3.
+    copy: Copies through a large buffer.
+
+When a method fails because the filesystems don't support it, it isn't tried again for files between the same pair of
+devices. When it fails because of the file, like a hardlink to a file that has too many links already, only that file
+falls back to the next method. Copies are written to a temporary file and renamed, so a destination is never left half-written, and they keep
+the source's modification time so that a later import can skip them.
+"""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+import errno
+import logging
+import os
+import shutil
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+import download_utils
+import metrics
+
+
+METHODS = ('hardlink', 'reflink', 'copy_file_range', 'sendfile', 'copy')
+# The `FICLONE` ioctl from <linux/fs.h>.
+_FICLONE = 0x40049409
+_COPY_BUFFER_BYTES = 1024 * 1024
+# Errors that mean a method doesn't work between two filesystems, rather than that something went wrong.
+_UNSUPPORTED_ERRNOS = frozenset(
+    getattr(errno, name) for name in ('EXDEV', 'EPERM', 'EOPNOTSUPP', 'ENOTSUP', 'EINVAL', 'ENOTTY', 'ENOSYS')
+    if hasattr(errno, name))
+# Errors that mean a method doesn't work for one file, like a source that has too many hard links already.
+_FILE_UNSUPPORTED_ERRNOS = frozenset([errno.EMLINK])
+
+_unsupported = set()
+_unsupported_lock = threading.Lock()
+
+
+def _is_up_to_date(source_stat, destination):
+    try:
+        destination_stat = os.stat(destination)
+    except OSError:
+        return False
+    # Compare whole seconds, since not every filesystem stores finer modification times.
+    return (destination_stat.st_size == source_stat.st_size and
+            int(destination_stat.st_mtime) == int(source_stat.st_mtime))
+
+
+def _hardlink(source, temp_destination):
+    os.link(source, temp_destination)
+
+
+def _reflink(source, temp_destination):
+    if fcntl is None:
+        raise OSError(errno.ENOSYS, 'Reflinks need `fcntl`.')
+    with open(source, 'rb') as source_file, open(temp_destination, 'wb') as destination_file:
+        fcntl.ioctl(destination_file.fileno(), _FICLONE, source_file.fileno())
+
+
+def _copy_in_kernel(copy_fn, source, temp_destination):
+    size = os.path.getsize(source)
+    with open(source, 'rb') as source_file, open(temp_destination, 'wb') as destination_file:
+        offset = 0
+        while offset < size:
+            num_copied = copy_fn(source_file.fileno(), destination_file.fileno(), offset, size - offset)
+            if num_copied == 0:
+                break
+            offset += num_copied
+
+
+def _copy_file_range(source, temp_destination):
+    if not hasattr(os, 'copy_file_range'):
+        raise OSError(errno.ENOSYS, '`os.copy_file_range` needs Python 3.8.')
+    _copy_in_kernel(lambda in_fd, out_fd, offset, count: os.copy_file_range(in_fd, out_fd, count, offset),
+                    source, temp_destination)
+
+
+def _sendfile(source, temp_destination):
+    if not hasattr(os, 'sendfile'):
+        raise OSError(errno.ENOSYS, '`os.sendfile` needs Python 3.')
+    _copy_in_kernel(lambda in_fd, out_fd, offset, count: os.sendfile(out_fd, in_fd, offset, count),
+                    source, temp_destination)
+
+
+def _copy(source, temp_destination):
+    with open(source, 'rb') as source_file, open(temp_destination, 'wb') as destination_file:
+        shutil.copyfileobj(source_file, destination_file, _COPY_BUFFER_BYTES)
+
+
+_COPY_FNS = {
+    'hardlink': _hardlink,
+    'reflink': _reflink,
+    'copy_file_range': _copy_file_range,
+    'sendfile': _sendfile,
+    'copy': _copy,
+}
+
+
+def copy_file(source, destination, methods=METHODS):
+    """Copies `source` to `destination`, unless it's already there.
+
+    Args:
+        source: The file to copy.
+        destination: Where to copy it to. It's replaced if it exists.
+        methods: The methods to try, in order. See the module docstring.
+
+    Returns:
+        The method that was used, or `None` if `destination` was already up to date.
+
+    Raises:
+        ValueError: If `methods` has an unknown method.
+        IOError, OSError: If no method worked.
+    """
+    unknown_methods = set(methods) - set(METHODS)
+    if unknown_methods:
+        raise ValueError('Unknown copy methods: %s' % sorted(unknown_methods))
+    source_stat = os.stat(source)
+    if _is_up_to_date(source_stat, destination):
+        metrics.increment('file_copies_skipped')
+        return None
+    devices = (source_stat.st_dev, os.stat(os.path.dirname(os.path.abspath(destination))).st_dev)
+    temp_destination = destination + '.aeag-copy'
+    error = None
+    for method in methods:
+        with _unsupported_lock:
+            if (method, devices) in _unsupported:
+                continue
+        if os.path.exists(temp_destination):
+            os.remove(temp_destination)
+        try:
+            with metrics.timer('file_copy'):
+                _COPY_FNS[method](source, temp_destination)
+                if method != 'hardlink':
+                    os.utime(temp_destination, (source_stat.st_atime, source_stat.st_mtime))
+                os.rename(temp_destination, destination)
+        except (IOError, OSError) as e:
+            if os.path.exists(temp_destination):
+                os.remove(temp_destination)
+            if e.errno in _FILE_UNSUPPORTED_ERRNOS:
+                logging.info('Can\'t %s %s to %s: %s', method, source, destination, e)
+            elif e.errno in _UNSUPPORTED_ERRNOS:
+                logging.info('Can\'t %s %s to %s, so not trying it again between these devices: %s', method, source,
+                             destination, e)
+                with _unsupported_lock:
+                    _unsupported.add((method, devices))
+            else:
+                raise
+            error = e
+            continue
+        metrics.increment('file_copies', method=method)
+        return method
+    raise error or IOError('No copy method was left to try for %s.' % source)
+
+
+def copy_files(sources_and_destinations, num_workers=8, methods=METHODS):
+    """Copies many files at once. See `copy_file`.
+
+    Args:
+        sources_and_destinations: A list of (source, destination) pairs.
+        num_workers: The number of files to copy at once.
+        methods: The methods to try for each file, in order.
+
+    Returns:
+        The method used for each file, in order, or `None` for files that were already up to date.
+    """
+    return download_utils.map_in_parallel(
+        lambda pair: copy_file(pair[0], pair[1], methods), sources_and_destinations, num_workers)
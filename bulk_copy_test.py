@@ -0,0 +1,78 @@
+"""Test bulk copy module."""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+import errno
+import os
+import shutil
+import tempfile
+import unittest
+
+import bulk_copy
+
+
+class TestBulkCopy(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.sources_and_destinations = []
+        for i in xrange(5):
+            source = os.path.join(self.tmp_dir, 'source_%i.mp3' % i)
+            with open(source, 'wb') as f:
+                f.write('audio %i' % i * 1000)
+            os.utime(source, (1000000000, 1000000000 + i))
+            self.sources_and_destinations.append((source, os.path.join(self.tmp_dir, 'destination_%i.mp3' % i)))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _assert_copied(self):
+        for source, destination in self.sources_and_destinations:
+            with open(source, 'rb') as source_file, open(destination, 'rb') as destination_file:
+                self.assertEqual(source_file.read(), destination_file.read())
+            self.assertEqual(int(os.path.getmtime(source)), int(os.path.getmtime(destination)))
+        self.assertFalse([filename for filename in os.listdir(self.tmp_dir) if filename.endswith('.aeag-copy')])
+
+    def test_each_method(self):
+        for method in bulk_copy.METHODS:
+            for _, destination in self.sources_and_destinations:
+                if os.path.exists(destination):
+                    os.remove(destination)
+            # Not every filesystem or Python supports every method, but `copy` always works.
+            methods_used = bulk_copy.copy_files(self.sources_and_destinations, num_workers=2,
+                                                methods=(method, 'copy'))
+            self.assertTrue(all(used in (method, 'copy') for used in methods_used))
+            self._assert_copied()
+
+    def test_skips_up_to_date_files(self):
+        bulk_copy.copy_files(self.sources_and_destinations, methods=('copy',))
+        source, destination = self.sources_and_destinations[0]
+        with open(source, 'wb') as f:
+            f.write('changed')
+        self.assertEqual(['copy', None, None, None, None],
+                         bulk_copy.copy_files(self.sources_and_destinations, methods=('copy',)))
+        self._assert_copied()
+
+    def test_too_many_links_only_falls_back_for_that_file(self):
+        real_hardlink = bulk_copy._COPY_FNS['hardlink']
+        def _hardlink(source, temp_destination):
+            if source == self.sources_and_destinations[0][0]:
+                raise OSError(errno.EMLINK, 'Too many links')
+            real_hardlink(source, temp_destination)
+        bulk_copy._COPY_FNS['hardlink'] = _hardlink
+        try:
+            self.assertEqual(['copy', 'hardlink', 'hardlink', 'hardlink', 'hardlink'],
+                             bulk_copy.copy_files(self.sources_and_destinations, num_workers=1,
+                                                  methods=('hardlink', 'copy')))
+        finally:
+            bulk_copy._COPY_FNS['hardlink'] = real_hardlink
+        self._assert_copied()
+
+    def test_unknown_method(self):
+        with self.assertRaises(ValueError):
+            bulk_copy.copy_file(*self.sources_and_destinations[0], methods=('teleport',))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+"""A small persistent key-value cache, backed by SQLite.
+
+Keys are tuples of strings, and values are anything that can be serialized to JSON. Entries can optionally expire
+after a time-to-live. When the cache holds more than `max_entries` entries, the least recently used ones are evicted.
+
+The cache can be shared between threads.
+"""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+# SQLite limits the number of parameters in a single query, so large lookups are split into chunks of this size.
+_MAX_PARAMS_PER_QUERY = 500
+
+
+class DiskCache(object):
+    """A persistent, size-bounded key-value cache.
+
+    Args:
+        path: The SQLite file to store the cache in. Parent directories are created if needed.
+        max_entries: The maximum number of entries to keep, or `None` for no limit.
+    """
+
+    def __init__(self, path, max_entries=None):
+        if max_entries is not None and max_entries < 1:
+            raise ValueError('`max_entries` must be at least 1. Instead, was %i' % max_entries)
+        dirname = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                'CREATE TABLE IF NOT EXISTS cache ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, last_access REAL NOT NULL, expires_at REAL)')
+            self._connection.execute('CREATE INDEX IF NOT EXISTS cache_last_access ON cache (last_access)')
+            # Caches written before entries could expire don't have an `expires_at` column.
+            columns = [row[1] for row in self._connection.execute('PRAGMA table_info(cache)')]
+            if 'expires_at' not in columns:
+                self._connection.execute('ALTER TABLE cache ADD COLUMN expires_at REAL')
+
+    @staticmethod
+    def _encode_key(key):
+        return json.dumps(list(key))
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def get_many(self, keys):
+        """Looks up many keys at once.
+
+        Args:
+            keys: A list of keys.
+
+        Returns:
+            A dictionary of {key: value} for the keys that were found and haven't expired.
+        """
+        encoded_keys = {self._encode_key(key): key for key in keys}
+        encoded_key_list = encoded_keys.keys()
+        found = {}
+        now = time.time()
+        with self._lock:
+            for i in xrange(0, len(encoded_key_list), _MAX_PARAMS_PER_QUERY):
+                chunk = encoded_key_list[i: i + _MAX_PARAMS_PER_QUERY]
+                rows = self._connection.execute(
+                    'SELECT key, value FROM cache WHERE key IN (%s) AND (expires_at IS NULL OR expires_at > ?)' %
+                    ','.join('?' * len(chunk)), chunk + [now])
+                for encoded_key, value in rows:
+                    found[encoded_key] = json.loads(value)
+            if found:
+                with self._connection:
+                    self._connection.executemany(
+                        'UPDATE cache SET last_access = ? WHERE key = ?', [(now, k) for k in found])
+        return {encoded_keys[k]: v for k, v in found.items()}
+
+    def set(self, key, value, ttl_secs=None):
+        self.set_many({key: value}, ttl_secs=ttl_secs)
+
+    def set_many(self, items, ttl_secs=None):
+        """Stores many {key: value} pairs at once, then evicts the least recently used entries if needed.
+
+        Args:
+            items: A dictionary of {key: value}.
+            ttl_secs: If not `None`, the entries expire this many seconds from now.
+        """
+        now = time.time()
+        expires_at = None if ttl_secs is None else now + ttl_secs
+        rows = [(self._encode_key(key), json.dumps(value), now, expires_at) for key, value in items.items()]
+        with self._lock:
+            with self._connection:
+                self._connection.executemany(
+                    'INSERT OR REPLACE INTO cache (key, value, last_access, expires_at) VALUES (?, ?, ?, ?)', rows)
+                if self._max_entries is not None:
+                    self._connection.execute(
+                        'DELETE FROM cache WHERE key IN '
+                        '(SELECT key FROM cache ORDER BY last_access DESC LIMIT -1 OFFSET ?)', (self._max_entries,))
+
+    def delete(self, key):
+        with self._lock:
+            with self._connection:
+                self._connection.execute('DELETE FROM cache WHERE key = ?', (self._encode_key(key),))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,53 @@
+"""Test disk cache module."""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+import os
+import tempfile
+import unittest
+
+import disk_cache
+
+
+class TestDiskCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_path = os.path.join(tempfile.mkdtemp(), 'subdir', 'cache.sqlite')
+
+    def test_get_and_set(self):
+        cache = disk_cache.DiskCache(self.cache_path)
+        cache.set_many({('en', 'es', 'water'): 'agua', ('en', 'es', 'fire'): 'fuego'})
+        self.assertEqual('agua', cache.get(('en', 'es', 'water')))
+        self.assertIsNone(cache.get(('en', 'es', 'earth')))
+        self.assertDictEqual(
+            {('en', 'es', 'fire'): 'fuego'},
+            cache.get_many([('en', 'es', 'fire'), ('en', 'es', 'earth')]))
+        cache.delete(('en', 'es', 'water'))
+        self.assertIsNone(cache.get(('en', 'es', 'water')))
+        cache.close()
+
+        # Entries persist between instances.
+        self.assertEqual(1, len(disk_cache.DiskCache(self.cache_path)))
+
+    def test_evicts_least_recently_used(self):
+        cache = disk_cache.DiskCache(self.cache_path, max_entries=2)
+        cache.set(('a',), 1)
+        cache.set(('b',), 2)
+        cache.get(('a',))
+        cache.set(('c',), 3)
+        self.assertEqual(2, len(cache))
+        self.assertIsNone(cache.get(('b',)))
+        self.assertEqual(1, cache.get(('a',)))
+        self.assertEqual(3, cache.get(('c',)))
+
+    def test_expired_entries_are_ignored(self):
+        cache = disk_cache.DiskCache(self.cache_path)
+        cache.set(('fresh',), 1, ttl_secs=60)
+        cache.set(('stale',), None, ttl_secs=-1)
+        self.assertEqual(1, cache.get(('fresh',)))
+        self.assertDictEqual({}, cache.get_many([('stale',)]))
+
+
+if __name__ == '__main__':
+    unittest.main()
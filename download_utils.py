@@ -0,0 +1,351 @@
+"""Utilities for downloading media from the web.
+
+`HttpSession` is the transport layer for all media and API downloads. It keeps connections alive between requests to
+the same host, so that each request doesn't pay for a new TCP connection and TLS handshake, and it streams downloads
+straight to disk. `get_session` returns the session shared by the whole program.
+
+`map_in_parallel` runs a function over a list of inputs with a bounded number of worker threads. Fetching media is
+almost entirely network-bound, so threads (rather than processes) are enough to keep many requests in flight.
+`map_in_processes` does the same with worker processes, for the CPU-bound work on fetched media.
+
+`HostConnectionLimiter` caps the number of simultaneous connections to any single host, so that fetching many files at
+once doesn't hammer one server.
+"""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+import contextlib
+import httplib
+import logging
+import multiprocessing
+import os
+import socket
+import threading
+import urllib
+import urlparse
+from multiprocessing.pool import ThreadPool
+
+import metrics
+
+
+# `Pool.map` blocks in a way that can't be interrupted with Ctrl-C in Python 2. Waiting on the async result with a
+# timeout avoids that.
+_MAX_WAIT_SECS = 60 * 60 * 24 * 7
+
+_REDIRECT_STATUSES = (301, 302, 303, 307, 308)
+_USER_AGENT = 'AEAG/1.0'
+# Characters that are left as they are when percent-encoding URLs, including existing percent-escapes.
+_URL_SAFE_CHARS = "/%:@&=+$,;~!*'()?"
+
+_default_session = None
+_default_session_lock = threading.Lock()
+
+
+class HttpError(IOError):
+    """Raised when a server responds with an error status."""
+
+    def __init__(self, url, status, reason):
+        super(HttpError, self).__init__('HTTP %i (%s) for %s' % (status, reason, url))
+        self.url = url
+        self.status = status
+
+
+class DownloadRejectedError(IOError):
+    """Raised when a download is abandoned because its content failed a check."""
+
+
+class DownloadCancelledError(IOError):
+    """Raised when a download is abandoned because it was cancelled by another thread."""
+
+
+class CancelEvent(object):
+    """A flag for abandoning downloads, like a `threading.Event`.
+
+    Setting it also shuts down the connections of the requests that use it, so that a request waiting on a slow host
+    stops right away, instead of holding on to its connection and its slot in `HostConnectionLimiter` until it times
+    out. A request that's still connecting stops once it's connected.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._connections = set()
+
+    def is_set(self):
+        return self._event.is_set()
+
+    def set(self):
+        with self._lock:
+            self._event.set()
+            connections = list(self._connections)
+        for connection in connections:
+            sock = connection.sock
+            if sock is not None:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass  # already closed
+
+    def _add_connection(self, connection):
+        with self._lock:
+            self._connections.add(connection)
+
+    def _discard_connection(self, connection):
+        with self._lock:
+            self._connections.discard(connection)
+
+
+class HostConnectionLimiter(object):
+    """Limits the number of concurrent connections to each host."""
+
+    def __init__(self, max_connections_per_host=2):
+        if max_connections_per_host < 1:
+            raise ValueError('`max_connections_per_host` must be at least 1. Instead, was %i' %
+                             max_connections_per_host)
+        self._max_connections_per_host = max_connections_per_host
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def _get_semaphore(self, host):
+        with self._lock:
+            if host not in self._semaphores:
+                self._semaphores[host] = threading.BoundedSemaphore(self._max_connections_per_host)
+            return self._semaphores[host]
+
+    @contextlib.contextmanager
+    def connection(self, url):
+        """Blocks until a connection slot for the host of `url` is available, and holds it for the `with` block."""
+        semaphore = self._get_semaphore(urlparse.urlparse(url).netloc.lower())
+        semaphore.acquire()
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+
+def map_in_parallel(fn, inputs, num_workers):
+    """Applies `fn` to every element of `inputs` using a pool of worker threads.
+
+    Args:
+        fn: A function of one argument. It must be safe to call from several threads at once.
+        inputs: A list of inputs.
+        num_workers: The maximum number of calls to `fn` in flight at once. If 1, runs serially in this thread.
+
+    Returns:
+        A list of outputs, in the same order as `inputs`.
+    """
+    inputs = list(inputs)
+    if num_workers <= 1 or len(inputs) <= 1:
+        return [fn(x) for x in inputs]
+    return _map_in_pool(ThreadPool(min(num_workers, len(inputs))), fn, inputs)
+
+
+def map_in_processes(fn, inputs, num_processes=None):
+    """Applies `fn` to every element of `inputs` using a pool of worker processes, for CPU-bound work.
+
+    Args:
+        fn: A function of one argument. It has to be picklable, so defined at the top level of a module.
+        inputs: A list of picklable inputs.
+        num_processes: The number of processes to use. Defaults to the number of CPUs. If 1, runs serially in this
+            process.
+
+    Returns:
+        A list of outputs, in the same order as `inputs`.
+    """
+    inputs = list(inputs)
+    if num_processes == 1 or len(inputs) <= 1:
+        return [fn(x) for x in inputs]
+    return _map_in_pool(multiprocessing.Pool(num_processes), fn, inputs)
+
+
+def _map_in_pool(pool, fn, inputs):
+    """Maps `fn` over `inputs` in `pool`, and then shuts the pool down."""
+    try:
+        return pool.map_async(fn, inputs).get(_MAX_WAIT_SECS)
+    except:
+        # Don't wait for the rest of the work if something already failed.
+        pool.terminate()
+        raise
+    finally:
+        pool.close()
+        pool.join()
+
+
+class HttpSession(object):
+    """Fetches URLs over a pool of keep-alive connections.
+
+    It's safe to use one session from many threads. Each connection is used by one request at a time, and idle
+    connections are kept per host for the next request.
+
+    Args:
+        timeout_secs: The socket timeout for connecting and for each read.
+        max_connections_per_host: The maximum number of simultaneous requests to any one host.
+        max_redirects: The maximum number of redirects to follow for one request.
+        chunk_size: The number of bytes to read at a time when streaming to disk.
+    """
+
+    def __init__(self, timeout_secs=30, max_connections_per_host=4, max_redirects=5, chunk_size=64 * 1024):
+        self._timeout_secs = timeout_secs
+        self._max_redirects = max_redirects
+        self._chunk_size = chunk_size
+        self._host_limiter = HostConnectionLimiter(max_connections_per_host)
+        self._idle_connections = {}
+        self._lock = threading.Lock()
+
+    def _new_connection(self, scheme, netloc):
+        connection_class = httplib.HTTPSConnection if scheme == 'https' else httplib.HTTPConnection
+        return connection_class(netloc, timeout=self._timeout_secs)
+
+    def _checkout_connection(self, scheme, netloc):
+        """Returns (connection, whether it was reused)."""
+        with self._lock:
+            idle_connections = self._idle_connections.get((scheme, netloc))
+            if idle_connections:
+                return idle_connections.pop(), True
+        return self._new_connection(scheme, netloc), False
+
+    def _checkin_connection(self, scheme, netloc, connection):
+        with self._lock:
+            self._idle_connections.setdefault((scheme, netloc), []).append(connection)
+
+    @staticmethod
+    def _send(connection, path, cancel_event):
+        """Sends a GET on `connection`, and returns the response. Closes `connection` if that fails.
+
+        Until `open` is done with `connection`, setting `cancel_event` shuts it down.
+        """
+        if cancel_event is not None:
+            cancel_event._add_connection(connection)
+        try:
+            connection.request('GET', path, headers={'User-Agent': _USER_AGENT})
+            if cancel_event is not None and cancel_event.is_set():
+                raise DownloadCancelledError('Cancelled request for %s.' % path)
+            return connection.getresponse()
+        except:
+            connection.close()
+            if cancel_event is not None:
+                cancel_event._discard_connection(connection)
+            raise
+
+    def _request(self, scheme, netloc, path, cancel_event=None):
+        """Sends a GET, and returns (connection, response)."""
+        connection, reused = self._checkout_connection(scheme, netloc)
+        try:
+            return connection, self._send(connection, path, cancel_event)
+        except (httplib.HTTPException, socket.error):
+            if not reused or (cancel_event is not None and cancel_event.is_set()):
+                raise
+        # The server probably closed the idle connection, so try once more on a fresh one.
+        metrics.increment('http_stale_connection_retries')
+        connection = self._new_connection(scheme, netloc)
+        return connection, self._send(connection, path, cancel_event)
+
+    @contextlib.contextmanager
+    def open(self, url, cancel_event=None):
+        """Sends a GET for `url`, following redirects, and yields the successful `httplib.HTTPResponse`.
+
+        The connection goes back to the pool when the `with` block ends, if the response was read to the end. Setting
+        `cancel_event`, an optional `CancelEvent`, shuts the connection down.
+
+        Raises:
+            HttpError: If the final response isn't a success.
+        """
+        for _ in xrange(self._max_redirects + 1):
+            scheme, netloc, path, query, _ = urlparse.urlsplit(url)
+            if scheme not in ('http', 'https'):
+                raise ValueError('Can only fetch http and https URLs. Instead, got: %s' % url)
+            # Percent-encode non-ASCII bytes, such as the words in Forvo URLs, which httplib refuses to send raw.
+            path = urlparse.urlunsplit(('', '', urllib.quote(path or '/', safe=_URL_SAFE_CHARS),
+                                        urllib.quote(query, safe=_URL_SAFE_CHARS), ''))
+            with self._host_limiter.connection(url):
+                connection, response = self._request(scheme, netloc, path, cancel_event)
+                try:
+                    if response.status in _REDIRECT_STATUSES and response.getheader('location'):
+                        response.read()
+                        url = urlparse.urljoin(url, response.getheader('location'))
+                        logging.debug('Following redirect to: %s', url)
+                    elif response.status < 200 or response.status >= 300:
+                        response.read()
+                        raise HttpError(url, response.status, response.reason)
+                    else:
+                        yield response
+                        return
+                finally:
+                    if cancel_event is not None:
+                        cancel_event._discard_connection(connection)
+                    # Only reuse connections that are in a clean state, and that a cancellation didn't shut down.
+                    cancelled = cancel_event is not None and cancel_event.is_set()
+                    if response.isclosed() and not response.will_close and not cancelled:
+                        self._checkin_connection(scheme, netloc, connection)
+                    else:
+                        connection.close()
+        raise IOError('Too many redirects for: %s' % url)
+
+    def get(self, url):
+        """Returns the body of `url`."""
+        with self.open(url) as response:
+            return response.read()
+
+    def download_to_file(self, url, destination_fn, max_bytes=None, validate_first_chunk=None, cancel_event=None):
+        """Streams the body of `url` to `destination_fn`.
+
+        The body is written to a temporary file first, so `destination_fn` is only replaced by a complete download that
+        passed every check.
+
+        Args:
+            url: The URL to download.
+            destination_fn: The filename to write to.
+            max_bytes: If not `None`, abandon downloads larger than this, before reading the body if the server says
+                how large it is, and otherwise as soon as the limit is passed.
+            validate_first_chunk: An optional function that takes the first chunk of the body and returns whether the
+                download should continue. Chunks are large enough to hold any file header.
+            cancel_event: An optional `CancelEvent`. If it's set, the download is abandoned, and its connection is shut
+                down.
+
+        Raises:
+            DownloadRejectedError: If the download was abandoned because of `max_bytes` or `validate_first_chunk`.
+            DownloadCancelledError: If the download was abandoned because `cancel_event` was set.
+        """
+        temp_fn = '%s.aeag-download-%i' % (destination_fn, threading.current_thread().ident)
+        try:
+            with self.open(url, cancel_event=cancel_event) as response:
+                content_length = response.getheader('content-length')
+                if max_bytes is not None and content_length and int(content_length) > max_bytes:
+                    raise DownloadRejectedError('%s is %s bytes, which is more than the limit of %i.' % (
+                        url, content_length, max_bytes))
+                with open(temp_fn, 'wb') as f:
+                    num_bytes = 0
+                    for chunk in iter(lambda: response.read(self._chunk_size), b''):
+                        if cancel_event and cancel_event.is_set():
+                            raise DownloadCancelledError('Cancelled download of %s.' % url)
+                        if num_bytes == 0 and validate_first_chunk and not validate_first_chunk(chunk):
+                            raise DownloadRejectedError('%s failed validation.' % url)
+                        num_bytes += len(chunk)
+                        if max_bytes is not None and num_bytes > max_bytes:
+                            raise DownloadRejectedError('%s is more than the limit of %i bytes.' % (url, max_bytes))
+                        f.write(chunk)
+            os.rename(temp_fn, destination_fn)
+        except (httplib.HTTPException, socket.error):
+            if cancel_event is not None and cancel_event.is_set():
+                raise DownloadCancelledError('Cancelled download of %s.' % url)
+            raise
+        finally:
+            if os.path.exists(temp_fn):
+                os.remove(temp_fn)
+
+
+def configure_session(**kwargs):
+    """Replaces the shared session with one built from `kwargs`. See `HttpSession` for the arguments."""
+    global _default_session
+    with _default_session_lock:
+        _default_session = HttpSession(**kwargs)
+
+
+def get_session():
+    """Returns the session shared by the whole program."""
+    global _default_session
+    with _default_session_lock:
+        if _default_session is None:
+            _default_session = HttpSession()
+        return _default_session
@@ -0,0 +1,133 @@
+"""Test download utils module."""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+import BaseHTTPServer
+import os
+import SocketServer
+import tempfile
+import threading
+import time
+import unittest
+
+import download_utils
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves a fixed body at `/media`, redirects `/redirect` there, and 404s everything else."""
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    body = 'x' * 100000
+    num_connections = 0
+    paths = []
+
+    def setup(self):
+        _Handler.num_connections += 1
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+
+    def do_GET(self):
+        _Handler.paths.append(self.path)
+        if self.path == '/media':
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(self.body)))
+            self.end_headers()
+            self.wfile.write(self.body)
+        elif self.path == '/redirect':
+            self.send_response(302)
+            self.send_header('Location', '/media')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        else:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class TestDownloadUtils(unittest.TestCase):
+
+    def test_map_in_parallel_preserves_order(self):
+        inputs = range(20)
+        self.assertListEqual(
+            [x * 2 for x in inputs],
+            download_utils.map_in_parallel(lambda x: x * 2, inputs, num_workers=4))
+
+    def test_map_in_processes_preserves_order(self):
+        inputs = range(-10, 10)
+        self.assertListEqual([abs(x) for x in inputs], download_utils.map_in_processes(abs, inputs, num_processes=2))
+
+    def test_host_connection_limiter(self):
+        limiter = download_utils.HostConnectionLimiter(max_connections_per_host=2)
+        lock = threading.Lock()
+        in_flight = {'cur': 0, 'max': 0}
+
+        def _download(url):
+            with limiter.connection(url):
+                with lock:
+                    in_flight['cur'] += 1
+                    in_flight['max'] = max(in_flight['max'], in_flight['cur'])
+                time.sleep(0.01)
+                with lock:
+                    in_flight['cur'] -= 1
+
+        urls = ['http://example.com/image_%i.png' % i for i in xrange(10)]
+        download_utils.map_in_parallel(_download, urls, num_workers=8)
+        self.assertEqual(2, in_flight['max'])
+
+
+class TestHttpSession(unittest.TestCase):
+
+    def setUp(self):
+        self.server = _Server(('127.0.0.1', 0), _Handler)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.url = 'http://127.0.0.1:%i' % self.server.server_address[1]
+        _Handler.num_connections = 0
+        _Handler.paths = []
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_reuses_connections(self):
+        session = download_utils.HttpSession()
+        destination_fn = tempfile.mktemp()
+        session.download_to_file(self.url + '/media', destination_fn)
+        self.assertEqual(_Handler.body, session.get(self.url + '/redirect'))
+        self.assertEqual(len(_Handler.body), os.path.getsize(destination_fn))
+        self.assertEqual(1, _Handler.num_connections)
+
+    def test_raises_on_error_status(self):
+        session = download_utils.HttpSession()
+        destination_fn = tempfile.mktemp()
+        with self.assertRaises(download_utils.HttpError) as context:
+            session.download_to_file(self.url + '/missing', destination_fn)
+        self.assertEqual(404, context.exception.status)
+        self.assertFalse(os.path.exists(destination_fn))
+
+    def test_rejects_downloads(self):
+        session = download_utils.HttpSession()
+        destination_fn = tempfile.mktemp()
+        with self.assertRaises(download_utils.DownloadRejectedError):
+            session.download_to_file(self.url + '/media', destination_fn, max_bytes=1000)
+        with self.assertRaises(download_utils.DownloadRejectedError):
+            session.download_to_file(self.url + '/media', destination_fn,
+                                     validate_first_chunk=lambda chunk: chunk.startswith('\x89PNG'))
+        self.assertFalse(os.path.exists(destination_fn))
+
+    def test_percent_encodes_non_ascii_urls(self):
+        session = download_utils.HttpSession()
+        with self.assertRaises(download_utils.HttpError):
+            session.get(self.url + '/word/\xd7\xa9\xd7\x9c?q=\xd7\x9d&x=a%20b')
+        self.assertListEqual(['/word/%D7%A9%D7%9C?q=%D7%9D&x=a%20b'], _Handler.paths)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,178 @@
+"""Benchmarks `main.main` end to end, against local stand-in API and media servers.
+
+No API keys or network access are needed: `fake_servers` stands in for Translate, Custom Search, Forvo and the media
+hosts. For each deck size, this reports the throughput in words per second, and latency percentiles for each stage:
+
+- translate: Translating one list of words, which may take several API requests.
+- image: Finding and downloading the image for one word.
+- forvo_lookup: Finding the MP3 link of one word.
+- download: Downloading one media file.
+
+Run with:
+
+python e2e_benchmark.py --deck_sizes 100,1000 --latency_secs 0.02
+
+Extra flags for `main.py` can be passed with `--main_flags`, for instance `--main_flags="--streaming"`.
+"""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+import argparse
+import collections
+import csv
+import functools
+import logging
+import os
+import shlex
+import shutil
+import string
+import tempfile
+import threading
+import time
+
+import download_utils
+import fake_servers
+import forvo_utils
+import images
+import main
+import translation
+
+
+class _StageTimer(object):
+    """Records how long each call to some library functions takes, by stage."""
+
+    def __init__(self):
+        self._durations = collections.defaultdict(list)
+        self._lock = threading.Lock()
+
+    def wrap(self, owner, attribute, stage):
+        """Replaces `owner.attribute` with a version that records its duration under `stage`."""
+        fn = getattr(owner, attribute)
+        fn = getattr(fn, '__func__', fn)  # unbound methods
+
+        @functools.wraps(fn)
+        def _timed(*args, **kwargs):
+            start_time = time.time()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                with self._lock:
+                    self._durations[stage].append(time.time() - start_time)
+        setattr(owner, attribute, _timed)
+
+    def reset(self):
+        with self._lock:
+            self._durations.clear()
+
+    def percentiles(self, stage, percents=(50, 90, 99)):
+        """Returns the given latency percentiles of `stage`, in seconds, or `None`s if it never ran."""
+        with self._lock:
+            durations = sorted(self._durations.get(stage, []))
+        if not durations:
+            return [None for _ in percents]
+        return [durations[min(len(durations) - 1, int(len(durations) * percent / 100.))] for percent in percents]
+
+
+def _make_words(num_words):
+    """Returns `num_words` distinct lowercase English-looking words."""
+    words = []
+    for i in xrange(num_words):
+        letters = []
+        for _ in xrange(4):
+            i, remainder = divmod(i, 26)
+            letters.append(string.ascii_lowercase[remainder])
+        words.append('bench' + ''.join(letters))
+    return words
+
+
+def _run_main(num_words, tmp_dir, main_flags):
+    """Runs `main.main` on a deck of `num_words` words, and returns (seconds, number of cards written).
+
+    With several `--target_languages` in `main_flags`, the cards of every language are counted.
+    """
+    input_file = os.path.join(tmp_dir, 'words.csv')
+    output_csv_file = os.path.join(tmp_dir, 'cards.csv')
+    with open(input_file, 'w') as f:
+        csv.writer(f).writerows([word] for word in _make_words(num_words))
+    main.FLAGS = main.EasyAnkiArgParser().parse_args([
+        '--input_file', input_file,
+        '--output_dir', os.path.join(tmp_dir, 'media'),
+        '--output_csv_file', output_csv_file,
+        '--disable_translation_cache',
+        '--disable_forvo_cache',
+        '--disable_image_search_cache',
+        '--quota_file', os.path.join(tmp_dir, 'quota.sqlite'),
+        '--translate_qps', '1000000',
+        '--cse_qps', '1000000',
+        '--forvo_qps', '1000000',
+    ] + main_flags)
+    os.makedirs(main.FLAGS.output_dir)
+    download_utils.configure_session(
+        timeout_secs=main.FLAGS.http_timeout_secs,
+        max_connections_per_host=main.FLAGS.max_connections_per_host)
+    main._configure_rate_limits()
+    start_time = time.time()
+    main.main()
+    secs = time.time() - start_time
+    languages = main._target_languages()
+    num_cards = 0
+    for language in languages:
+        with open(main._Target(language, len(languages) > 1).output_csv_file, 'r') as f:
+            num_cards += sum(1 for _ in f)
+    return secs, num_cards
+
+
+def _format_ms(secs):
+    return '%8s' % '-' if secs is None else '%8.1f' % (secs * 1000)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--deck_sizes', default='100,1000,10000,100000',
+                        help='Comma-separated list of deck sizes to benchmark.')
+    parser.add_argument('--latency_secs', type=float, default=0.005,
+                        help='The average latency of the fake servers.')
+    parser.add_argument('--api_error_rate', type=float, default=0.,
+                        help='The fraction of API requests that are rate limited, and retried with backoff.')
+    parser.add_argument('--media_error_rate', type=float, default=0.,
+                        help='The fraction of media downloads that fail. Like against the real servers, a failed image '
+                             'download moves on to the next candidate, but a failed audio download ends the run.')
+    parser.add_argument('--image_bytes', type=int, default=50 * 1024, help='The size of each image.')
+    parser.add_argument('--audio_bytes', type=int, default=20 * 1024, help='The size of each MP3.')
+    parser.add_argument('--main_flags', default='', help='Extra flags for `main.py`.')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    logging.getLogger('googleapiclient.discovery_cache').setLevel(logging.CRITICAL)
+
+    servers = fake_servers.FakeApiServers(
+        latency_secs=args.latency_secs,
+        api_error_rate=args.api_error_rate,
+        media_error_rate=args.media_error_rate,
+        image_bytes=args.image_bytes,
+        audio_bytes=args.audio_bytes)
+    servers.start()
+    servers.install()
+
+    timer = _StageTimer()
+    stages = ['translate', 'image', 'forvo_lookup', 'download']
+    timer.wrap(translation, '_translate_words', 'translate')
+    timer.wrap(images, '_fetch_single_image', 'image')
+    timer.wrap(forvo_utils, 'get_mp3_link', 'forvo_lookup')
+    timer.wrap(download_utils.HttpSession, 'download_to_file', 'download')
+
+    print('%8s %8s %9s %6s  %s' % ('words', 'secs', 'words/sec', 'cards',
+                                   ' '.join('%26s' % ('%s p50/p90/p99 ms' % stage) for stage in stages)))
+    try:
+        for num_words in [int(x) for x in args.deck_sizes.split(',')]:
+            timer.reset()
+            tmp_dir = tempfile.mkdtemp()
+            try:
+                secs, num_cards = _run_main(num_words, tmp_dir, shlex.split(args.main_flags))
+            finally:
+                shutil.rmtree(tmp_dir)
+            print('%8i %8.2f %9.1f %6i  %s' % (
+                num_words, secs, num_words / secs, num_cards,
+                ' '.join('%26s' % ''.join(_format_ms(x) for x in timer.percentiles(stage)) for stage in stages)))
+    finally:
+        servers.stop()
@@ -0,0 +1,286 @@
+"""Local stand-ins for the Translate, Custom Search and Forvo APIs, and for the hosts that serve media.
+
+These let benchmarks run the whole program without API keys or network access. Each server can be made slow, flaky, or
+heavy, with a configurable latency, error rate and payload size, and counts the requests it serves.
+
+`FakeApiServers.install` points `translation`, `images` and `forvo_utils` at the fakes. The fake Translate API
+"translates" an English word by prefixing it with a Hebrew letter, and the reverse by removing the prefix.
+"""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+import BaseHTTPServer
+import binascii
+import json
+import random
+import socket
+import SocketServer
+import sys
+import threading
+import time
+import urllib
+import urlparse
+
+import httplib2
+
+import forvo_utils
+import images
+import translation
+
+
+_TRANSLATION_PREFIX = u'\u05ea'  # Hebrew letter tav
+_PNG_SIGNATURE = '\x89PNG\r\n\x1a\n'
+# MPEG 1 Layer III, no CRC, 128kbps, 44.1kHz, mono.
+_MP3_HEADER = '\xff\xfb\x90\xc0'
+_MP3_FRAME_LENGTH = 417
+_MP3_SIDE_INFO_LENGTH = 17
+
+
+def _mp3_frame(loud):
+    """Returns one MP3 frame. Loud frames have coded audio in their side info, and quiet ones don't."""
+    num_bits = _MP3_SIDE_INFO_LENGTH * 8
+    side_info = 0
+    if loud:
+        # Each granule's part2_3_length (12 bits) and global_gain (8 bits, 9 bits later). The granules start at bits
+        # 18 and 77.
+        for granule_start in (18, 77):
+            side_info |= 1000 << (num_bits - granule_start - 12)
+            side_info |= 180 << (num_bits - granule_start - 29)
+    side_info = binascii.unhexlify('%0*x' % (_MP3_SIDE_INFO_LENGTH * 2, side_info))
+    return _MP3_HEADER + side_info + '\x55' * (_MP3_FRAME_LENGTH - 4 - _MP3_SIDE_INFO_LENGTH)
+
+
+def _discovery_document(api, version, root_url, resource, method_path, parameters):
+    """Returns a minimal discovery document for an API with one `list` method."""
+    return {
+        'kind': 'discovery#restDescription',
+        'discoveryVersion': 'v1',
+        'id': '%s:%s' % (api, version),
+        'name': api,
+        'version': version,
+        'rootUrl': root_url,
+        'servicePath': '%s/' % api,
+        'batchPath': 'batch',
+        'features': ['dataWrapper'] if api == 'translate' else [],
+        'parameters': {'key': {'type': 'string', 'location': 'query'}},
+        'resources': {resource: {'methods': {'list': {
+            'id': '%s.%s.list' % (api, resource),
+            'path': method_path,
+            'httpMethod': 'GET',
+            'parameters': {name: dict(type='string', location='query', **extra)
+                           for name, extra in parameters.items()},
+            'response': {'$ref': 'Response'},
+        }}}},
+        'schemas': {'Response': {'id': 'Response', 'type': 'object'}},
+    }
+
+
+def _translate_discovery_document(root_url):
+    return _discovery_document(
+        'translate', 'v2', root_url, 'translations', 'v2',
+        {'q': {'required': True, 'repeated': True}, 'source': {}, 'target': {'required': True}})
+
+
+def _cse_discovery_document(root_url):
+    return _discovery_document(
+        'customsearch', 'v1', root_url, 'cse', 'v1',
+        {'q': {'required': True}, 'cx': {}, 'searchType': {}, 'fileType': {}, 'num': {}})
+
+
+class DiscoveryHttp(object):
+    """Stands in for the `httplib2.Http` that the API client fetches discovery documents with.
+
+    It serves the fake servers' discovery documents from whatever URL they're asked for, and records the URLs, so tests
+    can check where the client would have fetched them from without network access.
+    """
+
+    def __init__(self):
+        self.uris = []
+
+    def request(self, uri, method='GET', body=None, headers=None, **kwargs):
+        self.uris.append(uri)
+        document_fn = _translate_discovery_document if '/translate/' in uri else _cse_discovery_document
+        return httplib2.Response({'status': 200}), json.dumps(document_fn('http://localhost/'))
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-alive
+    # Send each response in one write, so that Nagle's algorithm doesn't add its own latency.
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def _handle(self):
+        path, _, query_string = self.path.partition('?')
+        if self.command == 'POST':
+            # The API client switches long GETs to POSTs with the query in the body.
+            query_string = self.rfile.read(int(self.headers.getheader('content-length') or 0))
+        query = urlparse.parse_qs(query_string)
+        server = self.server
+        server.count_request()
+        is_discovery = path.startswith('/discovery/')
+        if not is_discovery and server.latency_secs:
+            time.sleep(server.latency_secs * random.uniform(0.5, 1.5))
+        if not is_discovery and random.random() < server.error_rate:
+            status, content_type, body = server.error_status, 'text/plain', 'Injected error'
+        else:
+            status, content_type, body = server.route(urllib.unquote(path), query)
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = _handle
+    do_POST = _handle
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """A local HTTP server that answers every request with `route`.
+
+    Args:
+        route: A function of (path, {query parameter: list of values}) that returns (status, content type, body).
+        latency_secs: The average time to wait before answering. Each request waits between half and one and a half
+            times this.
+        error_rate: The fraction of requests to answer with `error_status` instead.
+        error_status: The status of injected errors.
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, route, latency_secs=0., error_rate=0., error_status=500):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), _Handler)
+        self.route = route
+        self.latency_secs = latency_secs
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.num_requests = 0
+        self._lock = threading.Lock()
+        self._connections = {}
+
+    @property
+    def url(self):
+        return 'http://127.0.0.1:%i' % self.server_address[1]
+
+    def count_request(self):
+        with self._lock:
+            self.num_requests += 1
+
+    def process_request(self, request, client_address):
+        # Like `ThreadingMixIn`, but keeps track of each connection, so that `stop` can close them.
+        thread = threading.Thread(target=self.process_request_thread, args=(request, client_address))
+        thread.daemon = True
+        with self._lock:
+            self._connections[request] = thread
+        thread.start()
+
+    def shutdown_request(self, request):
+        with self._lock:
+            self._connections.pop(request, None)
+        BaseHTTPServer.HTTPServer.shutdown_request(self, request)
+
+    def handle_error(self, request, client_address):
+        # Clients hang up on the downloads they cancel, so there's no need to report those.
+        if not isinstance(sys.exc_info()[1], socket.error):
+            BaseHTTPServer.HTTPServer.handle_error(self, request, client_address)
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever, name='fake-server-%i' % self.server_address[1])
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        """Stops serving, and closes the connections that clients are keeping alive."""
+        self.shutdown()
+        self.server_close()
+        with self._lock:
+            connections = self._connections.items()
+        for request, thread in connections:
+            try:
+                request.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass  # already closed
+            thread.join()
+
+
+class FakeApiServers(object):
+    """Fake Translate, Custom Search, Forvo and media servers.
+
+    Args:
+        latency_secs: The average latency of every API and media request.
+        api_error_rate: The fraction of API requests that fail with a 429, as if they were rate limited.
+        media_error_rate: The fraction of media requests that fail with a 500.
+        image_bytes: The size of each image.
+        audio_bytes: The approximate size of each MP3. It's rounded up to a whole number of frames.
+        num_image_results: The number of results for each image search.
+    """
+
+    def __init__(self, latency_secs=0., api_error_rate=0., media_error_rate=0., image_bytes=50 * 1024,
+                 audio_bytes=20 * 1024, num_image_results=5):
+        self._num_image_results = num_image_results
+        self._image = _PNG_SIGNATURE + '\x00' * max(0, image_bytes - len(_PNG_SIGNATURE))
+        num_frames = max(3, -(-audio_bytes // _MP3_FRAME_LENGTH))
+        self._audio = (_mp3_frame(loud=False) + _mp3_frame(loud=True) * (num_frames - 2) + _mp3_frame(loud=False))
+        kwargs = dict(latency_secs=latency_secs, error_rate=api_error_rate, error_status=429)
+        self.translate = FakeServer(self._route_translate, **kwargs)
+        self.cse = FakeServer(self._route_cse, **kwargs)
+        self.forvo = FakeServer(self._route_forvo, **kwargs)
+        self.media = FakeServer(self._route_media, latency_secs=latency_secs, error_rate=media_error_rate)
+        self.servers = {'translate': self.translate, 'cse': self.cse, 'forvo': self.forvo, 'media': self.media}
+
+    def start(self):
+        for server in self.servers.values():
+            server.start()
+
+    def stop(self):
+        for server in self.servers.values():
+            server.stop()
+
+    def install(self):
+        """Points the library at the fake servers."""
+        discovery_path = '/discovery/v1/apis/{api}/{apiVersion}/rest'
+        translation.DISCOVERY_SERVICE_URL = self.translate.url + discovery_path
+        images.DISCOVERY_SERVICE_URL = self.cse.url + discovery_path
+        forvo_utils.FORVO_API_ROOT = self.forvo.url
+
+    def num_requests(self):
+        """Returns {server name: number of requests served}."""
+        return {name: server.num_requests for name, server in self.servers.items()}
+
+    def _route_translate(self, path, query):
+        if path.startswith('/discovery/'):
+            return 200, 'application/json', json.dumps(_translate_discovery_document(self.translate.url + '/'))
+        translations = []
+        for word in query.get('q', []):
+            word = word.decode('utf-8')
+            if query['target'][0] == 'en':
+                translations.append(word[len(_TRANSLATION_PREFIX):] if word.startswith(_TRANSLATION_PREFIX) else word)
+            else:
+                translations.append(_TRANSLATION_PREFIX + word)
+        body = {'data': {'translations': [{'translatedText': x} for x in translations]}}
+        return 200, 'application/json', json.dumps(body)
+
+    def _route_cse(self, path, query):
+        if path.startswith('/discovery/'):
+            return 200, 'application/json', json.dumps(_cse_discovery_document(self.cse.url + '/'))
+        word = query['q'][0]
+        num = int(query.get('num', [self._num_image_results])[0])
+        links = ['%s/image/%s/%i.png' % (self.media.url, urllib.quote(word), i) for i in xrange(num)]
+        return 200, 'application/json', json.dumps({'items': [{'link': link} for link in links]})
+
+    def _route_forvo(self, path, query):
+        word = path.split('/word/')[1].split('/')[0]
+        mp3_link = '%s/audio/%s.mp3' % (self.media.url, urllib.quote(word))
+        body = ('<?xml version="1.0" encoding="utf-8"?>\n<items total="1"><item><pathmp3>%s</pathmp3><rate>1</rate>'
+                '</item></items>' % mp3_link)
+        return 200, 'text/xml', body
+
+    def _route_media(self, path, query):
+        if path.startswith('/image/'):
+            return 200, 'image/png', self._image
+        if path.startswith('/audio/'):
+            return 200, 'audio/mpeg', self._audio
+        return 404, 'text/plain', 'Not found'
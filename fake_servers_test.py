@@ -0,0 +1,52 @@
+"""Test fake servers module, by running the library against it."""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+import logging
+import os
+import shutil
+import tempfile
+import unittest
+
+import audio
+import fake_servers
+import images
+import mp3_utils
+import translation
+from credentials import credentials
+
+
+class TestFakeServers(unittest.TestCase):
+
+    def setUp(self):
+        logging.getLogger('googleapiclient.discovery_cache').setLevel(logging.CRITICAL)
+        self.servers = fake_servers.FakeApiServers(image_bytes=1000, audio_bytes=3000)
+        self.servers.start()
+        self.servers.install()
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.servers.stop()
+        shutil.rmtree(self.tmp_dir)
+
+    def test_library_runs_against_fakes(self):
+        english_words, translations = translation.get_translations(['water', 'fire'], credentials)
+        self.assertEqual(('water', 'fire'), english_words)
+        self.assertEqual([u'\u05eawater'.encode('utf-8'), u'\u05eafire'.encode('utf-8')], list(translations))
+
+        image_fns = {word: os.path.join(self.tmp_dir, word + '.png') for word in english_words}
+        self.assertEqual([], images.get_images(image_fns, credentials))
+        self.assertTrue(all(os.path.getsize(fn) == 1000 for fn in image_fns.values()))
+
+        audio_fns = {word: os.path.join(self.tmp_dir, word + '.mp3') for word in translations}
+        self.assertEqual([], audio.get_audio(audio_fns, credentials))
+        self.assertEqual([], mp3_utils.clean_mp3s(audio_fns.values(), num_processes=1))
+
+        num_requests = self.servers.num_requests()
+        self.assertEqual(4, num_requests['media'])
+        self.assertEqual(2, num_requests['forvo'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,35 +2,105 @@
 
 `get_mp3_link` queries Forvo.com for a given word in a given language, and returns the download URL of the audio file
 from the XML response.
+
+Forvo's free API has a small daily quota, so `Mp3LinkCache` remembers the result of each lookup between runs. It also
+remembers words that have no audio, so that reruns don't spend quota on them again. The MP3 links themselves expire
+after a while, so they're only remembered for a few hours.
 """
 
 __author__ = 'shor.joel@gmail.com (Joel Shor)'
 
 
 import logging
-import urllib2
 import xml.etree.ElementTree as ET
 
+import disk_cache
+import download_utils
+import metrics
+import rate_limit
+
+
+# The root of Forvo's API. Benchmarks point this at a local stand-in server.
+FORVO_API_ROOT = 'https://apifree.forvo.com'
+
+# Google Translate codes that Forvo spells differently. Other codes are the same in both.
+_FORVO_LANGUAGES = {
+    'iw': 'he',
+    'jw': 'jv',
+    'zh-CN': 'zh',
+    'zh-TW': 'zh',
+}
+
+# Placeholder for a word that isn't in the cache, since `None` means Forvo has no audio for the word.
+_NOT_CACHED = object()
+
+
+class Mp3LinkCache(object):
+    """A persistent cache of `get_mp3_link` results, including words without audio.
+
+    Args:
+        path: The SQLite file to store the cache in.
+        found_ttl_secs: How long to remember the MP3 link of a word with audio. Forvo's links stop working after a
+            while, so this should be short.
+        not_found_ttl_secs: How long to remember that a word has no audio. People add new pronunciations to Forvo all
+            the time, so this shouldn't be too long either.
+        max_entries: The maximum number of words to remember, or `None` for no limit.
+    """
+
+    def __init__(self, path, found_ttl_secs=60 * 60 * 4, not_found_ttl_secs=60 * 60 * 24 * 7,
+                 max_entries=None):
+        self._cache = disk_cache.DiskCache(path, max_entries=max_entries)
+        self._found_ttl_secs = found_ttl_secs
+        self._not_found_ttl_secs = not_found_ttl_secs
+
+    def get(self, word, language):
+        """Returns the cached MP3 link, `None` if the word is cached as having no audio, or `_NOT_CACHED`."""
+        return self._cache.get((language, word), default=_NOT_CACHED)
+
+    def set(self, word, language, mp3_link):
+        ttl_secs = self._found_ttl_secs if mp3_link else self._not_found_ttl_secs
+        self._cache.set((language, word), mp3_link, ttl_secs=ttl_secs)
+
+    def forget(self, word, language):
+        """Drops the cached result for a word, for instance because its MP3 link no longer works."""
+        self._cache.delete((language, word))
+
+
+def forvo_language(translate_language):
+    """Returns Forvo's code for a language, given its Google Translate code."""
+    return _FORVO_LANGUAGES.get(translate_language, translate_language)
+
 
 def _get_forvo_url(word, api_key, language='he'):
-    return 'https://apifree.forvo.com/key/%s/format/xml/action/word-pronunciations/word/%s/language/%s' % (
-        api_key, word, language)
+    return '%s/key/%s/format/xml/action/word-pronunciations/word/%s/language/%s' % (
+        FORVO_API_ROOT, api_key, word, language)
 
 
 def _get_forvo_xml(word, api_key, language='he'):
     forvo_url = _get_forvo_url(word, api_key, language)
     try:
-        response = urllib2.urlopen(forvo_url)
+        return rate_limit.get_limiter('forvo').call(lambda: download_utils.get_session().get(forvo_url))
     except:
         logging.error('Failed to fetch Forvo URL, possibly because daily limit was reached: %s' % forvo_url)
         raise
-    return response.read()
 
 
-def get_mp3_link(word, api_key, language='he'):
-    """Returns URL of top rated audio, or None."""
-    xml_string = _get_forvo_xml(word, api_key, language=language)
-    return _extract_mp3link_from_xml(xml_string)
+def get_mp3_link(word, api_key, language='he', cache=None):
+    """Returns URL of top rated audio, or None.
+
+    If `cache` is an `Mp3LinkCache`, it's checked before querying Forvo, and updated afterwards.
+    """
+    if cache is not None:
+        mp3_link = cache.get(word, language)
+        if mp3_link is not _NOT_CACHED:
+            metrics.increment('forvo_cache_hits')
+            return mp3_link
+    with metrics.timer('forvo_lookup'):
+        xml_string = _get_forvo_xml(word, api_key, language=language)
+    mp3_link = _extract_mp3link_from_xml(xml_string)
+    if cache is not None:
+        cache.set(word, language, mp3_link)
+    return mp3_link
 
 
 def _extract_mp3link_from_xml(xml_string):
@@ -4,6 +4,7 @@
 import forvo_utils
 import unittest
 import os
+import tempfile
 
 
 class TestForvoUtils(unittest.TestCase):
@@ -19,6 +20,20 @@ class TestForvoUtils(unittest.TestCase):
             'https://apifree.forvo.com/audio/2d2g293f3k333l1g1l3f293p2q332q3j1i2c2d3h232i3335242a2f2i382j3q311f2h311g3q3a3h3n313j2d2c3c2d1m1i1m3q2q3i3c3m2a1b373a241o342p3h2b3f2p3f3h3h3j213b3b2j1j2633261f2q2l241h2i38371t1t_2j2d2p3g2k2l1p3g2e29241p2d2d2a2d1k363m2k382h1t1t',
             mp3_link)
 
+    def test_get_mp3_link_from_cache(self):
+        cache = forvo_utils.Mp3LinkCache(os.path.join(tempfile.mkdtemp(), 'forvo.sqlite'))
+        cache.set('word1', 'he', 'https://apifree.forvo.com/audio/word1')
+        cache.set('word2', 'he', None)
+
+        # Both words are cached, so neither touches the network.
+        self.assertEqual('https://apifree.forvo.com/audio/word1', forvo_utils.get_mp3_link('word1', '', cache=cache))
+        self.assertIsNone(forvo_utils.get_mp3_link('word2', '', cache=cache))
+
+    def test_forvo_language(self):
+        self.assertEqual('he', forvo_utils.forvo_language('iw'))
+        self.assertEqual('zh', forvo_utils.forvo_language('zh-TW'))
+        self.assertEqual('ar', forvo_utils.forvo_language('ar'))
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,99 @@
+"""Shrinks fetched images to a size that makes sense on a flashcard.
+
+Images from the web are often several megapixels, but a card shows them in a few hundred pixels. `resize_images`
+downsizes and recompresses images, in place, in a pool of processes, since resizing is CPU-bound. Images that are
+already within budget are left alone.
+
+This needs the Python Imaging Library. It might be as simple as running:
+
+pip install Pillow
+"""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+import logging
+import os
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+import download_utils
+
+
+def resize_image(filename, max_dimension=480, quality=85, max_bytes=200 * 1024):
+    """Resizes and recompresses one image in place, keeping its format.
+
+    Args:
+        filename: The image file.
+        max_dimension: The maximum width and height, in pixels. The aspect ratio is kept.
+        quality: The JPEG quality to recompress with. Other formats are recompressed losslessly.
+        max_bytes: Images no larger than this, that also fit in `max_dimension`, are left alone.
+
+    Returns:
+        The new size in bytes, or `None` if the image was left alone.
+    """
+    if Image is None:
+        raise ImportError('Resizing images needs the Python Imaging Library. Try `pip install Pillow`.')
+    original_bytes = os.path.getsize(filename)
+    image = Image.open(filename)
+    image_format = image.format
+    if max(image.size) <= max_dimension and original_bytes <= max_bytes:
+        return None
+    if getattr(image, 'is_animated', False):
+        logging.info('Not resizing animated image: %s', filename)
+        return None
+
+    image.thumbnail((max_dimension, max_dimension), Image.ANTIALIAS)
+    save_kwargs = {'optimize': True}
+    if image_format == 'JPEG':
+        save_kwargs['quality'] = quality
+        if image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+    temp_filename = filename + '.aeag-resize'
+    try:
+        image.save(temp_filename, format=image_format, **save_kwargs)
+        new_bytes = os.path.getsize(temp_filename)
+        if new_bytes >= original_bytes:
+            # Recompressing made it bigger, so keep the original.
+            return None
+        os.rename(temp_filename, filename)
+    finally:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+    logging.info('Resized %s from %i to %i bytes.', filename, original_bytes, new_bytes)
+    return new_bytes
+
+
+def _resize_image_or_log(args):
+    filename, max_dimension, quality, max_bytes = args
+    try:
+        return resize_image(filename, max_dimension=max_dimension, quality=quality, max_bytes=max_bytes)
+    except ImportError:
+        raise
+    except Exception as e:
+        # A bad image shouldn't stop the rest of the batch. The original file is kept.
+        logging.error('Failed to resize %s: %s', filename, e)
+        return None
+
+
+def resize_images(filenames, max_dimension=480, quality=85, max_bytes=200 * 1024, num_processes=None):
+    """Resizes and recompresses many images in place, in a pool of processes.
+
+    Args:
+        filenames: A list of image files.
+        max_dimension: See `resize_image`.
+        quality: See `resize_image`.
+        max_bytes: See `resize_image`.
+        num_processes: The number of processes to use. Defaults to the number of CPUs.
+
+    Returns:
+        The number of images that were resized.
+    """
+    if Image is None:
+        raise ImportError('Resizing images needs the Python Imaging Library. Try `pip install Pillow`.')
+    args = [(filename, max_dimension, quality, max_bytes) for filename in filenames]
+    results = download_utils.map_in_processes(_resize_image_or_log, args, num_processes)
+    return sum(result is not None for result in results)
@@ -0,0 +1,69 @@
+"""Test image resize module."""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+import image_resize
+
+# Like `image_resize`, the tests need the Python Imaging Library, and are skipped without it.
+Image = image_resize.Image
+
+
+def _write_noisy_jpeg(filename, size):
+    random.seed(0)
+    image = Image.new('RGB', size)
+    image.putdata([(random.randint(0, 255), random.randint(0, 255), random.randint(0, 255))
+                   for _ in xrange(size[0] * size[1])])
+    image.save(filename, format='JPEG', quality=95)
+
+
+@unittest.skipIf(Image is None, 'Needs the Python Imaging Library. Try `pip install Pillow`.')
+class TestImageResize(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_resizes_large_images(self):
+        filename = os.path.join(self.tmp_dir, 'big.jpg')
+        _write_noisy_jpeg(filename, (1000, 500))
+        original_bytes = os.path.getsize(filename)
+        new_bytes = image_resize.resize_image(filename, max_dimension=200)
+        self.assertEqual(new_bytes, os.path.getsize(filename))
+        self.assertLess(new_bytes, original_bytes)
+        image = Image.open(filename)
+        self.assertEqual('JPEG', image.format)
+        self.assertEqual((200, 100), image.size)
+
+    def test_leaves_small_images_alone(self):
+        filename = os.path.join(self.tmp_dir, 'small.jpg')
+        _write_noisy_jpeg(filename, (50, 50))
+        with open(filename, 'rb') as f:
+            original = f.read()
+        self.assertIsNone(image_resize.resize_image(filename, max_dimension=200))
+        with open(filename, 'rb') as f:
+            self.assertEqual(original, f.read())
+
+    def test_resize_images_in_parallel(self):
+        filenames = [os.path.join(self.tmp_dir, '%i.jpg' % i) for i in xrange(3)]
+        for filename in filenames:
+            _write_noisy_jpeg(filename, (400, 400))
+        bad_filename = os.path.join(self.tmp_dir, 'bad.jpg')
+        with open(bad_filename, 'w') as f:
+            f.write('not an image')
+        num_resized = image_resize.resize_images(filenames + [bad_filename], max_dimension=100, num_processes=2)
+        self.assertEqual(3, num_resized)
+        self.assertTrue(all(Image.open(filename).size == (100, 100) for filename in filenames))
+        self.assertFalse(any(f.endswith('.aeag-resize') for f in os.listdir(self.tmp_dir)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -21,55 +21,218 @@ __author__ = 'shor.joel@gmail.com (Joel Shor)'
 
 import logging
 import os
-import shutil
-import urllib
+import threading
 
 import imghdr
 
 from googleapiclient.discovery import build
 
+import bulk_copy
+import disk_cache
+import download_utils
+import metrics
+import rate_limit
 
-def _fetch_single_image(word, destination_fn, service, credentials, max_tries=5):
+
+# Where the API client fetches the API's description from, or `None` for its default. Benchmarks point this at a
+# local stand-in server.
+DISCOVERY_SERVICE_URL = None
+# How images are named in a directory of already downloaded media, with one spot for the English word.
+DOWNLOADED_FILENAME_FORMAT = 'image_%s.jpg'
+
+# The Google API client isn't thread-safe, so each thread keeps its own service object.
+_thread_local = threading.local()
+
+
+def _get_service(credentials):
+    """Returns this thread's CSE service object, building it on first use."""
+    if not hasattr(_thread_local, 'services'):
+        _thread_local.services = {}
+    services = _thread_local.services
+    developer_key = credentials.images.developerKey
+    if developer_key not in services:
+        # Build a service object for interacting with the API. Visit
+        # the Google APIs Console <http://code.google.com/apis/console>
+        # to get an API key for your own application.
+        kwargs = {'discoveryServiceUrl': DISCOVERY_SERVICE_URL} if DISCOVERY_SERVICE_URL else {}
+        services[developer_key] = build("customsearch", "v1", developerKey=developer_key, **kwargs)
+    return services[developer_key]
+
+
+class SearchResultCache(object):
+    """A persistent cache of Custom Search result lists, and of the results that were used.
+
+    CSE queries are the scarcest quota we have, so reruns reuse the ranked result list of a query instead of asking
+    again. Remembering which results were already used lets a rerun that replaces images move on to the next one.
+
+    Args:
+        path: The SQLite file to store the cache in.
+        ttl_secs: How long to remember the result list of a query.
+        max_entries: The maximum number of entries to remember, or `None` for no limit.
+    """
+
+    def __init__(self, path, ttl_secs=60 * 60 * 24 * 30, max_entries=None):
+        self._cache = disk_cache.DiskCache(path, max_entries=max_entries)
+        self._ttl_secs = ttl_secs
+
+    def get_links(self, query, file_type, num):
+        """Returns the cached list of result links, or `None`."""
+        return self._cache.get(('results', query, file_type, num))
+
+    def set_links(self, query, file_type, num, links):
+        self._cache.set(('results', query, file_type, num), links, ttl_secs=self._ttl_secs)
+
+    def get_used_links(self, query):
+        """Returns the links that were used for `query` in previous runs, oldest first."""
+        return self._cache.get(('used', query), default=[])
+
+    def add_used_link(self, query, link):
+        used_links = self.get_used_links(query)
+        if link not in used_links:
+            self._cache.set(('used', query), used_links + [link])
+
+
+def _looks_like_image(first_chunk):
+    return imghdr.what(None, h=first_chunk) is not None
+
+
+def _download_candidate(word, img_url, destination_fn, session, max_image_bytes, cancel_event=None):
+    """Downloads one candidate image, and returns whether it worked.
+
+    Each download is checked as it streams in, so candidates that aren't readable images, or are too large, are
+    abandoned early and never written to `destination_fn`.
+    """
+    try:
+        logging.info('about to retrieve: %s', word)
+        with metrics.timer('image_download'):
+            session.download_to_file(img_url, destination_fn, max_bytes=max_image_bytes,
+                                     validate_first_chunk=_looks_like_image, cancel_event=cancel_event)
+        logging.info('retrieved: %s', word)
+    except download_utils.DownloadCancelledError:
+        metrics.increment('image_download_cancellations')
+        logging.debug('Cancelled word / url: %s / %s', word, img_url)
+        return False
+    except download_utils.DownloadRejectedError as e:
+        metrics.increment('image_download_rejections')
+        logging.error('Rejected image for word / url: %s / %s', word, img_url)
+        logging.info(e)
+        return False
+    except Exception as e:
+        metrics.increment('image_download_failures')
+        logging.error('Failed on word / url: %s / %s', word, img_url)
+        logging.info(e)
+        return False
+    return True
+
+
+def _race_candidates(word, img_urls, destination_fn, session, max_image_bytes):
+    """Downloads several candidate images at once, and keeps the first one to finish.
+
+    Each candidate is written to its own temporary file. The first that passes validation is moved to `destination_fn`,
+    and the others are cancelled, which shuts down their connections. This then waits for them to clean up their
+    temporary files, which doesn't wait for slow hosts.
+
+    Returns:
+        The URL of the image that was kept, or `None` if none of the candidates worked.
+    """
+    cancel_event = download_utils.CancelEvent()
+    lock = threading.Lock()
+    winning_urls = []
+
+    def _download(index, img_url):
+        candidate_fn = '%s.aeag-candidate-%i' % (destination_fn, index)
+        try:
+            if _download_candidate(word, img_url, candidate_fn, session, max_image_bytes, cancel_event):
+                with lock:
+                    if not cancel_event.is_set():
+                        cancel_event.set()
+                        os.rename(candidate_fn, destination_fn)
+                        winning_urls.append(img_url)
+        finally:
+            if os.path.exists(candidate_fn):
+                os.remove(candidate_fn)
+
+    threads = [threading.Thread(target=_download, args=(index, img_url), name='race-%s-%i' % (word, index))
+               for index, img_url in enumerate(img_urls)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return winning_urls[0] if winning_urls else None
+
+
+def _search_image_links(word, service, credentials, max_tries, search_cache):
+    file_type = 'png'  # this is just to match the filename template defined in `main.py`
+    if search_cache is not None:
+        img_urls = search_cache.get_links(word, file_type, max_tries)
+        if img_urls is not None:
+            metrics.increment('cse_cache_hits')
+            return img_urls
+    request = (service or _get_service(credentials)).cse().list(
+        q=word,
+        cx=credentials.images.cxString,
+        searchType="image",
+        fileType=file_type,
+        num=max_tries)
+    with metrics.timer('cse_query'):
+        res = rate_limit.get_limiter('cse').call(request.execute)
+    img_urls = [search_result['link'] for search_result in res['items']]
+    if search_cache is not None:
+        search_cache.set_links(word, file_type, max_tries, img_urls)
+    return img_urls
+
+
+def _fetch_single_image(word, destination_fn, service, credentials, max_tries=5, session=None,
+                        max_image_bytes=None, num_racing_candidates=1, search_cache=None, skip_used_links=False):
     """Copies a web image to a destination on the local disk.
 
     Args:
         word: Word to find image for.
         destination_fn: Destination filename for image.
-        service: The Google Client API service object.
+        service: The Google Client API service object, or `None` to use this thread's own, built only if it's needed.
         credentials: The credentials object.
+        session: The `download_utils.HttpSession` to download with. Defaults to the shared session.
+        max_image_bytes: If not `None`, skip candidate images larger than this.
+        num_racing_candidates: The number of candidate images to download at once. The first one that works is kept,
+            and the rest are cancelled. If 1, candidates are tried one after another.
+        search_cache: An optional `SearchResultCache`, used to avoid repeating CSE queries.
+        skip_used_links: If `True`, skip results that `search_cache` says were used before, so that rerunning gives a
+            different image. If every result was used before, they're all tried again.
 
     Returns:
         `True` on success, `False` otherwise.
     """
-    res = service.cse().list(
-        q=word,
-        cx=credentials.images.cxString,
-        searchType="image",
-        fileType="png",  # this is just to match the filename template defined in `main.py`
-        num=max_tries).execute()
+    img_urls = _search_image_links(word, service, credentials, max_tries, search_cache)
+    if skip_used_links and search_cache is not None:
+        used_links = search_cache.get_used_links(word)
+        unused_urls = [img_url for img_url in img_urls if img_url not in used_links]
+        if unused_urls:
+            img_urls = unused_urls
+        else:
+            logging.warning('Every image result for `%s` was used before, so trying them all again.', word)
 
     # Copy images to disk until one works, or we run out of images and give up.
-    for search_result in res['items']:
-        img_url = search_result['link']
-        try:
-            logging.info('about to retrieve: %s', word)
-            urllib.urlretrieve(img_url, destination_fn)
-            logging.info('retrieved: %s', word)
-        except Exception as e:
-            logging.error('Failed on word / url: %s / %s', word, img_url)
-            logging.info(e)
-            continue
-
-        # Verify that the file is readable.
-        if not imghdr.what(destination_fn):
-            logging.error('Downloaded image, but was unreadable: word / filename: %s / %s', word, destination_fn)
-            continue
-        return True
+    session = session or download_utils.get_session()
+    winning_url = None
+    if num_racing_candidates > 1:
+        for i in xrange(0, len(img_urls), num_racing_candidates):
+            winning_url = _race_candidates(word, img_urls[i:i + num_racing_candidates], destination_fn, session,
+                                           max_image_bytes)
+            if winning_url:
+                break
+    else:
+        for img_url in img_urls:
+            if _download_candidate(word, img_url, destination_fn, session, max_image_bytes):
+                winning_url = img_url
+                break
 
-    return False
+    if winning_url and search_cache is not None:
+        search_cache.add_used_link(word, winning_url)
+    return winning_url is not None
 
 
-def get_images(filenames_to_write_imgs, credentials):
+def get_images(filenames_to_write_imgs, credentials, num_workers=8, session=None, max_image_bytes=None,
+               num_racing_candidates=1, search_cache=None, skip_used_links=False):
     """Fetch images from a Google Custom Search Engine.
 
     Based on instructions for `Custom Search` at
@@ -82,6 +245,14 @@ def get_images(filenames_to_write_imgs, credentials):
     Args:
         filenames_to_write_imgs: A dictionary of {English word: full filename to copy image to}.
         credentials: A object with Google CSE credentials.
+        num_workers: The number of words to fetch images for at once.
+        session: The `download_utils.HttpSession` to download with, which also limits connections per host. Defaults
+            to the shared session.
+        max_image_bytes: If not `None`, skip candidate images larger than this.
+        num_racing_candidates: The number of candidate images to download at once for each word. See
+            `_fetch_single_image`.
+        search_cache: An optional `SearchResultCache`, used to avoid repeating CSE queries.
+        skip_used_links: See `_fetch_single_image`.
 
     Returns:
         A list of words that failed.
@@ -89,34 +260,38 @@ def get_images(filenames_to_write_imgs, credentials):
     if not isinstance(filenames_to_write_imgs, dict):
         raise ValueError('`filenames_to_write_imgs` must be a dict. Instead, was %s' % type(filenames_to_write_imgs))
 
-    # Build a service object for interacting with the API. Visit
-    # the Google APIs Console <http://code.google.com/apis/console>
-    # to get an API key for your own application.
-    service = build("customsearch", "v1", developerKey=credentials.images.developerKey)
+    def _fetch(word_and_destination_fn):
+        word, destination_fn = word_and_destination_fn
+        with metrics.timer('image'):
+            return _fetch_single_image(word, destination_fn, None, credentials, session=session,
+                                       max_image_bytes=max_image_bytes, num_racing_candidates=num_racing_candidates,
+                                       search_cache=search_cache, skip_used_links=skip_used_links)
 
-    # TODO(joelshor): Use `multiprocessing.Pool` to fetch many images in parallel.
-    words_that_failed = []
-    for word, destination_fn in filenames_to_write_imgs.items():
-        if not _fetch_single_image(word, destination_fn, service, credentials):
-            words_that_failed.append(word)
+    words_and_destination_fns = filenames_to_write_imgs.items()
+    successes = download_utils.map_in_parallel(_fetch, words_and_destination_fns, num_workers)
 
-    return words_that_failed
+    return [word for (word, _), success in zip(words_and_destination_fns, successes) if not success]
 
 
-def copy_images_from_disk(filenames_to_write_imgs, media_dir, filename_regexp="image_%s.jpg"):
+def copy_images_from_disk(filenames_to_write_imgs, media_dir, filename_regexp=DOWNLOADED_FILENAME_FORMAT,
+                          num_workers=8, methods=bulk_copy.METHODS):
     """Copies images from one directory to another.
 
     Args:
         filenames_to_write_imgs: A dictionary of {English word: full filename to copy image to}.
         media_dir: The location on disk we expect to find the files.
         filename_regexp: The expected filename, with one spot for the word.
+        num_workers: The number of files to copy at once.
+        methods: The ways to copy each file, in order of preference. See `bulk_copy.py`.
 
     Raises:
         ValueError: If any image file doesn't exist.
     """
+    sources_and_destinations = []
     for word, target_location in filenames_to_write_imgs.items():
         existing_filename = os.path.join(media_dir, filename_regexp % word)
         if not os.path.exists(existing_filename):
             raise ValueError("Word `%s` was expecting image file %s, but it didn't "
                              "exist." % (word, existing_filename))
-        shutil.copyfile(existing_filename, target_location)
\ No newline at end of file
+        sources_and_destinations.append((existing_filename, target_location))
+    bulk_copy.copy_files(sources_and_destinations, num_workers=num_workers, methods=methods)
\ No newline at end of file
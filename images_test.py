@@ -4,12 +4,45 @@ __author__ = 'shor.joel@gmail.com (Joel Shor)'
 
 
 import tempfile
+import threading
+import time
 import unittest
 import os
 
+from googleapiclient import discovery
+
+from credentials import Credentials
+import download_utils
+import fake_servers
 import images
 
 
+_PNG = '\x89PNG\r\n\x1a\n' + 'x' * 1000
+
+
+class _FakeService(object):
+    """Stands in for the CSE service, returning fixed result links."""
+
+    def __init__(self, links):
+        self._links = links
+        self.num_queries = 0
+
+    def cse(self):
+        return self
+
+    def list(self, **kwargs):
+        return self
+
+    def execute(self):
+        self.num_queries += 1
+        return {'items': [{'link': link} for link in self._links]}
+
+
+class _FakeCredentials(object):
+    class images(object):
+        cxString = 'cx'
+
+
 class TestAudio(unittest.TestCase):
 
     def setUp(self):
@@ -30,5 +63,83 @@ class TestAudio(unittest.TestCase):
             self.assertTrue(os.path.exists(filename))
 
 
+class TestRacingDownloads(unittest.TestCase):
+
+    def setUp(self):
+        self.release_stalled_requests = threading.Event()
+        self.server = fake_servers.FakeServer(self._route)
+        self.server.start()
+        self.url = self.server.url
+
+    def tearDown(self):
+        self.release_stalled_requests.set()
+        self.server.stop()
+
+    def _route(self, path, query):
+        """Serves a PNG, except for something that isn't an image at `/text`, and nothing at all at `/stalled`."""
+        if path == '/stalled':
+            # Like a host that accepts the connection, but never sends the headers.
+            self.release_stalled_requests.wait(30)
+        if path == '/text':
+            return 200, 'text/plain', 'not an image'
+        return 200, 'image/png', _PNG
+
+    def _fetch(self, paths, num_racing_candidates, service=None, **kwargs):
+        destination_fn = tempfile.mktemp()
+        service = service or _FakeService([self.url + path for path in paths])
+        success = images._fetch_single_image(
+            'word', destination_fn, service, _FakeCredentials, session=download_utils.HttpSession(),
+            num_racing_candidates=num_racing_candidates, **kwargs)
+        return success, destination_fn
+
+    def test_stalled_host_doesnt_block_word(self):
+        start_time = time.time()
+        success, destination_fn = self._fetch(['/stalled', '/text', '/fast'], num_racing_candidates=3)
+        self.assertTrue(success)
+        self.assertLess(time.time() - start_time, 5)
+        with open(destination_fn, 'rb') as f:
+            self.assertEqual(_PNG, f.read())
+
+        # Cancelling the stalled candidate shut its connection down, so it had already stopped and cleaned up.
+        self.assertListEqual([], [thread for thread in threading.enumerate() if thread.name.startswith('race-')])
+        self.assertListEqual([], [fn for fn in os.listdir(os.path.dirname(destination_fn))
+                                  if fn.startswith(os.path.basename(destination_fn) + '.')])
+
+    def test_all_candidates_fail(self):
+        success, destination_fn = self._fetch(['/text', '/text', '/text'], num_racing_candidates=2)
+        self.assertFalse(success)
+        self.assertFalse(os.path.exists(destination_fn))
+
+    def test_search_result_cache(self):
+        search_cache = images.SearchResultCache(tempfile.mktemp())
+        service = _FakeService([self.url + '/text', self.url + '/fast', self.url + '/fast?2'])
+        self.assertTrue(self._fetch(None, 1, service=service, search_cache=search_cache)[0])
+        self.assertTrue(self._fetch(None, 1, service=service, search_cache=search_cache)[0])
+        self.assertEqual(1, service.num_queries)
+        self.assertEqual([self.url + '/fast'], search_cache.get_used_links('word'))
+
+        # Replacing the image moves on to the next result, without another query.
+        self.assertTrue(self._fetch(None, 1, service=service, search_cache=search_cache, skip_used_links=True)[0])
+        self.assertEqual(1, service.num_queries)
+        self.assertEqual([self.url + '/fast', self.url + '/fast?2'], search_cache.get_used_links('word'))
+
+    def test_get_service_with_default_discovery_url(self):
+        # Without a `DISCOVERY_SERVICE_URL`, the client fetches the API description from its own default URL.
+        self.assertIsNone(images.DISCOVERY_SERVICE_URL)
+        http = fake_servers.DiscoveryHttp()
+        real_build = images.build
+        images.build = lambda *args, **kwargs: real_build(*args, http=http, **kwargs)
+        try:
+            credentials = Credentials()
+            credentials.images = Credentials()
+            credentials.images.developerKey = 'default-discovery-url'
+            service = images._get_service(credentials)
+        finally:
+            images.build = real_build
+        self.assertTrue(hasattr(service, 'cse'))
+        self.assertEqual([discovery.DISCOVERY_URI.format(api='customsearch', apiVersion='v1')],
+                         [uri.split('?')[0] for uri in http.uris])
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,96 @@
+"""A checkpoint journal of a run, so that interrupted runs can be resumed.
+
+The journal is an append-only file with one JSON entry per line. Each entry records the outcome of one word at one
+stage of the run (see `STAGES`), so a resumed run can skip work that already succeeded, or already failed for good,
+including translations that were already paid for. Entries are flushed as soon as they're recorded, so they survive the
+process dying partway through a run.
+
+Each entry also records the run's target language, since translations and audio only apply to the language they were
+made for. A resumed run ignores the entries of other languages.
+"""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+import json
+import logging
+import os
+import threading
+
+import json_utils
+
+
+STAGES = ('translation', 'image', 'audio')
+
+
+class RunJournal(object):
+    """Records the outcome of each word at each stage of a run.
+
+    Args:
+        path: The journal file.
+        resume: If `True`, load the entries of a previous run from `path` and keep appending to it. Otherwise, start a
+            new journal.
+        target_language: The language code the run translates to, or `None` for entries that don't depend on it.
+            When resuming, entries recorded for any other language are ignored.
+    """
+
+    def __init__(self, path, resume=False, target_language=None):
+        self._entries = {stage: {} for stage in STAGES}
+        self._target_language = target_language
+        self._lock = threading.Lock()
+        if resume and os.path.exists(path):
+            num_other_language_entries = 0
+            with open(path, 'r') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # The last line might be incomplete, if the previous run died while writing it.
+                        logging.warning('Skipping malformed journal line: %s', line)
+                        continue
+                    if entry.get('language') != target_language:
+                        num_other_language_entries += 1
+                        continue
+                    self._entries[entry['stage']][json_utils.to_utf8(entry['word'])] = (
+                        entry['succeeded'], json_utils.to_utf8(entry['value']))
+            if num_other_language_entries:
+                logging.warning('Ignoring %i journal entries that weren\'t recorded for target language %s.',
+                                num_other_language_entries, target_language)
+            logging.info('Resuming from journal %s with %s entries.', path,
+                         {stage: len(entries) for stage, entries in self._entries.items()})
+        needs_newline = False
+        if resume and os.path.exists(path) and os.path.getsize(path) > 0:
+            # Make sure new entries don't get glued onto an incomplete last line.
+            with open(path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != '\n'
+        self._file = open(path, 'a' if resume else 'w')
+        if needs_newline:
+            self._file.write('\n')
+
+    def record(self, stage, word, succeeded, value=None):
+        """Records the outcome of `word` at `stage`.
+
+        Args:
+            stage: One of `STAGES`.
+            word: The word, as it's keyed at this stage.
+            succeeded: Whether the stage succeeded for this word.
+            value: An optional JSON-serializable result, for instance the translation.
+        """
+        if stage not in STAGES:
+            raise ValueError('`stage` must be one of %s. Instead, was %s' % (STAGES, stage))
+        line = json.dumps({'stage': stage, 'word': word, 'succeeded': succeeded, 'value': value,
+                           'language': self._target_language})
+        with self._lock:
+            self._entries[stage][word] = (succeeded, value)
+            self._file.write(line + '\n')
+            self._file.flush()
+
+    def get(self, stage, word):
+        """Returns (succeeded, value) for `word` at `stage`, or `None` if it wasn't recorded."""
+        with self._lock:
+            return self._entries[stage].get(word)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""Test journal module."""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+import os
+import tempfile
+import unittest
+
+import journal
+
+
+class TestJournal(unittest.TestCase):
+
+    def test_resume(self):
+        path = os.path.join(tempfile.mkdtemp(), 'run.journal')
+        run_journal = journal.RunJournal(path)
+        run_journal.record('translation', 'water', True, ['water', 'agua'])
+        run_journal.record('audio', 'agua', False)
+        run_journal.close()
+        # Simulate the run dying partway through writing an entry.
+        with open(path, 'a') as f:
+            f.write('{"stage": "image", "wo')
+
+        run_journal = journal.RunJournal(path, resume=True)
+        self.assertEqual((True, ['water', 'agua']), run_journal.get('translation', 'water'))
+        self.assertEqual((False, None), run_journal.get('audio', 'agua'))
+        self.assertIsNone(run_journal.get('image', 'water'))
+        run_journal.record('image', 'water', True)
+        run_journal.close()
+        self.assertEqual((True, None), journal.RunJournal(path, resume=True).get('image', 'water'))
+
+        # Without `resume`, the journal starts over.
+        self.assertIsNone(journal.RunJournal(path).get('translation', 'water'))
+
+    def test_resume_ignores_other_target_languages(self):
+        path = os.path.join(tempfile.mkdtemp(), 'run.journal')
+        run_journal = journal.RunJournal(path, target_language='iw')
+        run_journal.record('translation', 'water', True, ['water', 'מים'])
+        run_journal.close()
+
+        self.assertIsNone(journal.RunJournal(path, resume=True, target_language='es').get('translation', 'water'))
+        self.assertEqual((True, ['water', 'מים']),
+                         journal.RunJournal(path, resume=True, target_language='iw').get('translation', 'water'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,18 @@
+"""Helpers for the JSON files that the program keeps between runs."""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+def to_utf8(value):
+    """Converts the strings in decoded JSON to utf-8 encoded `str`s.
+
+    JSON decodes strings as unicode, but the rest of the program expects utf-8 encoded `str`s. Strings inside lists and
+    dictionaries are converted too.
+    """
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, list):
+        return [to_utf8(x) for x in value]
+    if isinstance(value, dict):
+        return {to_utf8(k): to_utf8(v) for k, v in value.items()}
+    return value
@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""Test JSON utils module."""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+import json
+import unittest
+
+import json_utils
+
+
+class TestJsonUtils(unittest.TestCase):
+
+    def test_to_utf8(self):
+        value = json_utils.to_utf8(json.loads(json.dumps({'water': ['מים', 1, None]})))
+        self.assertDictEqual({'water': ['מים', 1, None]}, value)
+        self.assertIsInstance(value.keys()[0], str)
+        self.assertIsInstance(value['water'][0], str)
+
+
+if __name__ == '__main__':
+    unittest.main()
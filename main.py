@@ -2,7 +2,7 @@
 
 The program does the following:
 1) Parses a table from disk containing English words and/or foreign words.
-2) Translates the English words into a foreign language, and foreign words to English.
+2) Translates the English words into one or more foreign languages, and foreign words to English.
 3) Finds a representative image from the web or from disk. NOTE: We search images in English, not the translated
  language, for two reasons:
  a) English Image search is better than in most languages
@@ -10,7 +10,10 @@ The program does the following:
     images for `foreign` are incorrect.
 4) Finds a native speaker audio file for the word, from the web or from disk.
 5) Writes everything to a target directory.
-6) Writes a CSV with the card info that can be imported into an Anki deck.
+6) Writes a CSV with the card info that can be imported into an Anki deck, one for each foreign language.
+
+Since images are searched in English, several foreign languages share them. Each image is only fetched once, and the
+languages are translated and get their audio at the same time.
 '''
 
 
@@ -18,15 +21,36 @@ __author__ = 'shor.joel@gmail.com (Joel Shor)'
 
 
 import argparse
+import collections
 import csv
+import itertools
 import logging
 import os
+import threading
 
 import audio as audio_lib
+import bulk_copy
 from credentials import credentials
+import disk_cache
+import download_utils
+import forvo_utils
+import image_resize
 import images as images_lib
+import journal as journal_lib
+import media_index as media_index_lib
+import media_resolver
+import media_store as media_store_lib
+import metrics
+import mp3_utils
 import translation as translate_lib
 import anki_import_csv
+import apkg_writer
+import pipeline
+import rate_limit
+import sync_manifest as sync_manifest_lib
+
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.aeag')  # where caches live between runs
 
 
 class EasyAnkiArgParser(argparse.ArgumentParser):
@@ -40,13 +64,30 @@ class EasyAnkiArgParser(argparse.ArgumentParser):
         default='',
         help='The location of the input file. Must be a comma-separated CSV file. The format depends on other input '
              'arguments.')
+    self.add_argument(
+        '--target_languages',
+        default='iw',
+        help='A comma-separated list of Google Translate codes of the languages to make cards for, ex `iw,ar,es`. With '
+             'more than one, the image of each English word is fetched once and shared, the languages are translated '
+             'and get their audio at the same time, and each output filename gets the language code before its '
+             'extension. More than one needs an input of single words, and isn\'t supported with `--streaming`.')
 
     # Arguments controlling media behavior.
     self.add_argument(
         '--already_downloaded_media_dir',
         default='',
-        help='If non-empty, looks for appropriately named media in this folder (images and audio) instead of trying to '
-             'download them.')
+        help='If non-empty, looks for appropriately named media in this folder (images and audio) before trying to '
+             'download it. Media that isn\'t there is downloaded as usual.')
+    self.add_argument(
+        '--num_copy_workers',
+        type=int,
+        default=8,
+        help='With `--already_downloaded_media_dir`, the number of files to copy at once.')
+    self.add_argument(
+        '--disable_hardlinks',
+        action='store_true',
+        help='With `--already_downloaded_media_dir`, copy media instead of hardlinking it when both directories are on '
+             'the same filesystem. Use this if another program edits the files in either directory in place.')
     self.add_argument(
         '--disable_image_fetching',
         action='store_true',
@@ -57,6 +98,117 @@ class EasyAnkiArgParser(argparse.ArgumentParser):
         '--override_images',
         action='store_true',
         help='If `True`, copy over already existing images.')
+    self.add_argument(
+        '--num_image_workers',
+        type=int,
+        default=8,
+        help='The number of words to fetch images for at once.')
+    self.add_argument(
+        '--max_image_bytes',
+        type=int,
+        default=5 * 1024 * 1024,
+        help='Skip candidate images larger than this many bytes.')
+    self.add_argument(
+        '--num_racing_candidates',
+        type=int,
+        default=1,
+        help='The number of candidate images to download at once for each word. The first valid image is kept and '
+             'the rest are cancelled, so one slow host doesn\'t hold up a word. 1 tries candidates one at a time.')
+    self.add_argument(
+        '--resize_images',
+        action='store_true',
+        help='If `True`, shrink and recompress newly fetched or copied images that are bigger than a card needs. '
+             'Requires Pillow.')
+    self.add_argument(
+        '--max_image_dimension',
+        type=int,
+        default=480,
+        help='With `--resize_images`, the maximum width and height of images, in pixels.')
+    self.add_argument(
+        '--image_quality',
+        type=int,
+        default=85,
+        help='With `--resize_images`, the JPEG quality to recompress images with.')
+    self.add_argument(
+        '--image_budget_bytes',
+        type=int,
+        default=200 * 1024,
+        help='With `--resize_images`, images within `--max_image_dimension` and no larger than this are left alone.')
+    self.add_argument(
+        '--num_resize_processes',
+        type=int,
+        default=0,
+        help='With `--resize_images`, the number of processes to resize with. 0 means one per CPU.')
+    self.add_argument(
+        '--max_connections_per_host',
+        type=int,
+        default=4,
+        help='The maximum number of simultaneous downloads from any single host.')
+    self.add_argument(
+        '--http_timeout_secs',
+        type=float,
+        default=30,
+        help='The socket timeout for media and Forvo downloads.')
+    self.add_argument(
+        '--audio_method',
+        default='Forvo',
+        choices=['Forvo', 'ForvoPipelined'],
+        help='How to fetch audio. `ForvoPipelined` overlaps Forvo lookups and MP3 downloads across words.')
+    self.add_argument(
+        '--num_forvo_lookup_workers',
+        type=int,
+        default=4,
+        help='With `--audio_method=ForvoPipelined`, the number of Forvo lookups to run at once.')
+    self.add_argument(
+        '--num_audio_download_workers',
+        type=int,
+        default=4,
+        help='With `--audio_method=ForvoPipelined`, the number of MP3s to download at once.')
+    self.add_argument(
+        '--audio_queue_size',
+        type=int,
+        default=16,
+        help='With `--audio_method=ForvoPipelined`, the maximum number of MP3 links waiting to be downloaded. This '
+             'keeps lookups from running far ahead of downloads.')
+    self.add_argument(
+        '--clean_audio',
+        action='store_true',
+        help='If `True`, check that fetched MP3s are complete and well-formed, and strip their tags and leading and '
+             'trailing silence. Words whose MP3 is rejected are treated as having no audio.')
+    self.add_argument(
+        '--num_audio_processes',
+        type=int,
+        default=0,
+        help='With `--clean_audio`, the number of processes to clean MP3s with. 0 means one per CPU.')
+    self.add_argument(
+        '--streaming',
+        action='store_true',
+        help='If `True`, send each word through translation, image, and audio on its own, and append its row to the '
+             'Anki import CSV as soon as its card is done, instead of finishing each stage for every word first.')
+    self.add_argument(
+        '--num_streaming_workers',
+        type=int,
+        default=4,
+        help='With `--streaming`, the number of words each stage works on at once.')
+
+    # Arguments controlling how media is stored.
+    self.add_argument(
+        '--media_store_dir',
+        default='',
+        help='If non-empty, keep a single copy of each distinct media file, using a content-addressed store in this '
+             'directory. See `media_store.py`.')
+    self.add_argument(
+        '--media_store_mode',
+        default='hardlink',
+        choices=media_store_lib.MODES,
+        help='With `--media_store_dir`, how card filenames point at the single copy. `hardlink` requires the store to '
+             'be on the same filesystem as `--output_dir`. `manifest` makes cards refer to the copy directly.')
+    self.add_argument(
+        '--media_index_file',
+        default='',
+        help='If non-empty, save the list of files in `--output_dir` here, and reuse it on the next run if the '
+             'directory hasn\'t changed, instead of listing it again. It has to be outside `--output_dir`. See '
+             '`media_index.py`.')
 
     # Output arguments.
     self.add_argument(
@@ -67,6 +219,140 @@ class EasyAnkiArgParser(argparse.ArgumentParser):
         '--output_csv_file',
         default='',
         help='The location of the Anki import csv file to generate.')
+    self.add_argument(
+        '--output_apkg_file',
+        default='',
+        help='If non-empty, also write the cards and their media to this Anki package (.apkg), which Anki can import '
+             'directly, without going through its CSV importer. Can be used instead of `--output_csv_file`.')
+    self.add_argument(
+        '--deck_name',
+        default='AEAG',
+        help='With `--output_apkg_file`, the name of the deck to put the cards in. Use `::` for subdecks.')
+    self.add_argument(
+        '--metrics_out',
+        default='',
+        help='If non-empty, write timings of each stage and counts of retries and failures to this filename with a '
+             '`.json` suffix, and in the Prometheus text format with a `.prom` suffix.')
+
+    # Arguments for resuming interrupted runs.
+    self.add_argument(
+        '--journal_file',
+        default='',
+        help='Where to record the outcome of each word at each stage of the run. Defaults to `--output_csv_file` '
+             'with a `.journal` suffix. With several `--target_languages`, this records images, and each language '
+             'records the rest in its own journal.')
+    self.add_argument(
+        '--resume',
+        action='store_true',
+        help='If `True`, continue a previous run from its journal, skipping translations and media fetches that '
+             'already succeeded, or already failed.')
+
+    # Arguments for incremental runs.
+    self.add_argument(
+        '--sync_manifest_file',
+        default='',
+        help='If non-empty, record the card made from each input row here, and on later runs only process the rows '
+             'that are new or changed since. The outputs still have every card. Not supported with `--streaming`.')
+    self.add_argument(
+        '--delta_csv_file',
+        default='',
+        help='With `--sync_manifest_file`, where to write an Anki import csv of only the cards made in this run. '
+             'Defaults to `--output_csv_file` with a `.delta.csv` suffix.')
+
+    # Arguments for rate limits and quotas of external APIs.
+    self.add_argument(
+        '--translate_qps',
+        type=float,
+        default=10,
+        help='The maximum number of Translate API requests per second.')
+    self.add_argument(
+        '--translate_daily_chars',
+        type=int,
+        default=None,
+        help='The daily Translate API quota, in characters. If set, runs wait for the quota to reset once it\'s '
+             'used up.')
+    self.add_argument(
+        '--cse_qps',
+        type=float,
+        default=1.5,
+        help='The maximum number of Custom Search API queries per second.')
+    self.add_argument(
+        '--cse_daily_limit',
+        type=int,
+        default=None,
+        help='The daily Custom Search API quota, in queries. If set, runs wait for the quota to reset once it\'s used '
+             'up.')
+    self.add_argument(
+        '--forvo_qps',
+        type=float,
+        default=2,
+        help='The maximum number of Forvo API requests per second.')
+    self.add_argument(
+        '--forvo_daily_limit',
+        type=int,
+        default=None,
+        help='The daily Forvo API quota, in requests. If set, runs wait for the quota to reset once it\'s used up.')
+    self.add_argument(
+        '--quota_file',
+        default=os.path.join(DEFAULT_CACHE_DIR, 'quota.sqlite'),
+        help='Where to keep track of daily API usage between runs.')
+    self.add_argument(
+        '--fail_when_quota_exhausted',
+        action='store_true',
+        help='If `True`, fail when a daily quota is used up, instead of waiting for it to reset.')
+
+    # Cache arguments.
+    self.add_argument(
+        '--translation_cache_file',
+        default=os.path.join(DEFAULT_CACHE_DIR, 'translations.sqlite'),
+        help='Where to cache translations between runs, so that words we\'ve already translated don\'t use API '
+             'quota.')
+    self.add_argument(
+        '--translation_cache_max_entries',
+        type=int,
+        default=500000,
+        help='The maximum number of translations to cache. The least recently used ones are evicted first.')
+    self.add_argument(
+        '--disable_translation_cache',
+        action='store_true',
+        help='If `True`, always ask the Translate API, and don\'t read or write the translation cache.')
+    self.add_argument(
+        '--forvo_cache_file',
+        default=os.path.join(DEFAULT_CACHE_DIR, 'forvo.sqlite'),
+        help='Where to cache Forvo lookups between runs, including words that have no audio.')
+    self.add_argument(
+        '--forvo_found_ttl_hours',
+        type=float,
+        default=4,
+        help='How long to remember the Forvo audio link for a word. Forvo\'s links expire, so keep this short.')
+    self.add_argument(
+        '--forvo_not_found_ttl_days',
+        type=float,
+        default=7,
+        help='How long to remember that Forvo has no audio for a word.')
+    self.add_argument(
+        '--disable_forvo_cache',
+        action='store_true',
+        help='If `True`, always ask Forvo, and don\'t read or write the Forvo cache.')
+    self.add_argument(
+        '--image_search_cache_file',
+        default=os.path.join(DEFAULT_CACHE_DIR, 'image_search.sqlite'),
+        help='Where to cache image search results between runs. With `--override_images`, images that were used '
+             'before are skipped in favor of the next search result.')
+    self.add_argument(
+        '--image_search_ttl_days',
+        type=float,
+        default=30,
+        help='How long to remember the image search results for a word.')
+    self.add_argument(
+        '--image_search_cache_max_entries',
+        type=int,
+        default=200000,
+        help='The maximum number of image search entries to cache. The least recently used ones are evicted first.')
+    self.add_argument(
+        '--disable_image_search_cache',
+        action='store_true',
+        help='If `True`, always query the Custom Search API, and don\'t read or write the image search cache.')
 
     # Debug arguments.
     self.add_argument(
@@ -79,54 +365,84 @@ class EasyAnkiArgParser(argparse.ArgumentParser):
 NUM_INPUT_FILE_FIELDS = 3
 IMAGE_FILENAME_FORMAT = '{english}.png'  # image filename to write
 AUDIO_FILENAME_FORMAT = '{translation}.mp3'  # audio filename to write
+# Audio filename to write with several target languages, since two languages can spell a word alike.
+MULTI_LANGUAGE_AUDIO_FILENAME_FORMAT = '{translation}_{language}.mp3'
 
 class WordTranslationPairs(object):
-    """A thin wrapper around a list of tuples."""
+    """A list of (English, translation, extra info...) rows, indexed by English word and by translation.
+
+    Rows are stored as tuples, in input order. Lookups go through persistent indexes, so they're O(1). Removing a row
+    leaves a tombstone (`None`) in its place, so removal is O(1) too. The row list is compacted once tombstones
+    outnumber live rows.
+    """
     def __init__(self, tuple_list, english_index=0, translation_index=1):
         self._english_index = english_index
         self._translation_index = translation_index
-        self._tuple_list = self._normalize_tuple_list(tuple_list)
+        self._extra_info_indices = [i for i in range(NUM_INPUT_FILE_FIELDS)
+                                    if i not in (english_index, translation_index)]
+        self._rows = []
+        self._english_to_row = {}
+        self._translation_to_row = {}
+        self._num_tombstones = 0
+        for tpl in tuple_list:
+            self._append(self._normalize_tuple(tpl))
 
-    def _normalize_tuple_list(self, tuple_list):
+    def _normalize_tuple(self, tpl):
         """Make sure that tuples have the right number of elements."""
-        new_tuple_list = []
-        for tpl in tuple_list:
-            if len(tpl) != NUM_INPUT_FILE_FIELDS:
-                if len(tpl) == 2:
-                    # If we just have a word and a translation, make the rest
-                    # empty strings.
-                    new_tpl = [""] * NUM_INPUT_FILE_FIELDS
-                    new_tpl[self._english_index] = tpl[self._english_index]
-                    new_tpl[self._translation_index] = tpl[
-                        self._translation_index]
-                    tpl = tuple(new_tpl)
-                else:
-                    raise ValueError(
-                        "Tuple %s had %i fields instead of the expected "
-                        "number: %i" % (tpl, len(tpl), NUM_INPUT_FILE_FIELDS))
-            assert len(tpl) == NUM_INPUT_FILE_FIELDS
-            new_tuple_list.append(tpl)
-        return new_tuple_list
+        if len(tpl) != NUM_INPUT_FILE_FIELDS:
+            if len(tpl) == 2:
+                # If we just have a word and a translation, make the rest
+                # empty strings.
+                new_tpl = [""] * NUM_INPUT_FILE_FIELDS
+                new_tpl[self._english_index] = tpl[self._english_index]
+                new_tpl[self._translation_index] = tpl[
+                    self._translation_index]
+                tpl = new_tpl
+            else:
+                raise ValueError(
+                    "Tuple %s had %i fields instead of the expected "
+                    "number: %i" % (tpl, len(tpl), NUM_INPUT_FILE_FIELDS))
+        assert len(tpl) == NUM_INPUT_FILE_FIELDS
+        return tuple(tpl)
+
+    def _append(self, tpl):
+        row_index = len(self._rows)
+        self._rows.append(tpl)
+        self._english_to_row[tpl[self._english_index]] = row_index
+        self._translation_to_row[tpl[self._translation_index]] = row_index
+
+    def _compact(self):
+        """Drops tombstones and rebuilds the indexes."""
+        rows = self.data
+        self._rows = []
+        self._english_to_row = {}
+        self._translation_to_row = {}
+        self._num_tombstones = 0
+        for tpl in rows:
+            self._append(tpl)
+
+    def __len__(self):
+        return len(self._rows) - self._num_tombstones
 
     @property
     def english_words(self):
-        return [x[0] for x in self._tuple_list]
+        return [x[self._english_index] for x in self.data]
 
     @property
     def translations(self):
-        return [x[1] for x in self._tuple_list]
+        return [x[self._translation_index] for x in self.data]
 
     @property
     def data(self):
-        return self._tuple_list
+        return [x for x in self._rows if x is not None]
 
     @property
     def translation_dict(self):
-        return {x[self._english_index]: x[self._translation_index] for x in
-                self.data}
+        # Ordered, so that CSVs made from it keep the input order.
+        return collections.OrderedDict((x[self._english_index], x[self._translation_index]) for x in self.data)
 
     def get_translation(self, english_word):
-        return self.translation_dict[english_word]
+        return self._rows[self._english_to_row[english_word]][self._translation_index]
 
     @property
     def reverse_translation_dict(self):
@@ -134,64 +450,70 @@ class WordTranslationPairs(object):
                 self.data}
 
     def get_english(self, translated_word):
-        return self.reverse_translation_dict[translated_word]
+        return self._rows[self._translation_to_row[translated_word]][self._english_index]
 
     @property
     def extra_info(self):
-        extra_info_indices = range(NUM_INPUT_FILE_FIELDS)
-        extra_info_indices.remove(self._english_index)
-        extra_info_indices.remove(self._translation_index)
-        if extra_info_indices:
-            return {x[self._english_index]: [x[i] for i in extra_info_indices]
+        if self._extra_info_indices:
+            return {x[self._english_index]: [x[i] for i in self._extra_info_indices]
                     for x in self.data}
         else:
             return None
 
     def remove_translated_word(self, translated_word):
-        index = -1
-        for i in xrange(len(self._tuple_list)):
-            tup = self._tuple_list[i]
-            if tup[self._translation_index] == translated_word:
-                index = i
-                break
-        if index == -1:
+        if translated_word not in self._translation_to_row:
             raise ValueError('Tried to deleted translated word `%s`, but '
                              'couldn\'t find it in the word list.' %
                              translated_word)
-        del self._tuple_list[index]
+        row_index = self._translation_to_row.pop(translated_word)
+        english_word = self._rows[row_index][self._english_index]
+        if self._english_to_row.get(english_word) == row_index:
+            del self._english_to_row[english_word]
+        self._rows[row_index] = None
+        self._num_tombstones += 1
+        if self._num_tombstones > len(self):
+            self._compact()
 
 
-def _num_elements_in_first_row(input_filename, delimiter=","):
-    """Parses input file and returns a `WordTranslationPairs`."""
+def _iter_csv_rows(input_filename, delimiter=","):
+    """Yields the rows of a CSV file one at a time, without reading the whole file into memory."""
     with open(input_filename, 'r') as f:
-        lines = f.readlines()
-    reader = csv.reader(lines, delimiter=delimiter, doublequote=True)
-    return sum([x != '' for x in reader.next()])
+        for row in csv.reader(f, delimiter=delimiter, doublequote=True):
+            yield row
+
+
+def _peek_csv_rows(input_filename, delimiter=","):
+    """Infers the input format from the first row, without reading the file twice.
+
+    Returns:
+        A 2-tuple of (number of non-empty elements in the first row, iterator over all rows, including the first).
+    """
+    rows = _iter_csv_rows(input_filename, delimiter=delimiter)
+    first_row = next(rows, None)
+    if first_row is None:
+        raise ValueError('Input file `%s` is empty.' % input_filename)
+    return sum([x != '' for x in first_row]), itertools.chain([first_row], rows)
 
 
 def parse_word_translation_csv(input_filename, delimiter=","):
     """Parses input file and returns a `WordTranslationPairs`."""
-    with open(input_filename, 'r') as f:
-        lines = f.readlines()
-    reader = csv.reader(lines, delimiter=delimiter, doublequote=True)
-    word_translation_pairs = [row for row in reader]
-    return WordTranslationPairs(word_translation_pairs)
+    return WordTranslationPairs(_iter_csv_rows(input_filename, delimiter=delimiter))
+
+
+def _iter_single_words(rows):
+    for row in rows:
+        if len(row) > 1:
+            raise ValueError('Malformed input: %s' % row)
+        yield row[0]
 
 
 def parse_single_word_csv(input_filename):
-    with open(input_filename, 'r') as f:
-        lines = f.readlines()
-    reader = csv.reader(lines, doublequote=True)
-    single_word = [row for row in reader]
-    for word in single_word:
-        if len(word) > 1:
-            raise ValueError('Malformed input: %s' % word)
-    return [x[0] for x in single_word]
+    return list(_iter_single_words(_iter_csv_rows(input_filename)))
 
 
-def _files_exist(filename_list):
+def _files_exist(filename_list, media_index=None):
     for filename in filename_list:
-        if not os.path.exists(filename):
+        if not (media_index.exists(filename) if media_index else os.path.exists(filename)):
             raise ValueError('`%s` should have existed, but it doesn\'t.' %
                              filename)
 
@@ -207,32 +529,43 @@ def _remove_words(english_words_to_remove, filenames_to_write_auds,
         word_translation_pairs.remove_translated_word(translated_word)
 
 
-def remove_existing_filenames(full_filenames, target_dir):
+def remove_existing_filenames(full_filenames, target_dir, media_index=None):
     """Removes arguments corresponding to media that already exists.
 
     Args:
         full_filenames: A dictionary of {word: filenames}.
         target_dir: The directory to check for name collisions.
+        media_index: A `media_index.MediaIndex` of `target_dir`. If `None`, `target_dir` is listed once here.
 
     Raises:
         ValueError: If any file in `target_dir` has the same basename as any
             files in `full_filenames`.
     """
+    media_index = media_index or media_index_lib.MediaIndex(target_dir)
     basenames = {k: os.path.basename(v) for k, v in full_filenames.items()}
     for word, basename in basenames.items():
-        if os.path.isfile(os.path.join(target_dir, basename)):
+        if media_index.has_basename(basename):
             del full_filenames[word]
             logging.info('%s already exists, so removing %s from current '
                          'search.' % (basename, word))
 
 
-def _write_csv_rows(csv_rows, output_csv_file):
+def _csv_writer(csvfile):
     # We need to set a custom dialect to avoid double-quoting quotation marks.
     csv.register_dialect(
         'mydialect', delimiter=';', doublequote=False, quotechar='\'')
+    return csv.writer(csvfile, dialect='mydialect')
+
+
+def _write_csv_rows(csv_rows, output_csv_file, chunk_size=10000):
+    """Writes an iterable of rows, `chunk_size` rows at a time, so a generator of rows is never fully in memory."""
+    csv_rows = iter(csv_rows)
     with open(output_csv_file, 'w') as csvfile:
-        writer = csv.writer(csvfile, dialect='mydialect')
-        writer.writerows(csv_rows)
+        writer = _csv_writer(csvfile)
+        for chunk in iter(lambda: list(itertools.islice(csv_rows, chunk_size)), []):
+            with metrics.timer('csv_write'):
+                writer.writerows(chunk)
+            metrics.increment('cards_written', len(chunk))
 
 
 def _check_unique(translated_words_no_diacritics):
@@ -245,98 +578,825 @@ def _all_unique(word_list):
     return len(word_list) == len(set(word_list))
 
 
-def main(argv=None):
-    del argv
+def _make_translation_cache():
+    if FLAGS.disable_translation_cache:
+        return None
+    return disk_cache.DiskCache(FLAGS.translation_cache_file, max_entries=FLAGS.translation_cache_max_entries)
+
+
+def _make_journal(journal_file, target_language=None):
+    return journal_lib.RunJournal(journal_file, resume=FLAGS.resume, target_language=target_language)
+
 
+def _default_journal_file():
+    return FLAGS.journal_file or (FLAGS.output_csv_file or FLAGS.output_apkg_file) + '.journal'
+
+
+def _get_translations(single_words, target_language, translation_cache, run_journal):
+    """Like `translate_lib.get_translations`, but reuses and records translations in the run journal."""
+    journaled_pairs = []
+    words_to_translate = []
+    for word in single_words:
+        entry = run_journal.get('translation', word)
+        if entry and entry[0]:
+            journaled_pairs.append(tuple(entry[1]))
+        else:
+            words_to_translate.append(word)
+    if journaled_pairs:
+        logging.info('Reusing %i translations from the journal.', len(journaled_pairs))
+    if not words_to_translate:
+        return tuple(zip(*journaled_pairs)) or ((), ())
+
+    english_words, translated_words = translate_lib.get_translations(
+        words_to_translate, credentials, target_language=target_language, cache=translation_cache)
+    # `get_translations` reorders the words, so match each pair back up with the input word it came from.
+    words_to_translate = set(words_to_translate)
+    for english_word, translated_word in zip(english_words, translated_words):
+        word = english_word if english_word in words_to_translate else translated_word
+        run_journal.record('translation', word, True, [english_word, translated_word])
+    english_words, translated_words = zip(*(journaled_pairs + zip(english_words, translated_words)))
+    return english_words, translated_words
+
+
+def _strip_diacritics(translated_words, language):
+    """Like `translate_lib.strip_diacritics`, but leaves words alone in languages without a table of marks."""
+    if not translate_lib.has_diacritic_marks(language):
+        return list(translated_words)
+    return translate_lib.strip_diacritics(translated_words, language=language)
+
+
+def _skip_journaled_words(run_journal, stage, filenames_to_fetch, media_index):
+    """Removes words that already have an outcome at `stage` from the fetch list.
+
+    NOTE: This function modifies the last argument.
+
+    Returns:
+        A list of words that failed at `stage` in a previous run.
+    """
+    words_that_failed = []
+    for word, filename in filenames_to_fetch.items():
+        entry = run_journal.get(stage, word)
+        if entry is None:
+            continue
+        succeeded, _ = entry
+        if succeeded and not media_index.exists(filename):
+            # The file has since been removed, so fetch it again.
+            continue
+        del filenames_to_fetch[word]
+        if not succeeded:
+            words_that_failed.append(word)
+    return words_that_failed
+
+
+def _record_fetches(run_journal, stage, filenames_fetched, words_that_failed):
+    words_that_failed = set(words_that_failed)
+    for word in filenames_fetched:
+        run_journal.record(stage, word, word not in words_that_failed)
+
+
+def _copy_methods():
+    if FLAGS.disable_hardlinks:
+        return tuple(method for method in bulk_copy.METHODS if method != 'hardlink')
+    return bulk_copy.METHODS
+
+
+def _make_media_index():
+    return media_index_lib.MediaIndex(FLAGS.output_dir, index_file=FLAGS.media_index_file or None)
+
+
+def _record_written(media_index, filenames_written, words_that_failed=()):
+    words_that_failed = set(words_that_failed)
+    for word, filename in filenames_written.items():
+        if word not in words_that_failed:
+            media_index.add(filename)
+
+
+def _resize_images(filenames, num_processes=None):
+    with metrics.timer('image_resize'):
+        num_resized = image_resize.resize_images(
+            filenames,
+            max_dimension=FLAGS.max_image_dimension,
+            quality=FLAGS.image_quality,
+            max_bytes=FLAGS.image_budget_bytes,
+            num_processes=num_processes or FLAGS.num_resize_processes or None)
+    logging.info('Resized %i of %i images.', num_resized, len(filenames))
+
+
+def _clean_audio(filenames_fetched, words_that_failed, media_index, num_processes=None):
+    """Validates and trims freshly fetched MP3s.
+
+    Rejected MP3s are removed, so they aren't mistaken for good audio by a later run.
+
+    Returns:
+        A list of words whose MP3 was rejected.
+    """
+    words_that_failed = set(words_that_failed)
+    fetched = {filename: word for word, filename in filenames_fetched.items() if word not in words_that_failed}
+    with metrics.timer('audio_clean'):
+        rejected_filenames = mp3_utils.clean_mp3s(
+            fetched.keys(), num_processes=num_processes or FLAGS.num_audio_processes or None)
+    metrics.increment('audio_rejections', len(rejected_filenames))
+    for filename in rejected_filenames:
+        if os.path.exists(filename):
+            os.remove(filename)
+        media_index.discard(filename)
+    logging.info('Cleaned %i MP3s, and rejected %i.', len(fetched) - len(rejected_filenames), len(rejected_filenames))
+    return [fetched[filename] for filename in rejected_filenames]
+
+
+def _make_media_store():
+    if not FLAGS.media_store_dir:
+        return None
+    return media_store_lib.MediaStore(FLAGS.media_store_dir, mode=FLAGS.media_store_mode)
+
+
+def _resolve_from_media_store(media_store, filenames_to_write, filenames_to_fetch):
+    """Points cards at media the store already has, and doesn't fetch that media again.
+
+    NOTE: This function modifies both arguments.
+    """
+    for word, filename in filenames_to_write.items():
+        resolved_filename = media_store.resolve(filename)
+        if resolved_filename != filename:
+            filenames_to_write[word] = resolved_filename
+            if word in filenames_to_fetch:
+                del filenames_to_fetch[word]
+
+
+def _add_to_media_store(media_store, filenames_to_write, filenames_fetched, media_index):
+    """Adds freshly fetched media to the store, and points cards at whatever the store says.
+
+    NOTE: This function modifies the first argument.
+    """
+    for word, filename in filenames_fetched.items():
+        if word in filenames_to_write and media_index.exists(filename):
+            filenames_to_write[word] = _add_file_to_media_store(media_store, filename, media_index)
+
+
+def _add_file_to_media_store(media_store, filename, media_index):
+    """Adds `filename` to the store, and returns the filename a card should refer to."""
+    store_filename = media_store.add(filename)
+    if store_filename != filename:
+        # In `manifest` mode, the file is moved into the store.
+        media_index.discard(filename)
+        media_index.add(store_filename)
+    return store_filename
+
+
+def _make_mp3_link_cache():
+    if FLAGS.disable_forvo_cache:
+        return None
+    secs_per_hour = 60 * 60
+    return forvo_utils.Mp3LinkCache(
+        FLAGS.forvo_cache_file,
+        found_ttl_secs=FLAGS.forvo_found_ttl_hours * secs_per_hour,
+        not_found_ttl_secs=FLAGS.forvo_not_found_ttl_days * secs_per_hour * 24)
+
+
+def _configure_rate_limits():
+    accountant = rate_limit.QuotaAccountant(FLAGS.quota_file)
+    for service, rate_per_sec, daily_limit in (
+            ('translate', FLAGS.translate_qps, FLAGS.translate_daily_chars),
+            ('cse', FLAGS.cse_qps, FLAGS.cse_daily_limit),
+            ('forvo', FLAGS.forvo_qps, FLAGS.forvo_daily_limit)):
+        rate_limit.configure_limiter(
+            service,
+            rate_per_sec=rate_per_sec,
+            daily_limit=daily_limit,
+            accountant=accountant,
+            wait_for_quota=not FLAGS.fail_when_quota_exhausted)
+
+
+def _make_image_search_cache():
+    if FLAGS.disable_image_search_cache:
+        return None
+    return images_lib.SearchResultCache(
+        FLAGS.image_search_cache_file,
+        ttl_secs=FLAGS.image_search_ttl_days * 60 * 60 * 24,
+        max_entries=FLAGS.image_search_cache_max_entries)
+
+
+def _make_sync_manifest(target):
+    if not target.sync_manifest_file:
+        return None
+    return sync_manifest_lib.SyncManifest(
+        target.sync_manifest_file, target_language=target.language, output_dir=FLAGS.output_dir)
+
+
+def _delta_csv_file(target):
+    if target.delta_csv_file or not target.output_csv_file:
+        return target.delta_csv_file
+    return os.path.splitext(target.output_csv_file)[0] + '.delta.csv'
+
+
+def _sync_entry_is_usable(entry, media_index):
+    """Whether the card recorded for an unchanged row still has its media."""
+    return ((FLAGS.disable_image_fetching or media_index.exists(entry['image_filename'])) and
+            media_index.exists(entry['audio_filename']))
+
+
+def _add_unchanged_rows(row_hashes, rows_processed, unchanged_rows, word_translation_pairs, filenames_to_write_imgs,
+                        filenames_to_write_auds):
+    """Combines the cards made in this run with the cards of rows that haven't changed since the last run.
+
+    NOTE: This function modifies the last two arguments.
+
+    Args:
+        row_hashes: The hash of every input row, in input order.
+        rows_processed: A list of (row hash, row) pairs that were processed in this run.
+        unchanged_rows: A list of (row hash, manifest entry) pairs that weren't.
+        word_translation_pairs: The `WordTranslationPairs` made in this run.
+        filenames_to_write_imgs: A dictionary of {English word: image filename} made in this run.
+        filenames_to_write_auds: A dictionary of {translated word: audio filename} made in this run.
+
+    Returns:
+        A 2-tuple of (`WordTranslationPairs` with every card in input order, dictionary of {row hash: manifest entry}
+        for every card).
+    """
+    english_words = set(word_translation_pairs.english_words)
+    translations = set(word_translation_pairs.translations)
+    extra_info = word_translation_pairs.extra_info or {}
+    manifest_entries = dict(unchanged_rows)
+    for digest, row in rows_processed:
+        # Single words might have been translated either way.
+        word = row[0]
+        if word in english_words:
+            english_word = word
+        elif word in translations:
+            english_word = word_translation_pairs.get_english(word)
+        else:
+            # The row didn't make a card, so try it again next time.
+            continue
+        translated_word = word_translation_pairs.get_translation(english_word)
+        manifest_entries[digest] = sync_manifest_lib.make_entry(
+            english_word, translated_word, filenames_to_write_imgs[english_word],
+            filenames_to_write_auds[translated_word], extra_info.get(english_word, ()))
+
+    for _, entry in unchanged_rows:
+        filenames_to_write_imgs[entry['english']] = entry['image_filename']
+        filenames_to_write_auds[entry['translation']] = entry['audio_filename']
+    rows = []
+    for digest in row_hashes:
+        entry = manifest_entries.get(digest)
+        if entry is not None:
+            rows.append((entry['english'], entry['translation']) + tuple(entry['extra_info']))
+    metrics.increment('sync_rows_unchanged', len(unchanged_rows))
+    metrics.increment('sync_rows_processed', len(rows_processed))
+    return WordTranslationPairs(rows), manifest_entries
+
+
+def _make_apkg_writer(target):
+    if not target.output_apkg_file:
+        return None
+    return apkg_writer.ApkgWriter(target.output_apkg_file, target.deck_name)
+
+
+def _make_local_media_index():
+    if not FLAGS.already_downloaded_media_dir:
+        return None
+    return media_index_lib.MediaIndex(FLAGS.already_downloaded_media_dir)
+
+
+def _target_languages():
+    return [language.strip() for language in FLAGS.target_languages.split(',') if language.strip()]
+
+
+def _add_language_suffix(filename, language):
+    """Puts the language code before the extension, ex `out.csv` becomes `out_es.csv`."""
+    if not filename:
+        return filename
+    root, extension = os.path.splitext(filename)
+    return '%s_%s%s' % (root, language, extension)
+
+
+class _Target(object):
+    """One target language, and where to write its cards.
+
+    With several target languages, each output filename and audio filename gets the language code, and each language
+    gets its own subdeck.
+
+    Args:
+        language: The Google Translate code of the language.
+        several_languages: Whether the run has other target languages too.
+    """
+
+    def __init__(self, language, several_languages):
+        add_suffix = lambda filename: _add_language_suffix(filename, language) if several_languages else filename
+        self.language = language
+        self.forvo_language = forvo_utils.forvo_language(language)
+        self.output_csv_file = add_suffix(FLAGS.output_csv_file)
+        self.output_apkg_file = add_suffix(FLAGS.output_apkg_file)
+        self.deck_name = '%s::%s' % (FLAGS.deck_name, language) if several_languages else FLAGS.deck_name
+        self.journal_file = (
+            add_suffix(FLAGS.journal_file) or (self.output_csv_file or self.output_apkg_file) + '.journal')
+        self.sync_manifest_file = add_suffix(FLAGS.sync_manifest_file)
+        self.delta_csv_file = add_suffix(FLAGS.delta_csv_file)
+        self._audio_filename_format = (
+            MULTI_LANGUAGE_AUDIO_FILENAME_FORMAT if several_languages else AUDIO_FILENAME_FORMAT)
+
+    def audio_filename(self, translation):
+        return os.path.join(FLAGS.output_dir, self._audio_filename_format.format(
+            translation=translation, language=self.language))
+
+
+class _SharedResources(object):
+    """The caches and media directories that every target language of a run shares."""
+
+    def __init__(self):
+        self.translation_cache = _make_translation_cache()
+        self.mp3_link_cache = _make_mp3_link_cache()
+        self.image_search_cache = _make_image_search_cache()
+        self.media_index = _make_media_index()
+        self.local_media_index = _make_local_media_index()
+        self.media_store = _make_media_store()
+
+    def save(self):
+        if self.media_store:
+            self.media_store.save()
+        self.media_index.save()
+
+
+def _journal_tier(run_journal, stage, media_index):
+    """Returns a tier for words that an earlier run already fetched media for, or found had none."""
+    def _resolve(filenames_to_fetch):
+        not_journaled = dict(filenames_to_fetch)
+        words_that_failed = _skip_journaled_words(run_journal, stage, not_journaled, media_index)
+        return ([word for word in filenames_to_fetch if word not in not_journaled and word not in words_that_failed],
+                words_that_failed)
+    return media_resolver.Tier('journal', _resolve)
+
+
+def _resolved_words(filenames_to_fetch, words_that_failed):
+    words_that_failed = set(words_that_failed)
+    return [word for word in filenames_to_fetch if word not in words_that_failed]
+
+
+def _make_image_tiers(run_journal, resources, num_workers):
+    """Returns the places to get images from: already downloaded media, the journal, and then the web."""
+
+    def _fetch(filenames_to_fetch):
+        words_that_failed = images_lib.get_images(
+            filenames_to_fetch, credentials,
+            num_workers=num_workers,
+            max_image_bytes=FLAGS.max_image_bytes,
+            num_racing_candidates=FLAGS.num_racing_candidates,
+            search_cache=resources.image_search_cache,
+            skip_used_links=FLAGS.override_images)
+        _record_fetches(run_journal, 'image', filenames_to_fetch, words_that_failed)
+        return _resolved_words(filenames_to_fetch, words_that_failed), words_that_failed
+
+    tiers = []
+    if resources.local_media_index:
+        tiers.append(media_resolver.local_dir_tier(
+            FLAGS.already_downloaded_media_dir, images_lib.DOWNLOADED_FILENAME_FORMAT,
+            media_index=resources.local_media_index, num_workers=FLAGS.num_copy_workers, methods=_copy_methods()))
+    return tiers + [_journal_tier(run_journal, 'image', resources.media_index), media_resolver.Tier('network', _fetch)]
+
+
+def _audio_method_kwargs():
+    """Returns the keyword arguments that only `--audio_method` takes."""
+    if FLAGS.audio_method == 'ForvoPipelined':
+        return {
+            'num_lookup_workers': FLAGS.num_forvo_lookup_workers,
+            'num_download_workers': FLAGS.num_audio_download_workers,
+            'queue_size': FLAGS.audio_queue_size,
+        }
+    return {}
+
+
+def _make_audio_tiers(run_journal, resources, target, num_processes=None):
+    """Returns the places to get audio from: already downloaded media, the journal, and then the web."""
+    def _fetch(filenames_to_fetch):
+        words_that_failed = audio_lib.get_audio(
+            filenames_to_fetch, credentials, method=FLAGS.audio_method, mp3_link_cache=resources.mp3_link_cache,
+            language=target.forvo_language, **_audio_method_kwargs())
+        if FLAGS.clean_audio:
+            words_that_failed.extend(
+                _clean_audio(filenames_to_fetch, words_that_failed, resources.media_index, num_processes))
+        _record_fetches(run_journal, 'audio', filenames_to_fetch, words_that_failed)
+        return _resolved_words(filenames_to_fetch, words_that_failed), words_that_failed
+
+    tiers = []
+    if resources.local_media_index:
+        tiers.append(media_resolver.local_dir_tier(
+            FLAGS.already_downloaded_media_dir, audio_lib.downloaded_filename_format(target.forvo_language),
+            media_index=resources.local_media_index, num_workers=FLAGS.num_copy_workers, methods=_copy_methods()))
+    return tiers + [_journal_tier(run_journal, 'audio', resources.media_index), media_resolver.Tier('network', _fetch)]
+
+
+class _Card(object):
+    """One flashcard as it moves through the streaming pipeline."""
+
+    def __init__(self, english, translation, extra_info, target):
+        self.english = english
+        self.translation = translation
+        self.extra_info = extra_info
+        self.image_filename = os.path.join(FLAGS.output_dir, IMAGE_FILENAME_FORMAT.format(english=english))
+        self.audio_filename = target.audio_filename(translation)
+
+
+def _main_streaming(target, resources):
+    """Like `_main_batch`, but each word goes through every stage on its own.
+
+    Words that fail to get an image or audio are dropped with a warning, as in `_main_batch`. Words whose English or
+    translation duplicates an earlier word are also dropped with a warning, since we can't know about duplicates up
+    front.
+    """
+    media_store = resources.media_store
+    media_index = resources.media_index
+    run_journal = _make_journal(target.journal_file, target.language)
+    image_tiers = _make_image_tiers(run_journal, resources, num_workers=1)
+    audio_tiers = _make_audio_tiers(run_journal, resources, target, num_processes=1)
+    lock = threading.Lock()
+    seen_english_words = set()
+    seen_translations = set()
+
+    def _check_unique_and_claim(card):
+        with lock:
+            if card.english in seen_english_words or card.translation in seen_translations:
+                logging.warning('Dropping duplicate word: %s / %s', card.english, card.translation)
+                return None
+            seen_english_words.add(card.english)
+            seen_translations.add(card.translation)
+        return card
+
+    def _translate(word):
+        english_words, translated_words = _get_translations(
+            [word], target.language, resources.translation_cache, run_journal)
+        translated_word_no_diacritics, = _strip_diacritics(translated_words, target.language)
+        return _check_unique_and_claim(
+            _Card(english_words[0], translated_word_no_diacritics, [translated_words[0]], target))
+
+    def _from_row(row):
+        english, translation, extra_info = WordTranslationPairs([row]).data[0]
+        return _check_unique_and_claim(_Card(english, translation, [extra_info], target))
+
+    def _fetch_image(card):
+        if FLAGS.disable_image_fetching:
+            return card
+        if not FLAGS.override_images:
+            if media_index.exists(card.image_filename):
+                return card
+            if media_store and media_store.resolve(card.image_filename) != card.image_filename:
+                card.image_filename = media_store.resolve(card.image_filename)
+                return card
+        filenames_to_fetch = {card.english: card.image_filename}
+        if media_resolver.resolve_media(filenames_to_fetch, image_tiers, 'image'):
+            logging.warning('Couldn\'t find image for: %s / %s', card.english, card.translation)
+            metrics.increment('words_without_image')
+            return None
+        _record_written(media_index, filenames_to_fetch)
+        if FLAGS.resize_images:
+            _resize_images([card.image_filename], num_processes=1)
+        if media_store:
+            card.image_filename = _add_file_to_media_store(media_store, card.image_filename, media_index)
+        return card
+
+    def _fetch_audio(card):
+        if media_index.exists(card.audio_filename):
+            return card
+        if media_store and media_store.resolve(card.audio_filename) != card.audio_filename:
+            card.audio_filename = media_store.resolve(card.audio_filename)
+            return card
+        filenames_to_fetch = {card.translation: card.audio_filename}
+        if media_resolver.resolve_media(filenames_to_fetch, audio_tiers, 'audio'):
+            logging.warning('Couldn\'t find audio for:  %s / %s', card.english, card.translation)
+            metrics.increment('words_without_audio')
+            return None
+        _record_written(media_index, filenames_to_fetch)
+        if media_store:
+            card.audio_filename = _add_file_to_media_store(media_store, card.audio_filename, media_index)
+        return card
+
+    # Read the input lazily, so that memory use doesn't grow with the size of the word list.
+    num_elements_in_first_row, rows = _peek_csv_rows(FLAGS.input_file)
+    if num_elements_in_first_row == 1:
+        words = _iter_single_words(rows)
+        first_stage = pipeline.Stage('translate', _translate, FLAGS.num_streaming_workers)
+    else:
+        words = rows
+        first_stage = pipeline.Stage('parse', _from_row)
+    stages = [
+        first_stage,
+        pipeline.Stage('image', _fetch_image, FLAGS.num_streaming_workers),
+        pipeline.Stage('audio', _fetch_audio, FLAGS.num_streaming_workers),
+    ]
+
+    csvfile = open(target.output_csv_file, 'w') if target.output_csv_file else None
+    writer = _csv_writer(csvfile) if csvfile else None
+    package = _make_apkg_writer(target)
+
+    def _write_row(card):
+        if writer:
+            csv_rows = anki_import_csv.make_csv_format(
+                {card.english: card.translation},
+                {card.english: card.image_filename},
+                {card.translation: card.audio_filename},
+                extra_info={card.english: card.extra_info})
+            with metrics.timer('csv_write'):
+                writer.writerows(csv_rows)
+                csvfile.flush()
+        if package is not None:
+            package.add_note(card.english, card.translation, card.image_filename, card.audio_filename,
+                             card.extra_info)
+        metrics.increment('cards_written')
+        logging.info('Wrote card: %s / %s', card.english, card.translation)
+
+    try:
+        num_cards = pipeline.run_pipeline(words, stages, _write_row)
+    except:
+        if package is not None:
+            package.discard()
+        raise
+    finally:
+        if csvfile:
+            csvfile.close()
+    if package is not None:
+        package.close()
+        logging.warning('Wrote %i cards to Anki package: %s', num_cards, target.output_apkg_file)
+    run_journal.close()
+    if csvfile:
+        logging.warning('Wrote %i cards to Anki import csv: %s', num_cards, target.output_csv_file)
+
+
+def _get_images(english_words, run_journal, resources):
+    """Gets an image for each English word from the cheapest place that has it, and readies it for a card.
+
+    Images come from already downloaded media, then what earlier runs recorded in the journal, and then the web. New
+    images are resized and added to the media store, if those are on.
+
+    Returns:
+        A 2-tuple of (dictionary of {English word: image filename} for words with an image, list of English words
+        without one).
+    """
+    # Determine full filename where images should be written to. If the image is already fetched, we still want to
+    # write it to the CSV, but we don't want to fetch it.
+    filenames_to_write_imgs = {
+        word: os.path.join(FLAGS.output_dir, IMAGE_FILENAME_FORMAT.format(english=word)) for word in english_words}
+    if FLAGS.disable_image_fetching:
+        return filenames_to_write_imgs, []
+    filenames_to_fetch_imgs = dict(filenames_to_write_imgs)
+    if not FLAGS.override_images:
+        # NOTE: These functions modify their arguments.
+        remove_existing_filenames(filenames_to_fetch_imgs, FLAGS.output_dir, resources.media_index)
+        if resources.media_store:
+            _resolve_from_media_store(resources.media_store, filenames_to_write_imgs, filenames_to_fetch_imgs)
+
+    words_without_imgs = media_resolver.resolve_media(
+        filenames_to_fetch_imgs, _make_image_tiers(run_journal, resources, num_workers=FLAGS.num_image_workers),
+        'image')
+    _record_written(resources.media_index, filenames_to_fetch_imgs, words_without_imgs)
+    for english_word in words_without_imgs:
+        del filenames_to_write_imgs[english_word]
+
+    # Shrink new images to what a card needs.
+    if FLAGS.resize_images:
+        _resize_images([filename for word, filename in filenames_to_fetch_imgs.items()
+                        if word in filenames_to_write_imgs and resources.media_index.exists(filename)])
+    # Keep a single copy of each distinct image.
+    if resources.media_store:
+        _add_to_media_store(
+            resources.media_store, filenames_to_write_imgs, filenames_to_fetch_imgs, resources.media_index)
+    _files_exist(filenames_to_write_imgs.values(), resources.media_index)
+    return filenames_to_write_imgs, words_without_imgs
+
+
+def _get_audio(translations, run_journal, resources, target):
+    """Like `_get_images`, but for the audio of each translated word.
+
+    Returns:
+        A 2-tuple of (dictionary of {translated word: audio filename} for words with audio, list of translated words
+        without it).
+    """
+    filenames_to_write_auds = {word: target.audio_filename(word) for word in translations}
+    filenames_to_fetch_auds = dict(filenames_to_write_auds)
+    remove_existing_filenames(filenames_to_fetch_auds, FLAGS.output_dir, resources.media_index)
+    if resources.media_store:
+        _resolve_from_media_store(resources.media_store, filenames_to_write_auds, filenames_to_fetch_auds)
+
+    words_without_audio = media_resolver.resolve_media(
+        filenames_to_fetch_auds, _make_audio_tiers(run_journal, resources, target), 'audio')
+    _record_written(resources.media_index, filenames_to_fetch_auds, words_without_audio)
+    for translated_word in words_without_audio:
+        del filenames_to_write_auds[translated_word]
+
+    if resources.media_store:
+        _add_to_media_store(
+            resources.media_store, filenames_to_write_auds, filenames_to_fetch_auds, resources.media_index)
+    _files_exist(filenames_to_write_auds.values(), resources.media_index)
+    return filenames_to_write_auds, words_without_audio
+
+
+class _SharedImages(object):
+    """Gets the image of each English word once, however many target languages ask for it.
+
+    Target languages call `get` from their own threads. Words that another language already got are answered from
+    memory, and words that another language is still getting are waited for.
+
+    Args:
+        run_journal: The `journal.RunJournal` to record image fetches in.
+        resources: The run's `_SharedResources`.
+    """
+
+    def __init__(self, run_journal, resources):
+        self._run_journal = run_journal
+        self._resources = resources
+        self._lock = threading.Lock()
+        self._filenames = {}  # {English word: image filename, or `None` if it has no image}
+        self._pending = {}  # {English word: `threading.Event` that's set once another thread got it}
+
+    def get(self, english_words):
+        """Like `_get_images`."""
+        words_to_get, events_to_wait_for = [], []
+        with self._lock:
+            for word in set(english_words):
+                if word in self._pending:
+                    events_to_wait_for.append(self._pending[word])
+                elif word not in self._filenames:
+                    self._pending[word] = threading.Event()
+                    words_to_get.append(word)
+        filenames = None
+        try:
+            filenames, _ = _get_images(words_to_get, self._run_journal, self._resources)
+        finally:
+            # Wake up the threads waiting for these words even if this failed, so they can fail too.
+            with self._lock:
+                for word in words_to_get:
+                    if filenames is not None:
+                        self._filenames[word] = filenames.get(word)
+                    self._pending.pop(word).set()
+        for event in events_to_wait_for:
+            event.wait()
+
+        filenames_to_write_imgs, words_without_imgs = {}, []
+        with self._lock:
+            for word in english_words:
+                if word not in self._filenames:
+                    raise RuntimeError('Another target language failed to get the image for `%s`.' % word)
+                if self._filenames[word] is None:
+                    words_without_imgs.append(word)
+                else:
+                    filenames_to_write_imgs[word] = self._filenames[word]
+        return filenames_to_write_imgs, words_without_imgs
+
+
+def _main_batch(target, run_journal, resources, get_images):
+    """Makes the cards for one target language, finishing each stage for every word before the next.
+
+    Args:
+        target: The `_Target` to make cards for.
+        run_journal: The target's `journal.RunJournal`.
+        resources: The run's `_SharedResources`.
+        get_images: A function like `_get_images`, of just the English words.
+    """
     # Parse input CSV file. Infer the expected format by peaking at the number
     # of elements in the first line.
-    if _num_elements_in_first_row(FLAGS.input_file) == 1:
-        single_words = parse_single_word_csv(FLAGS.input_file)
-        english_words, translated_words = translate_lib.get_translations(
-            single_words, credentials)
-        logging.info('Translated %i words.' % len(translated_words))
-        translated_words_no_diacritics = translate_lib.strip_diacritics(
-            translated_words)
+    media_index = resources.media_index
+    num_elements_in_first_row, rows = _peek_csv_rows(FLAGS.input_file)
+    sync_manifest = _make_sync_manifest(target)
+    if sync_manifest is not None:
+        rows = list(rows)
+        row_hashes = [sync_manifest_lib.row_hash(row) for row in rows]
+        rows_to_process, unchanged_rows = sync_manifest.split_rows(
+            rows, lambda entry: _sync_entry_is_usable(entry, media_index))
+        rows = [row for _, row in rows_to_process]
+    if num_elements_in_first_row == 1:
+        single_words = list(_iter_single_words(rows))
+        english_words, translated_words = _get_translations(
+            single_words, target.language, resources.translation_cache, run_journal)
+        logging.info('Translated %i words to %s.' % (len(translated_words), target.language))
+        translated_words_no_diacritics = _strip_diacritics(translated_words, target.language)
         _check_unique(translated_words_no_diacritics)
         word_translation_pairs = WordTranslationPairs(
             zip(english_words, translated_words_no_diacritics,
                 translated_words))
     else:
-        word_translation_pairs = parse_word_translation_csv(FLAGS.input_file)
+        word_translation_pairs = WordTranslationPairs(rows)
     assert isinstance(word_translation_pairs, WordTranslationPairs)
     if not _all_unique(word_translation_pairs.english_words):
         raise ValueError('Not all words are unique.')
     if not _all_unique(word_translation_pairs.translations):
         raise ValueError('Not all translations are unique.')
 
-    # Determine full filename where media should be written to.
-    # If the media is already fetched, we still want to write it to the CSV, but
-    # we don't want to fetch it.
-    filenames_to_write_imgs = {
-        word: os.path.join(FLAGS.output_dir, IMAGE_FILENAME_FORMAT.format(
-            english=word)) for word in word_translation_pairs.english_words}
-    filenames_to_write_auds = {
-        word: os.path.join(FLAGS.output_dir, AUDIO_FILENAME_FORMAT.format(
-            translation=word)) for word in word_translation_pairs.translations}
-
-    # The media we write might be different than the media that we fetch, if
-    # some media already exists. Make a copy
-    # of the media list so we can track media to fetch, and remove entries
-    # corresponding to media that already exists.
-    if FLAGS.disable_image_fetching:
-        filenames_to_fetch_imgs = {}
-    else:
-        filenames_to_fetch_imgs = {k: v for k, v in filenames_to_write_imgs.items()}
-    filenames_to_fetch_auds = {k: v for k, v in filenames_to_write_auds.items()}
-    # NOTE: This function modifies the first argument.
-    if not FLAGS.override_images:
-        remove_existing_filenames(filenames_to_fetch_imgs, FLAGS.output_dir)
-    remove_existing_filenames(filenames_to_fetch_auds, FLAGS.output_dir)
-
-    # Get images, and audio.
-    # TODO(joelshor): Try to combine approaches and fetch media if it doesn't
-    # exist.
-    if FLAGS.already_downloaded_media_dir:
-        images_lib.copy_images_from_disk(
-            filenames_to_fetch_imgs, FLAGS.already_downloaded_media_dir)
-        audio_lib.copy_audio_from_disk(
-            filenames_to_fetch_auds, FLAGS.already_downloaded_media_dir)
-    else:
-        words_without_imgs = images_lib.get_images(
-            filenames_to_fetch_imgs, credentials)
-        words_without_audio = audio_lib.get_audio(
-            filenames_to_fetch_auds, credentials)
-
-        # Remove words without audio or image from flashcard list *to write to
-        # csv*.
-        for english_word in words_without_imgs:
-            translated_word = word_translation_pairs.get_translation(
-                english_word)
-            logging.warning('Couldn\'t find image for: %s / %s', english_word,
-                            translated_word)
-        for translated_word in words_without_audio:
-            english_word = word_translation_pairs.get_english(translated_word)
-            logging.warning('Couldn\'t find audio for:  %s / %s', english_word,
-                            translated_word)
-        english_words_to_remove = set(words_without_imgs).union(
-            set([word_translation_pairs.get_english(x) for x in words_without_audio]))
-        _remove_words(english_words_to_remove, filenames_to_write_auds,
-                      filenames_to_write_imgs, word_translation_pairs)
-
-    # Sanity check that all files now exist.
-    if not FLAGS.disable_image_fetching:
-        _files_exist(filenames_to_write_imgs.values())
-    _files_exist(filenames_to_write_auds.values())
+    # Get images and audio at the same time, each from the cheapest place that has it: already downloaded media, then
+    # what earlier runs recorded in the journal, and then the web.
+    (filenames_to_write_imgs, words_without_imgs), (filenames_to_write_auds, words_without_audio) = (
+        download_utils.map_in_parallel(lambda get_media: get_media(), [
+            lambda: get_images(word_translation_pairs.english_words),
+            lambda: _get_audio(word_translation_pairs.translations, run_journal, resources, target),
+        ], 2))
+
+    # Remove words without audio or image from flashcard list *to write to
+    # csv*.
+    for english_word in words_without_imgs:
+        translated_word = word_translation_pairs.get_translation(
+            english_word)
+        logging.warning('Couldn\'t find image for: %s / %s', english_word,
+                        translated_word)
+    for translated_word in words_without_audio:
+        english_word = word_translation_pairs.get_english(translated_word)
+        logging.warning('Couldn\'t find audio for:  %s / %s', english_word,
+                        translated_word)
+    metrics.increment('words_without_image', len(words_without_imgs))
+    metrics.increment('words_without_audio', len(words_without_audio))
+    english_words_to_remove = set(words_without_imgs).union(
+        set([word_translation_pairs.get_english(x) for x in words_without_audio]))
+    _remove_words(english_words_to_remove, filenames_to_write_auds,
+                  filenames_to_write_imgs, word_translation_pairs)
     logging.info('Wrote media files to: %s', FLAGS.output_dir)
 
+    # Write the cards made in this run on their own, and then add back the cards of rows that haven't changed.
+    if sync_manifest is not None:
+        if _delta_csv_file(target):
+            _write_csv_rows(anki_import_csv.make_csv_format(
+                word_translation_pairs.translation_dict,
+                filenames_to_write_imgs,
+                filenames_to_write_auds,
+                extra_info=word_translation_pairs.extra_info), _delta_csv_file(target))
+            logging.warning('Wrote %i new or changed cards to: %s', len(word_translation_pairs),
+                            _delta_csv_file(target))
+        word_translation_pairs, manifest_entries = _add_unchanged_rows(
+            row_hashes, rows_to_process, unchanged_rows, word_translation_pairs, filenames_to_write_imgs,
+            filenames_to_write_auds)
+        if not _all_unique(word_translation_pairs.english_words):
+            raise ValueError('Not all words are unique.')
+        if not _all_unique(word_translation_pairs.translations):
+            raise ValueError('Not all translations are unique.')
+
     # Write CSV that can be imported into an Anki deck.
-    csv_rows = anki_import_csv.make_csv_format(
-        word_translation_pairs.translation_dict,
-        filenames_to_write_imgs,
-        filenames_to_write_auds,
-        extra_info=word_translation_pairs.extra_info)
-    _write_csv_rows(csv_rows, FLAGS.output_csv_file)
-    logging.warning('Wrote Anki import csv to: %s', FLAGS.output_csv_file)
+    if target.output_csv_file:
+        csv_rows = anki_import_csv.make_csv_format(
+            word_translation_pairs.translation_dict,
+            filenames_to_write_imgs,
+            filenames_to_write_auds,
+            extra_info=word_translation_pairs.extra_info)
+        _write_csv_rows(csv_rows, target.output_csv_file)
+        logging.warning('Wrote Anki import csv to: %s', target.output_csv_file)
+
+    # Write an Anki package.
+    if target.output_apkg_file:
+        extra_info = word_translation_pairs.extra_info or {}
+        with _make_apkg_writer(target) as package:
+            for english_word, translated_word in zip(word_translation_pairs.english_words,
+                                                     word_translation_pairs.translations):
+                package.add_note(english_word, translated_word, filenames_to_write_imgs[english_word],
+                                 filenames_to_write_auds[translated_word], extra_info.get(english_word, ()))
+        logging.warning('Wrote %i cards to Anki package: %s', len(package), target.output_apkg_file)
+    if sync_manifest is not None:
+        sync_manifest.replace(manifest_entries)
+        sync_manifest.save()
+
+
+def _main_multi_language(targets, resources):
+    """Makes the cards for several target languages at once.
+
+    Each language is translated and gets its audio in its own thread, and they share the image of each English word,
+    which is only fetched once. Images are recorded in the journal at `--journal_file`, and everything else in each
+    language's own journal.
+    """
+    num_elements_in_first_row, _ = _peek_csv_rows(FLAGS.input_file)
+    if num_elements_in_first_row != 1:
+        raise ValueError('Several `--target_languages` need an input of single words, not of translations.')
+    images_journal = _make_journal(_default_journal_file())
+    shared_images = _SharedImages(images_journal, resources)
+    run_journals = [_make_journal(target.journal_file, target.language) for target in targets]
+    try:
+        download_utils.map_in_parallel(
+            lambda target_and_journal: _main_batch(
+                target_and_journal[0], target_and_journal[1], resources, shared_images.get),
+            zip(targets, run_journals), len(targets))
+    finally:
+        for run_journal in run_journals + [images_journal]:
+            run_journal.close()
+
+
+def main(argv=None):
+    del argv
+
+    if not FLAGS.output_csv_file and not FLAGS.output_apkg_file:
+        raise ValueError('Set `--output_csv_file`, `--output_apkg_file`, or both.')
+    if FLAGS.streaming and FLAGS.sync_manifest_file:
+        raise ValueError('`--sync_manifest_file` isn\'t supported with `--streaming`.')
+    languages = _target_languages()
+    if not languages:
+        raise ValueError('Set at least one of `--target_languages`.')
+    if len(set(languages)) != len(languages):
+        raise ValueError('`--target_languages` has duplicates: %s' % FLAGS.target_languages)
+    if FLAGS.streaming and len(languages) > 1:
+        raise ValueError('Several `--target_languages` aren\'t supported with `--streaming`.')
+    targets = [_Target(language, len(languages) > 1) for language in languages]
+
+    resources = _SharedResources()
+    if FLAGS.streaming:
+        _main_streaming(targets[0], resources)
+    elif len(targets) == 1:
+        run_journal = _make_journal(targets[0].journal_file, targets[0].language)
+        _main_batch(targets[0], run_journal, resources,
+                    lambda english_words: _get_images(english_words, run_journal, resources))
+        run_journal.close()
+    else:
+        _main_multi_language(targets, resources)
+    resources.save()
 
 
 def set_logging_level(log_level):
@@ -352,4 +1412,13 @@ if __name__ == "__main__":
     logging.getLogger('googleapiclient.discovery_cache').setLevel(
         logging.ERROR)  # disable annoying warning
     set_logging_level(FLAGS.log)
-    main()
+    download_utils.configure_session(
+        timeout_secs=FLAGS.http_timeout_secs,
+        max_connections_per_host=FLAGS.max_connections_per_host)
+    _configure_rate_limits()
+    try:
+        main()
+    finally:
+        if FLAGS.metrics_out:
+            # Also written for failed runs, to see where they spent their time.
+            metrics.get_metrics().write(FLAGS.metrics_out)
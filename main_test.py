@@ -0,0 +1,202 @@
+"""Test main module."""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+import audio
+import download_utils
+import images
+import journal
+import main
+import translation
+
+
+def _fake_get_translations(single_words, credentials, target_language='iw', **kwargs):
+    """Translates `word` to `<language>:word`, and back."""
+    prefix = target_language + ':'
+    english_words = tuple(w[len(prefix):] if w.startswith(prefix) else w for w in single_words)
+    return english_words, tuple(prefix + w for w in english_words)
+
+
+class TestMain(unittest.TestCase):
+
+    def setUp(self):
+        self.dir_path = os.path.dirname(os.path.realpath(__file__))
+        self.temp_dir = tempfile.mkdtemp()
+        self.output_dir = os.path.join(self.temp_dir, 'media')
+        os.mkdir(self.output_dir)
+        self.translated = []
+        self.words_without_audio = set()
+        self.real_fns = translation.get_translations, images.get_images, audio.get_audio
+        translation.get_translations = self._get_translations
+        images.get_images = self._get_media
+        audio.get_audio = lambda filenames, credentials, **kwargs: self._get_media(filenames, credentials)
+
+    def tearDown(self):
+        translation.get_translations, images.get_images, audio.get_audio = self.real_fns
+
+    def _get_translations(self, single_words, credentials, **kwargs):
+        self.translated.extend(single_words)
+        return _fake_get_translations(single_words, credentials, **kwargs)
+
+    def _get_media(self, filenames, credentials, **kwargs):
+        for word, filename in filenames.items():
+            if word not in self.words_without_audio:
+                with open(filename, 'w') as f:
+                    f.write(word)
+        return [word for word in filenames if word in self.words_without_audio]
+
+    def _parse_flags(self, *args):
+        main.FLAGS = main.EasyAnkiArgParser().parse_args([
+            '--output_dir', self.output_dir, '--output_csv_file', os.path.join(self.temp_dir, 'out.csv'),
+            '--disable_translation_cache', '--disable_forvo_cache', '--disable_image_search_cache'] + list(args))
+
+    def _run_main(self, words, *args):
+        input_file = os.path.join(self.temp_dir, 'words.csv')
+        with open(input_file, 'w') as f:
+            f.write('\n'.join(words) + '\n')
+        self._parse_flags('--input_file', input_file, *args)
+        main.main()
+
+    def _read_csv(self, filename, column=3):
+        """Returns one column of a CSV the run wrote. The English word by default."""
+        with open(os.path.join(self.temp_dir, filename), 'r') as f:
+            return [line.split(';')[column] for line in f.read().splitlines()]
+
+    def _shared_images(self):
+        self._parse_flags()
+        return main._SharedImages(journal.RunJournal(os.path.join(self.temp_dir, 'images.journal')),
+                                  main._SharedResources())
+
+    def test_peek_csv_rows(self):
+        num_elements, rows = main._peek_csv_rows(os.path.join(self.dir_path, 'testdata', 'dummy_words.txt'))
+        self.assertEqual(1, num_elements)
+        self.assertListEqual(['coding', 'beats', 'boardgames'], list(main._iter_single_words(rows)))
+
+    def test_write_csv_rows_in_chunks(self):
+        output_csv_file = tempfile.mktemp()
+        main._write_csv_rows((('<img src="%i.png">' % i, str(i)) for i in xrange(25)), output_csv_file, chunk_size=10)
+        with open(output_csv_file, 'r') as f:
+            lines = f.read().splitlines()
+        self.assertEqual(25, len(lines))
+        self.assertEqual('<img src="24.png">;24', lines[-1])
+
+    def test_word_translation_pairs(self):
+        pairs = main.WordTranslationPairs(
+            [('water', 'agua', 'el agua'), ['fire', 'fuego'], ('earth', 'tierra', 'la tierra')])
+        self.assertEqual('fuego', pairs.get_translation('fire'))
+        self.assertEqual('earth', pairs.get_english('tierra'))
+        self.assertDictEqual({'water': ['el agua'], 'fire': [''], 'earth': ['la tierra']}, pairs.extra_info)
+
+        pairs.remove_translated_word('agua')
+        pairs.remove_translated_word('fuego')  # compacts the rows
+        self.assertEqual(1, len(pairs))
+        self.assertListEqual([('earth', 'tierra', 'la tierra')], pairs.data)
+        self.assertEqual('tierra', pairs.get_translation('earth'))
+        with self.assertRaises(KeyError):
+            pairs.get_english('agua')
+        with self.assertRaises(ValueError):
+            pairs.remove_translated_word('agua')
+
+    def test_add_language_suffix(self):
+        self.assertEqual('out_es.csv', main._add_language_suffix('out.csv', 'es'))
+        self.assertEqual('/tmp/deck_zh-TW.apkg', main._add_language_suffix('/tmp/deck.apkg', 'zh-TW'))
+        self.assertEqual('', main._add_language_suffix('', 'es'))
+
+    def test_sync_manifest_only_processes_changed_rows(self):
+        sync_manifest_file = os.path.join(self.temp_dir, 'sync.json')
+        # `iw:fire` is translated from Hebrew, and `ice` gets no audio, so it doesn't make a card.
+        self.words_without_audio = {'iw:ice'}
+        self._run_main(['water', 'ice', 'iw:fire'], '--sync_manifest_file', sync_manifest_file)
+        self.assertListEqual(['water', 'fire'], self._read_csv('out.csv'))
+        with open(sync_manifest_file, 'r') as f:
+            self.assertEqual(2, len(json.load(f)['rows']))
+
+        self.translated = []
+        self.words_without_audio = set()
+        self._run_main(['water', 'ice', 'iw:fire', 'earth'], '--sync_manifest_file', sync_manifest_file)
+        self.assertListEqual(['ice', 'earth'], self.translated)
+        self.assertListEqual(['ice', 'earth'], self._read_csv('out.delta.csv'))
+        # Cards are in input order, and unchanged rows keep their media.
+        self.assertListEqual(['water', 'ice', 'fire', 'earth'], self._read_csv('out.csv'))
+        with open(sync_manifest_file, 'r') as f:
+            entries = {entry['english']: entry for entry in json.load(f)['rows'].values()}
+        self.assertListEqual(['earth', 'fire', 'ice', 'water'], sorted(entries))
+        self.assertEqual('iw:fire', entries['fire']['translation'])
+        self.assertEqual(os.path.join(self.output_dir, 'water.png'), entries['water']['image_filename'])
+        self.assertEqual(os.path.join(self.output_dir, 'iw:fire.mp3'), entries['fire']['audio_filename'])
+
+
+    def test_switching_target_language_doesnt_reuse_the_last_run(self):
+        sync_manifest_file = os.path.join(self.temp_dir, 'sync.json')
+        self._run_main(['water', 'fire'], '--sync_manifest_file', sync_manifest_file)
+        self.assertListEqual(['iw:water', 'iw:fire'], self._read_csv('out.csv', column=1))
+
+        # Neither the manifest nor the journal of the Hebrew run apply to Spanish.
+        self.translated = []
+        self._run_main(['water', 'fire'], '--sync_manifest_file', sync_manifest_file, '--resume',
+                       '--target_languages', 'es')
+        self.assertListEqual(['water', 'fire'], self.translated)
+        self.assertListEqual(['es:water', 'es:fire'], self._read_csv('out.csv', column=1))
+
+    def test_shared_images_fetches_each_word_once(self):
+        shared_images = self._shared_images()
+        fetched = []
+        lock = threading.Lock()
+
+        def _get_images(filenames, credentials, **kwargs):
+            time.sleep(0.1)  # So that each language asks while the other is fetching.
+            with lock:
+                fetched.extend(filenames)
+            return self._get_media(filenames, credentials)
+
+        images.get_images = _get_images
+        (filenames_1, missing_1), (filenames_2, missing_2) = download_utils.map_in_parallel(
+            shared_images.get, [['water', 'fire'], ['fire', 'ice']], 2)
+        self.assertListEqual(['fire', 'ice', 'water'], sorted(fetched))
+        self.assertListEqual(['fire', 'water'], sorted(filenames_1))
+        self.assertListEqual(['fire', 'ice'], sorted(filenames_2))
+        self.assertEqual(os.path.join(self.output_dir, 'fire.png'), filenames_1['fire'])
+        self.assertEqual(filenames_1['fire'], filenames_2['fire'])
+        self.assertListEqual([], missing_1 + missing_2)
+
+    def test_shared_images_failure_wakes_up_waiting_languages(self):
+        shared_images = self._shared_images()
+        fetching, release = threading.Event(), threading.Event()
+
+        def _get_images(filenames, credentials, **kwargs):
+            fetching.set()
+            release.wait()
+            raise IOError('Custom Search is down.')
+
+        images.get_images = _get_images
+        errors = []
+
+        def _get(english_words):
+            try:
+                shared_images.get(english_words)
+            except Exception as e:
+                errors.append(e)
+
+        first = threading.Thread(target=_get, args=(['water'],))
+        first.start()
+        self.assertTrue(fetching.wait(5))
+        second = threading.Thread(target=_get, args=(['water'],))
+        second.start()
+        time.sleep(0.1)  # Let the second language start waiting for the first.
+        release.set()
+        first.join(5)
+        second.join(5)
+        self.assertFalse(second.is_alive())
+        self.assertItemsEqual([IOError, RuntimeError], [type(e) for e in errors])
+
+
+if __name__ == '__main__':
+    unittest.main()
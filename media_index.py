@@ -0,0 +1,137 @@
+"""An in-memory index of the files in a media directory.
+
+Anki's media folder can hold a very large number of files, sometimes on networked storage, where checking whether each
+card's media exists one `stat` at a time is slow. `MediaIndex` lists the directory once, and then answers every
+existence check from memory. It's updated as the run writes and removes files.
+
+The index can be saved to disk along with the directory's modification time from when it was listed. A later run
+reuses it if the directory hasn't changed since, and lists the directory again otherwise. So a run that changes the
+directory, or that another program changes the directory during, makes the next run list it again. The index file has
+to be outside the directory, since saving it would change the directory otherwise.
+
+Listing uses `scandir`, which tells files from directories without a `stat` per entry. It's built into Python 3, and
+available for Python 2 with `pip install scandir`. Without it, the index falls back to `os.listdir`, which also lists
+subdirectories. Media folders normally have none.
+"""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+import json
+import logging
+import os
+import threading
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+import json_utils
+
+
+def _list_files(media_dir):
+    if not os.path.isdir(media_dir):
+        return set()
+    if scandir is None:
+        return set(os.listdir(media_dir))
+    return set(entry.name for entry in scandir(media_dir) if entry.is_file())
+
+
+class MediaIndex(object):
+    """The set of files in one media directory.
+
+    Args:
+        media_dir: The directory to index. If it doesn't exist yet, the index starts out empty.
+        index_file: An optional file to save the index to, and to load it from if the directory hasn't changed. It
+            can't be in `media_dir`.
+
+    Raises:
+        ValueError: If `index_file` is in `media_dir`.
+    """
+
+    def __init__(self, media_dir, index_file=None):
+        self._media_dir = os.path.abspath(media_dir)
+        self._index_file = index_file
+        if index_file and os.path.dirname(os.path.abspath(index_file)) == self._media_dir:
+            raise ValueError('The media index file can\'t be in the directory it indexes: %s' % index_file)
+        self._lock = threading.Lock()
+        # The directory's mtime when it was listed, or `None` if it didn't exist.
+        self._mtime = None
+        self._basenames = self._load()
+        if self._basenames is None:
+            if os.path.isdir(self._media_dir):
+                # Before listing, so that changes made while listing make the saved index out of date.
+                self._mtime = os.stat(self._media_dir).st_mtime
+            self._basenames = _list_files(self._media_dir)
+            logging.info('Indexed %i files in %s.', len(self._basenames), self._media_dir)
+
+    def _load(self):
+        """Returns the saved basenames, or `None` if there's no saved index or it's out of date."""
+        if not self._index_file or not os.path.exists(self._index_file) or not os.path.isdir(self._media_dir):
+            return None
+        try:
+            with open(self._index_file, 'r') as f:
+                saved = json.load(f)
+        except ValueError:
+            logging.warning('Ignoring malformed media index: %s', self._index_file)
+            return None
+        mtime = os.stat(self._media_dir).st_mtime
+        if saved.get('media_dir') != self._media_dir or saved.get('mtime') != mtime:
+            return None
+        self._mtime = mtime
+        logging.info('Reusing media index %s with %i files.', self._index_file, len(saved['basenames']))
+        return set(json_utils.to_utf8(basename) for basename in saved['basenames'])
+
+    def save(self):
+        """Saves the index, if there's an `index_file` and the directory existed when it was listed."""
+        if not self._index_file or self._mtime is None:
+            return
+        with self._lock:
+            saved = {
+                'media_dir': self._media_dir,
+                'mtime': self._mtime,
+                'basenames': sorted(self._basenames),
+            }
+            temp_index_file = self._index_file + '.tmp'
+            with open(temp_index_file, 'w') as f:
+                json.dump(saved, f)
+            os.rename(temp_index_file, self._index_file)
+
+    def _basename_in_dir(self, filename):
+        """Returns the basename of `filename` if it's in the indexed directory, and `None` otherwise."""
+        dirname, basename = os.path.split(os.path.abspath(filename))
+        return basename if dirname == self._media_dir else None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._basenames)
+
+    def has_basename(self, basename):
+        """Whether a file named `basename` is in the directory."""
+        with self._lock:
+            return basename in self._basenames
+
+    def exists(self, filename):
+        """Whether `filename` exists. Files outside the indexed directory are checked on disk."""
+        basename = self._basename_in_dir(filename)
+        if basename is None:
+            return os.path.isfile(filename)
+        return self.has_basename(basename)
+
+    def add(self, filename):
+        """Records that `filename` was written."""
+        basename = self._basename_in_dir(filename)
+        if basename is not None:
+            with self._lock:
+                self._basenames.add(basename)
+
+    def discard(self, filename):
+        """Records that `filename` was removed."""
+        basename = self._basename_in_dir(filename)
+        if basename is not None:
+            with self._lock:
+                self._basenames.discard(basename)
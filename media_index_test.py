@@ -0,0 +1,79 @@
+"""Test media index module."""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import media_index
+
+
+def _touch(filename):
+    with open(filename, 'w') as f:
+        f.write('data')
+
+
+class TestMediaIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.media_dir = os.path.join(self.tmp_dir, 'media')
+        os.mkdir(self.media_dir)
+        _touch(os.path.join(self.media_dir, 'image_water.jpg'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_existence_and_updates(self):
+        index = media_index.MediaIndex(self.media_dir)
+        self.assertTrue(index.exists(os.path.join(self.media_dir, 'image_water.jpg')))
+        self.assertTrue(index.has_basename('image_water.jpg'))
+        self.assertFalse(index.exists(os.path.join(self.media_dir, 'image_fire.jpg')))
+
+        # Updates are recorded, not checked on disk.
+        index.add(os.path.join(self.media_dir, 'image_fire.jpg'))
+        self.assertTrue(index.exists(os.path.join(self.media_dir, 'image_fire.jpg')))
+        index.discard(os.path.join(self.media_dir, 'image_water.jpg'))
+        self.assertFalse(index.has_basename('image_water.jpg'))
+
+        # Files elsewhere are checked on disk.
+        outside_filename = os.path.join(self.tmp_dir, 'image_water.jpg')
+        self.assertFalse(index.exists(outside_filename))
+        _touch(outside_filename)
+        self.assertTrue(index.exists(outside_filename))
+
+    def test_missing_dir(self):
+        index = media_index.MediaIndex(os.path.join(self.tmp_dir, 'missing'))
+        self.assertEqual(0, len(index))
+
+    def test_saved_index_is_reused_until_dir_changes(self):
+        index_file = os.path.join(self.tmp_dir, 'index.json')
+        os.utime(self.media_dir, (1000, 1000))
+        media_index.MediaIndex(self.media_dir, index_file).save()
+
+        # The saved index is reused, so a file that appears without changing the directory's mtime isn't seen.
+        _touch(os.path.join(self.media_dir, 'image_earth.jpg'))
+        os.utime(self.media_dir, (1000, 1000))
+        index = media_index.MediaIndex(self.media_dir, index_file)
+        self.assertEqual(1, len(index))
+        self.assertFalse(index.has_basename('image_earth.jpg'))
+
+        # The index is saved with the mtime from when the directory was listed, so once a run changes the directory,
+        # the next run lists it again.
+        _touch(os.path.join(self.media_dir, 'image_fire.jpg'))
+        index.add(os.path.join(self.media_dir, 'image_fire.jpg'))
+        index.save()
+        index = media_index.MediaIndex(self.media_dir, index_file)
+        self.assertTrue(index.has_basename('image_earth.jpg'))
+        self.assertEqual(3, len(index))
+
+    def test_index_file_in_media_dir(self):
+        with self.assertRaises(ValueError):
+            media_index.MediaIndex(self.media_dir, os.path.join(self.media_dir, 'index.json'))
+
+
+if __name__ == '__main__':
+    unittest.main()
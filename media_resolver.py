@@ -0,0 +1,88 @@
+"""Gets each word's media from the cheapest place that has it.
+
+Media can come from several places: a directory of media that was downloaded before, what earlier runs recorded, and
+the web. `resolve_media` tries each of these places ("tiers") in order, and only passes on to the next tier the words
+that the earlier tiers couldn't resolve. Each tier handles all of its words at once, so local lookups are batched, and
+the web is only asked for whatever is left.
+"""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+import logging
+import os
+
+import bulk_copy
+import media_index as media_index_lib
+import metrics
+
+
+class Tier(object):
+    """One place to get media from.
+
+    Args:
+        name: A short name for logs and metrics.
+        resolve_fn: A function that takes a dictionary of {word: filename to write the media to}, and returns a pair of
+            lists: the words whose media it wrote, and the words it knows have no media. Any other words are passed on
+            to the next tier.
+    """
+
+    def __init__(self, name, resolve_fn):
+        self.name = name
+        self._resolve_fn = resolve_fn
+
+    def resolve(self, filenames_to_fetch):
+        return self._resolve_fn(filenames_to_fetch)
+
+
+def local_dir_tier(media_dir, filename_format, media_index=None, num_workers=8, methods=bulk_copy.METHODS):
+    """Returns a tier that copies media from a directory of already downloaded media.
+
+    Args:
+        media_dir: The directory to copy from.
+        filename_format: The name of each file in `media_dir`, with one spot for the word.
+        media_index: A `media_index.MediaIndex` of `media_dir`. If `None`, `media_dir` is listed once here.
+        num_workers: The number of files to copy at once.
+        methods: The ways to copy each file, in order of preference. See `bulk_copy.py`.
+    """
+    media_index = media_index or media_index_lib.MediaIndex(media_dir)
+
+    def _copy(filenames_to_fetch):
+        words, sources_and_destinations = [], []
+        for word, filename in filenames_to_fetch.items():
+            if media_index.has_basename(filename_format % word):
+                words.append(word)
+                sources_and_destinations.append((os.path.join(media_dir, filename_format % word), filename))
+        bulk_copy.copy_files(sources_and_destinations, num_workers=num_workers, methods=methods)
+        return words, []
+
+    return Tier('local_dir', _copy)
+
+
+def resolve_media(filenames_to_fetch, tiers, media_type):
+    """Gets media for each word from the first tier that can resolve it.
+
+    Args:
+        filenames_to_fetch: A dictionary of {word: filename to write the media to}.
+        tiers: A list of `Tier`s, in the order to try them.
+        media_type: 'image' or 'audio', for logs and metrics.
+
+    Returns:
+        A list of words without media, either because a tier said so, or because no tier could resolve them.
+    """
+    remaining = dict(filenames_to_fetch)
+    words_that_failed = []
+    for tier in tiers:
+        if not remaining:
+            break
+        resolved_words, failed_words = tier.resolve(dict(remaining))
+        for word in resolved_words:
+            del remaining[word]
+        for word in failed_words:
+            del remaining[word]
+        words_that_failed.extend(failed_words)
+        metrics.increment('media_resolved', len(resolved_words), media=media_type, tier=tier.name)
+        logging.info('Resolved %i %s files from %s, and %i are left.', len(resolved_words), media_type, tier.name,
+                     len(remaining))
+    words_that_failed.extend(remaining)
+    return words_that_failed
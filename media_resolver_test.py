@@ -0,0 +1,63 @@
+"""Test media resolver module."""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import media_resolver
+
+
+class TestMediaResolver(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.local_dir = os.path.join(self.tmp_dir, 'local')
+        self.output_dir = os.path.join(self.tmp_dir, 'output')
+        os.mkdir(self.local_dir)
+        os.mkdir(self.output_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_tiers_only_see_what_earlier_tiers_left(self):
+        with open(os.path.join(self.local_dir, 'image_water.jpg'), 'w') as f:
+            f.write('water')
+        filenames_to_fetch = {word: os.path.join(self.output_dir, word + '.png')
+                              for word in ('water', 'fire', 'ice', 'earth')}
+        network_requests = []
+
+        def _journal(filenames):
+            return [], ['ice'] if 'ice' in filenames else []
+
+        def _network(filenames):
+            network_requests.append(sorted(filenames))
+            for word, filename in filenames.items():
+                if word != 'earth':
+                    with open(filename, 'w') as f:
+                        f.write(word)
+            return [word for word in filenames if word != 'earth'], []
+
+        words_that_failed = media_resolver.resolve_media(filenames_to_fetch, [
+            media_resolver.local_dir_tier(self.local_dir, 'image_%s.jpg', methods=('copy',)),
+            media_resolver.Tier('journal', _journal),
+            media_resolver.Tier('network', _network),
+        ], 'image')
+
+        # `earth` wasn't resolved by the network, so it's reported as failed without a tier saying so.
+        self.assertEqual(['earth', 'ice'], sorted(words_that_failed))
+        self.assertEqual([['earth', 'fire']], network_requests)
+        with open(filenames_to_fetch['water']) as f:
+            self.assertEqual('water', f.read())
+
+    def test_no_tiers_are_called_without_words(self):
+        def _fail(_):
+            raise AssertionError('Shouldn\'t be called.')
+        self.assertEqual([], media_resolver.resolve_media({}, [media_resolver.Tier('network', _fail)], 'audio'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+"""A content-addressed store for downloaded media.
+
+The same bytes often end up under many card filenames, for instance for synonyms or for decks that are regenerated.
+`MediaStore` hashes each media file and keeps a single copy (a "blob") of each distinct file. Card filenames point at
+their blob in one of two ways:
+
+1) `hardlink`: The blobs live in the store directory, and each card file is a hardlink to its blob. The store must be
+   on the same filesystem as the media directory.
+2) `manifest`: There are no per-card files at all. The blob is kept in the media directory, named by its hash, and the
+   card should refer to the blob's filename instead. This keeps the media directory (and so Anki sync) small.
+
+In both modes, the manifest records which blob each card filename points at.
+"""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+import hashlib
+import json
+import logging
+import os
+import threading
+
+
+MODES = ('hardlink', 'manifest')
+_MANIFEST_FILENAME = 'manifest.json'
+_CHUNK_SIZE = 1 << 20
+
+
+def _hash_file(filename):
+    sha256 = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(_CHUNK_SIZE), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _link_over(source, destination):
+    """Atomically replaces `destination` with a hardlink to `source`."""
+    temp_destination = destination + '.aeag-link'
+    if os.path.lexists(temp_destination):
+        os.remove(temp_destination)
+    os.link(source, temp_destination)
+    os.rename(temp_destination, destination)
+
+
+class MediaStore(object):
+    """A content-addressed store of media files.
+
+    Args:
+        store_dir: The directory for the manifest and, in `hardlink` mode, the blobs.
+        mode: One of `MODES`.
+    """
+
+    def __init__(self, store_dir, mode='hardlink'):
+        if mode not in MODES:
+            raise ValueError('`mode` must be one of %s. Instead, was %s' % (MODES, mode))
+        self._store_dir = store_dir
+        self._blob_dir = os.path.join(store_dir, 'blobs')
+        self._mode = mode
+        self._lock = threading.Lock()
+        if not os.path.isdir(self._blob_dir):
+            os.makedirs(self._blob_dir)
+        self._manifest_filename = os.path.join(store_dir, _MANIFEST_FILENAME)
+        if os.path.exists(self._manifest_filename):
+            with open(self._manifest_filename, 'r') as f:
+                self._manifest = json.load(f)
+        else:
+            self._manifest = {}
+
+    def _blob_filename(self, digest, extension, media_dir):
+        if self._mode == 'hardlink':
+            return os.path.join(self._blob_dir, digest[:2], digest + extension)
+        return os.path.join(media_dir, digest + extension)
+
+    def add(self, filename):
+        """Adds a freshly written media file to the store.
+
+        Args:
+            filename: The full filename of a media file, as written by a fetcher.
+
+        Returns:
+            The filename that the card should refer to. In `hardlink` mode, this is `filename`, which is now a hardlink
+            to its blob. In `manifest` mode, this is the blob in the same directory as `filename`, and `filename` itself
+            is removed.
+        """
+        media_dir, basename = os.path.split(filename)
+        digest = _hash_file(filename)
+        blob_filename = self._blob_filename(digest, os.path.splitext(basename)[1], media_dir)
+        with self._lock:
+            if not os.path.exists(blob_filename):
+                if not os.path.isdir(os.path.dirname(blob_filename)):
+                    os.makedirs(os.path.dirname(blob_filename))
+                if self._mode == 'hardlink':
+                    os.link(filename, blob_filename)
+                else:
+                    os.rename(filename, blob_filename)
+            elif self._mode == 'hardlink':
+                if not os.path.samefile(filename, blob_filename):
+                    logging.info('%s has the same content as %s, so linking them.', filename, blob_filename)
+                    _link_over(blob_filename, filename)
+            else:
+                logging.info('%s has the same content as %s, so removing it.', filename, blob_filename)
+                os.remove(filename)
+            self._manifest[basename] = os.path.abspath(blob_filename)
+        return filename if self._mode == 'hardlink' else blob_filename
+
+    def lookup(self, basename):
+        """Returns the blob filename for a card filename, or `None` if it's not in the store."""
+        with self._lock:
+            blob_filename = self._manifest.get(basename)
+        if blob_filename and os.path.exists(blob_filename):
+            return blob_filename
+        return None
+
+    def resolve(self, filename):
+        """Returns the filename a card should refer to, if `filename` was previously added in `manifest` mode."""
+        if self._mode != 'manifest':
+            return filename
+        return self.lookup(os.path.basename(filename)) or filename
+
+    def save(self):
+        """Writes the manifest to disk."""
+        with self._lock:
+            temp_manifest_filename = self._manifest_filename + '.tmp'
+            with open(temp_manifest_filename, 'w') as f:
+                json.dump(self._manifest, f, indent=0, sort_keys=True)
+            os.rename(temp_manifest_filename, self._manifest_filename)
@@ -0,0 +1,48 @@
+"""Test media store module."""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import media_store
+
+
+class TestMediaStore(unittest.TestCase):
+
+    def setUp(self):
+        self.dir_path = os.path.dirname(os.path.realpath(__file__))
+        self.media_dir = tempfile.mkdtemp()
+        self.store_dir = tempfile.mkdtemp()
+        for filename in ['synonym1.mp3', 'synonym2.mp3']:
+            shutil.copyfile(os.path.join(self.dir_path, 'testdata', 'test_audio_word1.mp3'),
+                            os.path.join(self.media_dir, filename))
+
+    def test_hardlink_mode(self):
+        store = media_store.MediaStore(self.store_dir, mode='hardlink')
+        filename1 = os.path.join(self.media_dir, 'synonym1.mp3')
+        filename2 = os.path.join(self.media_dir, 'synonym2.mp3')
+        self.assertEqual(filename1, store.add(filename1))
+        self.assertEqual(filename2, store.add(filename2))
+        self.assertTrue(os.path.samefile(filename1, filename2))
+        self.assertTrue(os.path.samefile(filename1, store.lookup('synonym2.mp3')))
+
+    def test_manifest_mode(self):
+        store = media_store.MediaStore(self.store_dir, mode='manifest')
+        filename1 = os.path.join(self.media_dir, 'synonym1.mp3')
+        filename2 = os.path.join(self.media_dir, 'synonym2.mp3')
+        blob_filename = store.add(filename1)
+        self.assertEqual(blob_filename, store.add(filename2))
+        self.assertListEqual([os.path.basename(blob_filename)], os.listdir(self.media_dir))
+        store.save()
+
+        # A new store remembers where the card filenames point.
+        store = media_store.MediaStore(self.store_dir, mode='manifest')
+        self.assertEqual(blob_filename, store.resolve(filename2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+"""Timers and counters that show where a run spends its time.
+
+Library code wraps each unit of work in `timer`, for instance one Forvo lookup or one image download, and calls
+`increment` for events worth counting, like retries and failures. Everything is recorded in one `Metrics` object for
+the whole program, which `get_metrics` returns.
+
+At the end of a run, `Metrics.write` saves a JSON summary, and the same numbers in the Prometheus text format so they
+can be picked up by a node exporter's textfile collector.
+"""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+
+
+_PERCENTILES = (50, 90, 99)
+_PROMETHEUS_PREFIX = 'aeag'
+
+_default_metrics = None
+_default_metrics_lock = threading.Lock()
+
+
+def _percentile(sorted_values, percent):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percent / 100.))]
+
+
+def _counter_key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for key, value in labels)
+
+
+class Metrics(object):
+    """Thread-safe stage timers and event counters."""
+
+    def __init__(self):
+        self._start_time = time.time()
+        self._durations = collections.defaultdict(list)
+        self._counters = collections.defaultdict(int)
+        self._lock = threading.Lock()
+
+    def record_duration(self, stage, secs):
+        with self._lock:
+            self._durations[stage].append(secs)
+
+    @contextlib.contextmanager
+    def timer(self, stage):
+        """Records how long the `with` block takes under `stage`, whether or not it raises."""
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.record_duration(stage, time.time() - start_time)
+
+    def increment(self, name, n=1, **labels):
+        """Adds `n` to the counter `name`. Keyword arguments are labels, such as the service that was retried."""
+        with self._lock:
+            self._counters[_counter_key(name, labels)] += n
+
+    def get_count(self, name, **labels):
+        with self._lock:
+            return self._counters.get(_counter_key(name, labels), 0)
+
+    def summary(self):
+        """Returns a JSON-serializable summary of every timer and counter."""
+        with self._lock:
+            durations = {stage: sorted(values) for stage, values in self._durations.items()}
+            counters = dict(self._counters)
+        stages = {}
+        for stage, values in durations.items():
+            stages[stage] = {
+                'count': len(values),
+                'total_secs': sum(values),
+                'mean_secs': sum(values) / len(values),
+                'max_secs': values[-1],
+            }
+            for percent in _PERCENTILES:
+                stages[stage]['p%i_secs' % percent] = _percentile(values, percent)
+        return {
+            'wall_secs': time.time() - self._start_time,
+            'stages': stages,
+            'counters': {name + _format_labels(labels): count for (name, labels), count in counters.items()},
+        }
+
+    def prometheus_text(self):
+        """Returns every timer and counter in the Prometheus text exposition format."""
+        summary = self.summary()
+        with self._lock:
+            counters = dict(self._counters)
+        lines = [
+            '# HELP %s_wall_seconds How long the run has taken.' % _PROMETHEUS_PREFIX,
+            '# TYPE %s_wall_seconds gauge' % _PROMETHEUS_PREFIX,
+            '%s_wall_seconds %r' % (_PROMETHEUS_PREFIX, summary['wall_secs']),
+            '# HELP %s_stage_seconds Time spent on each unit of work, by stage.' % _PROMETHEUS_PREFIX,
+            '# TYPE %s_stage_seconds summary' % _PROMETHEUS_PREFIX,
+        ]
+        for stage, stats in sorted(summary['stages'].items()):
+            for percent in _PERCENTILES:
+                lines.append('%s_stage_seconds%s %r' % (
+                    _PROMETHEUS_PREFIX, _format_labels((('stage', stage), ('quantile', str(percent / 100.)))),
+                    stats['p%i_secs' % percent]))
+            lines.append('%s_stage_seconds_sum%s %r' % (
+                _PROMETHEUS_PREFIX, _format_labels((('stage', stage),)), stats['total_secs']))
+            lines.append('%s_stage_seconds_count%s %i' % (
+                _PROMETHEUS_PREFIX, _format_labels((('stage', stage),)), stats['count']))
+        for name in sorted(set(name for name, _ in counters)):
+            lines.append('# TYPE %s_%s_total counter' % (_PROMETHEUS_PREFIX, name))
+            for (counter_name, labels), count in sorted(counters.items()):
+                if counter_name == name:
+                    lines.append('%s_%s_total%s %i' % (_PROMETHEUS_PREFIX, name, _format_labels(labels), count))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, basename):
+        """Writes `basename`.json and `basename`.prom.
+
+        Returns:
+            The two filenames.
+        """
+        json_filename, prometheus_filename = basename + '.json', basename + '.prom'
+        dirname = os.path.dirname(os.path.abspath(basename))
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        for filename, contents in ((json_filename, json.dumps(self.summary(), indent=2, sort_keys=True)),
+                                   (prometheus_filename, self.prometheus_text())):
+            # Write atomically, since a collector might read the file at any time.
+            with open(filename + '.tmp', 'w') as f:
+                f.write(contents)
+            os.rename(filename + '.tmp', filename)
+        return json_filename, prometheus_filename
+
+
+def reset_metrics():
+    """Replaces the shared metrics with empty ones, and returns them."""
+    global _default_metrics
+    with _default_metrics_lock:
+        _default_metrics = Metrics()
+        return _default_metrics
+
+
+def get_metrics():
+    """Returns the metrics shared by the whole program."""
+    global _default_metrics
+    with _default_metrics_lock:
+        if _default_metrics is None:
+            _default_metrics = Metrics()
+        return _default_metrics
+
+
+def timer(stage):
+    """Times a `with` block under `stage` in the shared metrics. See `Metrics.timer`."""
+    return get_metrics().timer(stage)
+
+
+def increment(name, n=1, **labels):
+    """Increments a counter in the shared metrics. See `Metrics.increment`."""
+    get_metrics().increment(name, n, **labels)
@@ -0,0 +1,54 @@
+"""Test metrics module."""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import metrics
+
+
+class TestMetrics(unittest.TestCase):
+
+    def test_timers_and_counters(self):
+        run_metrics = metrics.Metrics()
+        for secs in xrange(1, 101):
+            run_metrics.record_duration('image', secs)
+        with self.assertRaises(ValueError):
+            with run_metrics.timer('forvo_lookup'):
+                raise ValueError()
+        run_metrics.increment('rate_limit_retries', service='cse')
+        run_metrics.increment('rate_limit_retries', 2, service='cse')
+
+        summary = run_metrics.summary()
+        self.assertEqual(100, summary['stages']['image']['count'])
+        self.assertEqual(51, summary['stages']['image']['p50_secs'])
+        self.assertEqual(100, summary['stages']['image']['p99_secs'])
+        self.assertEqual(1, summary['stages']['forvo_lookup']['count'])
+        self.assertEqual(3, run_metrics.get_count('rate_limit_retries', service='cse'))
+        self.assertEqual({'rate_limit_retries{service="cse"}': 3}, summary['counters'])
+
+    def test_write(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            run_metrics = metrics.Metrics()
+            run_metrics.record_duration('csv_write', 0.5)
+            run_metrics.increment('words_without_audio')
+            json_filename, prometheus_filename = run_metrics.write(os.path.join(tmp_dir, 'run'))
+            with open(json_filename) as f:
+                self.assertEqual(0.5, json.load(f)['stages']['csv_write']['total_secs'])
+            with open(prometheus_filename) as f:
+                lines = f.read().splitlines()
+            self.assertIn('aeag_stage_seconds{stage="csv_write",quantile="0.5"} 0.5', lines)
+            self.assertIn('aeag_stage_seconds_count{stage="csv_write"} 1', lines)
+            self.assertIn('aeag_words_without_audio_total 1', lines)
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
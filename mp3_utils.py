@@ -0,0 +1,311 @@
+"""Validates and trims fetched MP3s without decoding them.
+
+An MP3 is a sequence of frames, each with a 4 byte header that says how long the frame is, optionally wrapped in ID3
+or APE tag blocks. `clean_mp3` walks the frame headers to check that a file is well-formed and complete, drops the tag
+blocks, and drops silent frames at the start and end of the recording. Silence is read from the Layer III side info of
+each frame (the number of Huffman-coded bits and the global gain of each granule), so no audio is decoded.
+
+`clean_mp3s` does the same for many files in a pool of processes.
+"""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+import binascii
+import collections
+import logging
+import os
+import struct
+
+import download_utils
+
+
+# Indexed by the 2 bit version field. `None` is reserved.
+_MPEG_VERSIONS = (2.5, None, 2, 1)
+# Indexed by the 2 bit layer field. `None` is reserved.
+_LAYERS = (None, 3, 2, 1)
+# Indexed by the 2 bit sample rate field, then by version.
+_SAMPLE_RATES = {
+    1: (44100, 48000, 32000),
+    2: (22050, 24000, 16000),
+    2.5: (11025, 12000, 8000),
+}
+# In kbps, indexed by the 4 bit bitrate field. 0 is "free format", which isn't supported.
+_BITRATES = {
+    (1, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (1, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (1, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (2, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (2, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (2, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_MONO = 3
+
+_ID3V1_SIZE = 128
+_APE_FOOTER_SIZE = 32
+# How far into a file to look for the first frame, after any ID3v2 tags.
+_MAX_LEADING_JUNK = 4096
+
+FrameHeader = collections.namedtuple(
+    'FrameHeader', ['version', 'layer', 'has_crc', 'bitrate', 'sample_rate', 'num_channels', 'length'])
+
+
+class InvalidMp3Error(ValueError):
+    """Raised when a file isn't a complete, well-formed MP3."""
+
+
+def parse_frame_header(data, offset=0):
+    """Parses the MPEG audio frame header at `data[offset:offset + 4]`.
+
+    Returns:
+        A `FrameHeader`, or `None` if there isn't a valid frame header there.
+    """
+    if len(data) < offset + 4:
+        return None
+    header, = struct.unpack('>I', data[offset:offset + 4])
+    if header >> 21 != 0x7FF:
+        return None
+    version = _MPEG_VERSIONS[(header >> 19) & 0x3]
+    layer = _LAYERS[(header >> 17) & 0x3]
+    bitrate_index = (header >> 12) & 0xF
+    sample_rate_index = (header >> 10) & 0x3
+    if version is None or layer is None or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+    bitrate = _BITRATES[(min(version, 2), layer)][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][sample_rate_index]
+    padding = (header >> 9) & 0x1
+    if layer == 1:
+        length = (12 * bitrate // sample_rate + padding) * 4
+    elif layer == 3 and version != 1:
+        length = 72 * bitrate // sample_rate + padding
+    else:
+        length = 144 * bitrate // sample_rate + padding
+    return FrameHeader(
+        version=version,
+        layer=layer,
+        has_crc=not (header >> 16) & 0x1,
+        bitrate=bitrate,
+        sample_rate=sample_rate,
+        num_channels=1 if (header >> 6) & 0x3 == _MONO else 2,
+        length=length)
+
+
+def _side_info_length(frame):
+    if frame.version == 1:
+        return 17 if frame.num_channels == 1 else 32
+    return 9 if frame.num_channels == 1 else 17
+
+
+def _parse_side_info(data, offset, frame):
+    """Returns (main_data_begin, [(part2_3_length, global_gain) for each granule and channel]) of a Layer III frame."""
+    start = offset + 4 + (2 if frame.has_crc else 0)
+    side_info = data[start:start + _side_info_length(frame)]
+    num_bits = len(side_info) * 8
+    bits = int(binascii.hexlify(side_info), 16)
+
+    def _read(bit_offset, width):
+        return (bits >> (num_bits - bit_offset - width)) & ((1 << width) - 1)
+
+    if frame.version == 1:
+        main_data_begin = _read(0, 9)
+        bit_offset = 9 + (5 if frame.num_channels == 1 else 3) + 4 * frame.num_channels
+        num_granules, granule_bits = 2, 59
+    else:
+        main_data_begin = _read(0, 8)
+        bit_offset = 8 + frame.num_channels
+        num_granules, granule_bits = 1, 63
+    granules = []
+    for _ in xrange(num_granules * frame.num_channels):
+        granules.append((_read(bit_offset, 12), _read(bit_offset + 21, 8)))
+        bit_offset += granule_bits
+    return main_data_begin, granules
+
+
+def _is_vbr_info_frame(data, offset, frame):
+    """Whether a frame holds a Xing, Info or VBRI header instead of audio. Its frame count is wrong once we trim."""
+    start = offset + 4 + (2 if frame.has_crc else 0) + _side_info_length(frame)
+    return data[start:start + 4] in ('Xing', 'Info') or data[offset + 36:offset + 40] == 'VBRI'
+
+
+def _id3v2_length(data, offset):
+    """Returns the length of the ID3v2 tag at `offset`, or 0 if there isn't one."""
+    if data[offset:offset + 3] != 'ID3' or len(data) < offset + 10:
+        return 0
+    size_bytes = bytearray(data[offset + 6:offset + 10])
+    if any(b & 0x80 for b in size_bytes):
+        raise InvalidMp3Error('Malformed ID3v2 tag at byte %i.' % offset)
+    size = 0
+    for b in size_bytes:
+        size = (size << 7) | b
+    has_footer = ord(data[offset + 5]) & 0x10
+    return 10 + size + (10 if has_footer else 0)
+
+
+def _audio_end(data, start):
+    """Returns the offset where trailing ID3v1 and APE tags start."""
+    end = len(data)
+    if end - start >= _ID3V1_SIZE and data[end - _ID3V1_SIZE:end - _ID3V1_SIZE + 3] == 'TAG':
+        end -= _ID3V1_SIZE
+    if end - start >= _APE_FOOTER_SIZE and data[end - _APE_FOOTER_SIZE:end - _APE_FOOTER_SIZE + 8] == 'APETAGEX':
+        footer = data[end - _APE_FOOTER_SIZE:end]
+        tag_size, _, flags = struct.unpack('<III', footer[12:24])
+        has_header = flags & 0x80000000
+        end -= tag_size + (_APE_FOOTER_SIZE if has_header else 0)
+        if end < start:
+            raise InvalidMp3Error('Malformed APE tag.')
+    return end
+
+
+def _find_first_frame(data, start, end):
+    """Returns the offset of the first frame, which must be followed by a compatible frame or the end of the audio."""
+    for offset in xrange(start, min(end, start + _MAX_LEADING_JUNK)):
+        if data[offset] != '\xff':
+            continue
+        frame = parse_frame_header(data, offset)
+        if frame is None:
+            continue
+        next_offset = offset + frame.length
+        next_frame = parse_frame_header(data, next_offset)
+        if next_offset == end or (next_frame and next_frame[:2] == frame[:2]):
+            return offset
+    raise InvalidMp3Error('Couldn\'t find an MP3 frame.')
+
+
+def parse_frames(data):
+    """Finds every frame of an MP3.
+
+    Args:
+        data: The contents of an MP3 file.
+
+    Returns:
+        A list of (offset, `FrameHeader`), without any tags.
+
+    Raises:
+        InvalidMp3Error: If the file is truncated, or isn't a well-formed MP3.
+    """
+    start = 0
+    tag_length = _id3v2_length(data, start)
+    while tag_length:
+        start += tag_length
+        tag_length = _id3v2_length(data, start)
+    end = _audio_end(data, start)
+    if start >= end:
+        raise InvalidMp3Error('There\'s no audio after the tags.')
+
+    frames = []
+    offset = _find_first_frame(data, start, end)
+    while offset < end:
+        frame = parse_frame_header(data, offset)
+        if frame is None or (frames and frame[:2] != frames[0][1][:2]):
+            raise InvalidMp3Error('Lost frame sync at byte %i of %i.' % (offset, end))
+        if offset + frame.length > end:
+            raise InvalidMp3Error('Truncated: the frame at byte %i needs %i bytes, but only %i are left.' % (
+                offset, frame.length, end - offset))
+        frames.append((offset, frame))
+        offset += frame.length
+    return frames
+
+
+def _silent_frames(data, frames, max_silent_gain):
+    """Returns whether each Layer III frame is silent, and the `main_data_begin` of each frame."""
+    is_silent, main_data_begins = [], []
+    for offset, frame in frames:
+        main_data_begin, granules = _parse_side_info(data, offset, frame)
+        is_silent.append(all(part2_3_length == 0 or global_gain <= max_silent_gain
+                             for part2_3_length, global_gain in granules))
+        main_data_begins.append(main_data_begin)
+    return is_silent, main_data_begins
+
+
+def clean_mp3_data(data, trim_silence=True, max_silent_gain=100, padding_frames=1):
+    """Returns `data` without tags and, optionally, without leading and trailing silent frames.
+
+    Args:
+        data: The contents of an MP3 file.
+        trim_silence: Whether to drop silent frames at the start and end. Only Layer III files are trimmed.
+        max_silent_gain: A granule is silent if it has no coded audio, or its global gain is at most this. 210 is
+            roughly full scale, and each step is 1.5dB.
+        padding_frames: The number of silent frames to keep on each side of the audio, so it doesn't start or end
+            abruptly. More leading frames are kept if the first audible frame uses their bit reservoir.
+
+    Raises:
+        InvalidMp3Error: If the file is truncated, or isn't a well-formed MP3.
+    """
+    frames = parse_frames(data)
+    if frames and _is_vbr_info_frame(data, *frames[0]):
+        frames = frames[1:]
+    if not frames:
+        raise InvalidMp3Error('There are no audio frames.')
+    first, last = 0, len(frames) - 1
+    if trim_silence and frames[0][1].layer == 3:
+        is_silent, main_data_begins = _silent_frames(data, frames, max_silent_gain)
+        if all(is_silent):
+            logging.warning('Every frame is silent, so not trimming.')
+        else:
+            first = is_silent.index(False)
+            last = len(frames) - 1 - is_silent[::-1].index(False)
+            # The audio of a frame can start in the main data of earlier frames (the "bit reservoir"), so keep
+            # enough earlier frames to cover it.
+            bytes_needed = main_data_begins[first]
+            keep_from = first
+            while bytes_needed > 0 and keep_from > 0:
+                keep_from -= 1
+                offset, frame = frames[keep_from]
+                bytes_needed -= frame.length - 4 - (2 if frame.has_crc else 0) - _side_info_length(frame)
+            first = max(0, min(keep_from, first - padding_frames))
+            last = min(len(frames) - 1, last + padding_frames)
+    return b''.join(data[offset:offset + frame.length] for offset, frame in frames[first:last + 1])
+
+
+def clean_mp3(filename, trim_silence=True, max_silent_gain=100, padding_frames=1):
+    """Validates an MP3 and rewrites it in place without tags and edge silence. See `clean_mp3_data`.
+
+    Returns:
+        The new size in bytes.
+
+    Raises:
+        InvalidMp3Error: If the file is truncated, or isn't a well-formed MP3. The file is left as it was.
+    """
+    with open(filename, 'rb') as f:
+        data = f.read()
+    cleaned = clean_mp3_data(data, trim_silence=trim_silence, max_silent_gain=max_silent_gain,
+                             padding_frames=padding_frames)
+    if len(cleaned) < len(data):
+        temp_filename = filename + '.aeag-clean'
+        try:
+            with open(temp_filename, 'wb') as f:
+                f.write(cleaned)
+            os.rename(temp_filename, filename)
+        finally:
+            if os.path.exists(temp_filename):
+                os.remove(temp_filename)
+        logging.info('Cleaned %s from %i to %i bytes.', filename, len(data), len(cleaned))
+    return len(cleaned)
+
+
+def _clean_mp3_or_log(args):
+    """Returns whether the file is a valid MP3."""
+    filename, trim_silence, max_silent_gain = args
+    try:
+        clean_mp3(filename, trim_silence=trim_silence, max_silent_gain=max_silent_gain)
+    except (InvalidMp3Error, IOError) as e:
+        logging.warning('Rejecting audio file %s: %s', filename, e)
+        return False
+    return True
+
+
+def clean_mp3s(filenames, trim_silence=True, max_silent_gain=100, num_processes=None):
+    """Validates and cleans many MP3s in place, in a pool of processes. See `clean_mp3`.
+
+    Args:
+        filenames: A list of MP3 files.
+        trim_silence: See `clean_mp3_data`.
+        max_silent_gain: See `clean_mp3_data`.
+        num_processes: The number of processes to use. Defaults to the number of CPUs.
+
+    Returns:
+        A list of the files that aren't valid MP3s. They're left as they were.
+    """
+    args = [(filename, trim_silence, max_silent_gain) for filename in filenames]
+    results = download_utils.map_in_processes(_clean_mp3_or_log, args, num_processes)
+    return [filename for filename, is_valid in zip(filenames, results) if not is_valid]
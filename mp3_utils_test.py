@@ -0,0 +1,103 @@
+"""Test MP3 utils module."""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import mp3_utils
+
+
+# MPEG 1 Layer III, no CRC, 128kbps, 44.1kHz, mono.
+_HEADER = '\xff\xfb\x90\xc0'
+_FRAME_LENGTH = 417
+_SIDE_INFO_LENGTH = 17
+
+
+def _make_frame(part2_3_length, global_gain, main_data_begin=0, fill='\x55'):
+    """Makes a mono MPEG 1 Layer III frame whose two granules have the given side info."""
+    bits = [(main_data_begin, 9), (0, 5), (0, 4)]
+    for _ in xrange(2):
+        bits.extend([(part2_3_length, 12), (0, 9), (global_gain, 8), (0, 30)])
+    value, num_bits = 0, 0
+    for field, width in bits:
+        value = (value << width) | field
+        num_bits += width
+    value <<= _SIDE_INFO_LENGTH * 8 - num_bits
+    side_info = ('%034x' % value).decode('hex')
+    return _HEADER + side_info + fill * (_FRAME_LENGTH - 4 - _SIDE_INFO_LENGTH)
+
+
+def _silent_frame():
+    return _make_frame(0, 0)
+
+
+def _loud_frame(main_data_begin=0):
+    return _make_frame(1000, 180, main_data_begin=main_data_begin)
+
+
+def _id3v2_tag(size):
+    size_bytes = ''.join(chr((size >> shift) & 0x7F) for shift in (21, 14, 7, 0))
+    return 'ID3\x03\x00\x00' + size_bytes + '\x00' * size
+
+
+class TestMp3Utils(unittest.TestCase):
+
+    def test_parse_frame_header(self):
+        frame = mp3_utils.parse_frame_header(_HEADER)
+        self.assertEqual(1, frame.version)
+        self.assertEqual(3, frame.layer)
+        self.assertEqual(128000, frame.bitrate)
+        self.assertEqual(44100, frame.sample_rate)
+        self.assertEqual(1, frame.num_channels)
+        self.assertEqual(_FRAME_LENGTH, frame.length)
+        self.assertIsNone(mp3_utils.parse_frame_header('ID3\x03'))
+
+    def test_strips_tags_and_trims_silence(self):
+        audio = [_loud_frame(), _loud_frame()]
+        data = (_id3v2_tag(1000) + _silent_frame() * 5 + ''.join(audio) + _silent_frame() * 5 +
+                'TAG' + '\x00' * 125)
+        cleaned = mp3_utils.clean_mp3_data(data)
+        self.assertEqual(_silent_frame() + ''.join(audio) + _silent_frame(), cleaned)
+        self.assertEqual(data[1010:-128], mp3_utils.clean_mp3_data(data, trim_silence=False))
+
+    def test_keeps_frames_in_bit_reservoir(self):
+        data = _silent_frame() * 5 + _loud_frame(main_data_begin=500)
+        # The loud frame's data starts 500 bytes back, which is two frames' worth of main data.
+        self.assertEqual(_silent_frame() * 2 + _loud_frame(main_data_begin=500), mp3_utils.clean_mp3_data(data))
+
+    def test_drops_vbr_info_frame(self):
+        info_frame = _HEADER + '\x00' * _SIDE_INFO_LENGTH + 'Info' + '\x00' * (_FRAME_LENGTH - 25)
+        self.assertEqual(_loud_frame(), mp3_utils.clean_mp3_data(info_frame + _loud_frame()))
+
+    def test_rejects_invalid_files(self):
+        data = _loud_frame() * 3
+        with self.assertRaises(mp3_utils.InvalidMp3Error):
+            mp3_utils.clean_mp3_data(data[:-10])
+        with self.assertRaises(mp3_utils.InvalidMp3Error):
+            mp3_utils.clean_mp3_data(data + 'garbage')
+        with self.assertRaises(mp3_utils.InvalidMp3Error):
+            mp3_utils.clean_mp3_data('<html>Not found</html>')
+        with self.assertRaises(mp3_utils.InvalidMp3Error):
+            mp3_utils.clean_mp3_data('')
+
+    def test_clean_mp3s(self):
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            good_fn, bad_fn = os.path.join(tmp_dir, 'good.mp3'), os.path.join(tmp_dir, 'bad.mp3')
+            with open(good_fn, 'wb') as f:
+                f.write(_silent_frame() * 3 + _loud_frame() + _silent_frame() * 3)
+            with open(bad_fn, 'wb') as f:
+                f.write(_loud_frame()[:100])
+            self.assertEqual([bad_fn], mp3_utils.clean_mp3s([good_fn, bad_fn], num_processes=2))
+            self.assertEqual(3 * _FRAME_LENGTH, os.path.getsize(good_fn))
+            self.assertEqual(100, os.path.getsize(bad_fn))
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+    unittest.main()
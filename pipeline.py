@@ -0,0 +1,128 @@
+"""Streams items through a chain of stages, overlapping the stages across items.
+
+Each item flows through the stages on its own, so a slow item at one stage doesn't hold up the rest of the batch, and
+results reach the sink as soon as each item is done. Python 2 has no `asyncio`, so each stage is a small pool of worker
+threads, connected to the next stage by a bounded queue. The work is network-bound, so threads are enough.
+"""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+import Queue
+import sys
+import threading
+
+
+# Marks the end of the input in a queue.
+_DONE = object()
+
+
+class Stage(object):
+    """One step of a pipeline.
+
+    Args:
+        name: A human-readable name, used in thread names.
+        fn: A function that takes an item and returns the processed item, or `None` to drop the item.
+        num_workers: The number of items this stage processes at once.
+    """
+
+    def __init__(self, name, fn, num_workers=1):
+        if num_workers < 1:
+            raise ValueError('Stage `%s` must have at least 1 worker. Instead, had %i' % (name, num_workers))
+        self.name = name
+        self.fn = fn
+        self.num_workers = num_workers
+
+
+def run_pipeline(items, stages, sink, queue_size=32):
+    """Runs every item through `stages`, in order, and passes the results to `sink`.
+
+    Args:
+        items: An iterable of inputs. It's consumed lazily, so it can be a generator over a very large input.
+        stages: A list of `Stage`s.
+        sink: A function called with each item that made it through every stage, as soon as it does. It's always
+            called from the calling thread, so it doesn't need to be thread-safe.
+        queue_size: The maximum number of items waiting between any two stages.
+
+    Returns:
+        The number of items passed to `sink`.
+
+    Raises:
+        The first exception raised by a stage or the sink, after all threads have stopped.
+    """
+    queues = [Queue.Queue(maxsize=queue_size) for _ in xrange(len(stages) + 1)]
+    errors = []
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def _record_error():
+        with lock:
+            errors.append(sys.exc_info())
+        stop.set()
+
+    def _feed():
+        try:
+            for item in items:
+                if stop.is_set():
+                    break
+                queues[0].put(item)
+        except Exception:
+            _record_error()
+        finally:
+            queues[0].put(_DONE)
+
+    def _make_worker(stage, in_queue, out_queue, workers_left):
+        def _work():
+            while True:
+                item = in_queue.get()
+                if item is _DONE:
+                    # Let sibling workers see the end of the input too. The last worker out tells the next stage.
+                    in_queue.put(_DONE)
+                    with lock:
+                        workers_left[0] -= 1
+                        last_worker = workers_left[0] == 0
+                    if last_worker:
+                        out_queue.put(_DONE)
+                    return
+                if stop.is_set():
+                    # Keep draining, so that upstream threads never block on a full queue.
+                    continue
+                try:
+                    item = stage.fn(item)
+                except Exception:
+                    _record_error()
+                    continue
+                if item is not None:
+                    out_queue.put(item)
+        return _work
+
+    threads = [threading.Thread(target=_feed, name='pipeline-feed')]
+    for i, stage in enumerate(stages):
+        workers_left = [stage.num_workers]
+        for j in xrange(stage.num_workers):
+            threads.append(threading.Thread(
+                target=_make_worker(stage, queues[i], queues[i + 1], workers_left),
+                name='pipeline-%s-%i' % (stage.name, j)))
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    num_done = 0
+    while True:
+        item = queues[-1].get()
+        if item is _DONE:
+            break
+        if stop.is_set():
+            continue
+        try:
+            sink(item)
+            num_done += 1
+        except Exception:
+            _record_error()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        exc_type, exc_value, exc_traceback = errors[0]
+        raise exc_type, exc_value, exc_traceback
+    return num_done
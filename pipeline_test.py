@@ -0,0 +1,34 @@
+"""Test pipeline module."""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+import unittest
+
+import pipeline
+
+
+class TestPipeline(unittest.TestCase):
+
+    def test_run_pipeline(self):
+        stages = [
+            pipeline.Stage('double', lambda x: x * 2, num_workers=3),
+            pipeline.Stage('drop_tens', lambda x: None if x % 10 == 0 else x, num_workers=2),
+        ]
+        results = []
+        num_done = pipeline.run_pipeline(iter(xrange(100)), stages, results.append, queue_size=2)
+        self.assertEqual(80, num_done)
+        self.assertListEqual([x * 2 for x in xrange(100) if (x * 2) % 10 != 0], sorted(results))
+
+    def test_run_pipeline_raises_first_error(self):
+        def _fail_on_seven(x):
+            if x == 7:
+                raise ValueError('seven')
+            return x
+        stages = [pipeline.Stage('fail', _fail_on_seven, num_workers=2)]
+        with self.assertRaisesRegexp(ValueError, 'seven'):
+            pipeline.run_pipeline(xrange(100), stages, lambda _: None, queue_size=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
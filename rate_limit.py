@@ -0,0 +1,294 @@
+"""Rate limiting and quota tracking for the external APIs we call.
+
+Each service (see `SERVICES`) has a `RateLimiter`. It spaces out requests with a token bucket, counts them against a
+daily quota, and backs off when the service answers with 429, or with a 403 whose reason is a rate limit, which is how
+Google APIs say "too many requests". Other 403s, like invalid keys, are raised right away. After a rate limit response
+the bucket slows down, and it speeds back up as requests succeed.
+
+Quota usage is kept in a `QuotaAccountant`, which persists between runs. When a daily quota is used up, the limiter
+waits for it to reset at midnight UTC, so a long job slows down instead of failing.
+
+`configure_limiter` sets up the limiter for a service, and `get_limiter` returns it. Services that were never
+configured get a limiter that doesn't limit anything.
+"""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+import datetime
+import json
+import logging
+import random
+import threading
+import time
+
+import disk_cache
+import metrics
+
+
+SERVICES = ('translate', 'cse', 'forvo')
+# Google APIs also answer 403 for invalid keys and forbidden requests, so a 403 is only a rate limit for these reasons.
+_RATE_LIMIT_REASONS = frozenset(['rateLimitExceeded', 'userRateLimitExceeded', 'dailyLimitExceeded'])
+# After a rate limit response, the rate is multiplied by this...
+_SLOW_DOWN_FACTOR = 0.5
+# ...and after each success, it recovers by this fraction of the configured rate.
+_SPEED_UP_FRACTION = 0.1
+# The bucket never slows down below one request a minute.
+_MIN_RATE_PER_SEC = 1. / 60
+# Sleep in slices of at most this long, so that Ctrl-C can interrupt long waits.
+_MAX_SLEEP_SECS = 60
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+class QuotaExceededError(IOError):
+    """Raised when a daily quota is used up, and the limiter was told not to wait for it to reset."""
+
+
+def _sleep(secs):
+    end_time = time.time() + secs
+    while True:
+        remaining_secs = end_time - time.time()
+        if remaining_secs <= 0:
+            return
+        time.sleep(min(remaining_secs, _MAX_SLEEP_SECS))
+
+
+def _utc_today():
+    return datetime.datetime.utcnow().date()
+
+
+def _secs_until_utc_midnight():
+    now = datetime.datetime.utcnow()
+    tomorrow = datetime.datetime.combine(now.date() + datetime.timedelta(days=1), datetime.time())
+    return (tomorrow - now).total_seconds()
+
+
+class TokenBucket(object):
+    """A thread-safe token bucket, whose rate adapts to rate limit responses.
+
+    Args:
+        rate_per_sec: The number of tokens added per second, or `None` for no limit.
+        burst: The maximum number of tokens that can build up.
+    """
+
+    def __init__(self, rate_per_sec=None, burst=1):
+        if rate_per_sec is not None and rate_per_sec <= 0:
+            raise ValueError('`rate_per_sec` must be positive. Instead, was %s' % rate_per_sec)
+        self._max_rate_per_sec = rate_per_sec
+        self._rate_per_sec = rate_per_sec
+        self._burst = max(1, burst)
+        self._tokens = float(self._burst)
+        self._last_refill = time.time()
+        self._lock = threading.Lock()
+
+    @property
+    def rate_per_sec(self):
+        return self._rate_per_sec
+
+    def _refill(self):
+        now = time.time()
+        self._tokens = min(self._burst, self._tokens + (now - self._last_refill) * self._rate_per_sec)
+        self._last_refill = now
+
+    def acquire(self):
+        """Blocks until a token is available, and takes it."""
+        if self._rate_per_sec is None:
+            return
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_secs = (1 - self._tokens) / self._rate_per_sec
+            _sleep(wait_secs)
+
+    def slow_down(self):
+        """Called after a rate limit response."""
+        if self._rate_per_sec is None:
+            return
+        with self._lock:
+            self._refill()
+            self._rate_per_sec = max(_MIN_RATE_PER_SEC, self._rate_per_sec * _SLOW_DOWN_FACTOR)
+            self._tokens = min(self._tokens, 0.)
+        logging.warning('Slowing down to %.3g requests per second.', self._rate_per_sec)
+
+    def speed_up(self):
+        """Called after a successful request."""
+        if self._rate_per_sec is None or self._rate_per_sec >= self._max_rate_per_sec:
+            return
+        with self._lock:
+            self._refill()
+            self._rate_per_sec = min(self._max_rate_per_sec,
+                                     self._rate_per_sec + self._max_rate_per_sec * _SPEED_UP_FRACTION)
+
+
+class QuotaAccountant(object):
+    """Counts the daily usage of each service, persistently.
+
+    Days are UTC days, which is when Google API quotas reset.
+
+    Args:
+        path: The SQLite file to store the counts in, or `None` to only count in memory.
+    """
+
+    def __init__(self, path=None):
+        self._cache = disk_cache.DiskCache(path) if path else None
+        self._in_memory_counts = {}
+        self._lock = threading.Lock()
+
+    def _key(self, service):
+        return (service, _utc_today().isoformat())
+
+    def _get(self, key):
+        if self._cache is not None:
+            return self._cache.get(key, default=0)
+        return self._in_memory_counts.get(key, 0)
+
+    def get_usage(self, service):
+        """Returns the usage of `service` today."""
+        with self._lock:
+            return self._get(self._key(service))
+
+    def try_use(self, service, cost=1, daily_limit=None):
+        """Adds `cost` to today's usage of `service`, unless that would go over `daily_limit`.
+
+        Returns:
+            Whether the usage was added.
+        """
+        with self._lock:
+            key = self._key(service)
+            usage = self._get(key)
+            if daily_limit is not None and usage + cost > daily_limit:
+                return False
+            if self._cache is not None:
+                # Keep counts for a couple of days, so they're still there if a run straddles midnight.
+                self._cache.set(key, usage + cost, ttl_secs=2 * 60 * 60 * 24)
+            else:
+                self._in_memory_counts[key] = usage + cost
+            return True
+
+
+def _status_of(error):
+    """Returns the HTTP status of an exception, if it has one.
+
+    `download_utils.HttpError` has a `status`, and `googleapiclient.errors.HttpError` has a `resp` with a `status`.
+    """
+    status = getattr(error, 'status', None)
+    if status is None:
+        status = getattr(getattr(error, 'resp', None), 'status', None)
+    try:
+        return int(status)
+    except (TypeError, ValueError):
+        return None
+
+
+def _reasons_of(error):
+    """Returns the error reasons in the JSON body of a `googleapiclient.errors.HttpError`, ex `rateLimitExceeded`."""
+    try:
+        body = json.loads(getattr(error, 'content', None))
+        return set(item.get('reason') for item in body['error']['errors'])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return set()
+
+
+def _is_rate_limited(error):
+    status = _status_of(error)
+    return status == 429 or (status == 403 and bool(_reasons_of(error) & _RATE_LIMIT_REASONS))
+
+
+def _retry_after_secs(error):
+    """Returns the Retry-After of a `googleapiclient.errors.HttpError`, if it has one in seconds."""
+    resp = getattr(error, 'resp', None)
+    try:
+        return float(resp.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class RateLimiter(object):
+    """Rate limits, counts, and retries the requests to one service.
+
+    Args:
+        service: The name of the service, for quota accounting and logging.
+        rate_per_sec: The maximum steady rate of requests, or `None` for no limit.
+        burst: The number of requests that can be made at once, after a quiet period.
+        daily_limit: The daily quota, in the units of `cost` passed to `call`, or `None` for no limit.
+        accountant: The `QuotaAccountant` to count usage with. Defaults to one that counts in memory.
+        wait_for_quota: If `True`, wait for the daily quota to reset when it's used up. Otherwise, raise
+            `QuotaExceededError`.
+        max_retries: The number of times to retry a request that got a rate limit response.
+        initial_backoff_secs: The wait before the first retry. It doubles with each retry.
+        max_backoff_secs: The longest wait between retries.
+    """
+
+    def __init__(self, service, rate_per_sec=None, burst=1, daily_limit=None, accountant=None, wait_for_quota=True,
+                 max_retries=5, initial_backoff_secs=1., max_backoff_secs=300.):
+        self._service = service
+        self._bucket = TokenBucket(rate_per_sec, burst)
+        self._daily_limit = daily_limit
+        self._accountant = accountant or QuotaAccountant()
+        self._wait_for_quota = wait_for_quota
+        self._max_retries = max_retries
+        self._initial_backoff_secs = initial_backoff_secs
+        self._max_backoff_secs = max_backoff_secs
+
+    def _use_quota(self, cost):
+        while not self._accountant.try_use(self._service, cost, self._daily_limit):
+            if not self._wait_for_quota:
+                raise QuotaExceededError('The daily quota of %s for %s is used up.' % (self._daily_limit, self._service))
+            wait_secs = _secs_until_utc_midnight() + 1
+            metrics.increment('quota_waits', service=self._service)
+            logging.warning('The daily quota of %s for %s is used up. Waiting %.1f hours for it to reset.',
+                            self._daily_limit, self._service, wait_secs / 3600)
+            _sleep(wait_secs)
+
+    def call(self, fn, cost=1):
+        """Calls `fn()` within the rate limit and quota, retrying with backoff on rate limit responses.
+
+        Args:
+            fn: A function of no arguments that makes one request.
+            cost: How much of the daily quota the request uses.
+
+        Returns:
+            The result of `fn()`.
+
+        Raises:
+            QuotaExceededError: If the daily quota is used up, and `wait_for_quota` is `False`.
+            Whatever `fn` raises, if it isn't a rate limit response, or it still is after `max_retries` retries.
+        """
+        for attempt in xrange(self._max_retries + 1):
+            self._bucket.acquire()
+            self._use_quota(cost)
+            try:
+                result = fn()
+            except Exception as e:
+                if not _is_rate_limited(e) or attempt == self._max_retries:
+                    raise
+                self._bucket.slow_down()
+                metrics.increment('rate_limit_retries', service=self._service)
+                backoff_secs = min(self._max_backoff_secs, self._initial_backoff_secs * 2 ** attempt)
+                # Jitter, so that threads that were limited together don't all retry together.
+                backoff_secs = max(_retry_after_secs(e) or 0, backoff_secs * random.uniform(0.5, 1.5))
+                logging.warning('%s responded with %s. Retrying in %.1f seconds.', self._service, _status_of(e),
+                                backoff_secs)
+                _sleep(backoff_secs)
+                continue
+            self._bucket.speed_up()
+            return result
+
+
+def configure_limiter(service, **kwargs):
+    """Replaces the limiter of `service` with one built from `kwargs`. See `RateLimiter` for the arguments."""
+    with _limiters_lock:
+        _limiters[service] = RateLimiter(service, **kwargs)
+
+
+def get_limiter(service):
+    """Returns the limiter of `service`."""
+    with _limiters_lock:
+        if service not in _limiters:
+            _limiters[service] = RateLimiter(service)
+        return _limiters[service]
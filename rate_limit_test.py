@@ -0,0 +1,87 @@
+"""Test rate limit module."""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+import tempfile
+import time
+import unittest
+
+import httplib2
+from googleapiclient import errors
+
+import download_utils
+import rate_limit
+
+
+def _google_error(status, reason):
+    body = '{"error": {"code": %i, "errors": [{"reason": "%s"}]}}' % (status, reason)
+    return errors.HttpError(httplib2.Response({'status': status}), body)
+
+
+class TestRateLimit(unittest.TestCase):
+
+    def test_token_bucket_limits_rate(self):
+        bucket = rate_limit.TokenBucket(rate_per_sec=100, burst=1)
+        start_time = time.time()
+        for _ in xrange(21):
+            bucket.acquire()
+        self.assertGreaterEqual(time.time() - start_time, 0.19)
+
+    def test_backs_off_on_rate_limit_responses(self):
+        limiter = rate_limit.RateLimiter('cse', rate_per_sec=1000, initial_backoff_secs=0.01)
+        responses = [download_utils.HttpError('url', 429, 'Too Many Requests'),
+                     _google_error(403, 'userRateLimitExceeded'),
+                     'body']
+
+        def _request():
+            response = responses.pop(0)
+            if isinstance(response, Exception):
+                raise response
+            return response
+
+        self.assertEqual('body', limiter.call(_request))
+        self.assertLess(limiter._bucket.rate_per_sec, 1000)
+
+    def test_doesnt_retry_other_errors(self):
+        limiter = rate_limit.RateLimiter('forvo', initial_backoff_secs=0.01)
+        calls = []
+
+        def _request():
+            calls.append(1)
+            raise download_utils.HttpError('url', 404, 'Not Found')
+
+        with self.assertRaises(download_utils.HttpError):
+            limiter.call(_request)
+        self.assertEqual(1, len(calls))
+
+    def test_doesnt_retry_other_403s(self):
+        limiter = rate_limit.RateLimiter('translate', initial_backoff_secs=0.01)
+        calls = []
+
+        def _request():
+            calls.append(1)
+            raise _google_error(403, 'keyInvalid')
+
+        with self.assertRaises(errors.HttpError):
+            limiter.call(_request)
+        self.assertEqual(1, len(calls))
+        self.assertEqual(1, limiter._accountant.get_usage('translate'))
+
+    def test_quota_persists_between_runs(self):
+        quota_file = tempfile.mktemp()
+        limiter = rate_limit.RateLimiter('cse', daily_limit=5, accountant=rate_limit.QuotaAccountant(quota_file),
+                                         wait_for_quota=False)
+        limiter.call(lambda: None, cost=3)
+
+        accountant = rate_limit.QuotaAccountant(quota_file)
+        self.assertEqual(3, accountant.get_usage('cse'))
+        self.assertEqual(0, accountant.get_usage('forvo'))
+        limiter = rate_limit.RateLimiter('cse', daily_limit=5, accountant=accountant, wait_for_quota=False)
+        limiter.call(lambda: None, cost=2)
+        with self.assertRaises(rate_limit.QuotaExceededError):
+            limiter.call(lambda: None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,4 +2,21 @@
 
 python audio_test.py
 python forvo_utils_test.py
-python images_test.py
\ No newline at end of file
+python images_test.py
+python download_utils_test.py
+python pipeline_test.py
+python disk_cache_test.py
+python media_store_test.py
+python main_test.py
+python journal_test.py
+python image_resize_test.py
+python mp3_utils_test.py
+python rate_limit_test.py
+python fake_servers_test.py
+python metrics_test.py
+python media_index_test.py
+python bulk_copy_test.py
+python media_resolver_test.py
+python apkg_writer_test.py
+python sync_manifest_test.py
+python json_utils_test.py
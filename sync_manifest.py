@@ -0,0 +1,115 @@
+"""A record of what the last run made from each input row, so that later runs only process what changed.
+
+Word lists tend to grow a little at a time. `SyncManifest` maps a hash of each input row to the card it produced: the
+English word, the translation, any extra info, and the media files. On the next run, `split_rows` passes on the rows
+that are new or changed, and returns the recorded cards of the rest, so translation, validation, and media fetching
+only cost time for the rows that changed.
+
+Rows that are no longer in the input are forgotten when the manifest is replaced with the current run's cards. The
+manifest also records the target language and the output directory. A run for another language ignores it, since the
+cards it recorded have translations and audio in the wrong language, and so does a run with another output directory,
+since the media it recorded are somewhere else.
+"""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+import hashlib
+import json
+import logging
+import os
+
+import json_utils
+
+
+_VERSION = 1
+
+
+def row_hash(row):
+    """Returns a hash of an input row. Trailing empty fields don't count, so `a,b` and `a,b,` hash the same."""
+    row = list(row)
+    while row and row[-1] == '':
+        row.pop()
+    return hashlib.sha1('\x1f'.join(row)).hexdigest()
+
+
+def make_entry(english, translation, image_filename, audio_filename, extra_info=()):
+    """Returns what the manifest records for the card made from one row."""
+    return {
+        'english': english,
+        'translation': translation,
+        'image_filename': image_filename,
+        'audio_filename': audio_filename,
+        'extra_info': list(extra_info),
+    }
+
+
+class SyncManifest(object):
+    """Maps input row hashes to the cards they produced.
+
+    Args:
+        path: The JSON file to keep the manifest in.
+        target_language: The language code the cards are translated to. A saved manifest for another language is
+            ignored.
+        output_dir: The directory the cards' media are written to. A saved manifest for another directory is ignored.
+    """
+
+    def __init__(self, path, target_language=None, output_dir=None):
+        self._path = path
+        self._target_language = target_language
+        self._output_dir = os.path.abspath(output_dir) if output_dir else None
+        self._entries = {}
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                saved = json.load(f)
+            if saved.get('version') != _VERSION:
+                logging.warning('Ignoring sync manifest %s with unknown version %s.', path, saved.get('version'))
+            elif saved.get('target_language') != target_language:
+                logging.warning('Ignoring sync manifest %s, since it was made for target language %s, not %s.', path,
+                                saved.get('target_language'), target_language)
+            elif saved.get('output_dir') != self._output_dir:
+                logging.warning('Ignoring sync manifest %s, since it was made for output directory %s, not %s.', path,
+                                saved.get('output_dir'), self._output_dir)
+            else:
+                self._entries = json_utils.to_utf8(saved['rows'])
+
+    def __len__(self):
+        return len(self._entries)
+
+    def split_rows(self, rows, is_usable=None):
+        """Separates the rows that need processing from the ones the last run already made cards for.
+
+        Args:
+            rows: An iterable of input rows.
+            is_usable: An optional function of an entry, which returns whether it can still be used, for instance
+                because its media still exists. Rows whose entries aren't usable are processed again.
+
+        Returns:
+            A 2-tuple of (list of (row hash, row) pairs to process, list of (row hash, entry) pairs for unchanged rows).
+            Both are in input order.
+        """
+        rows_to_process, unchanged = [], []
+        for row in rows:
+            digest = row_hash(row)
+            entry = self._entries.get(digest)
+            if entry is not None and (is_usable is None or is_usable(entry)):
+                unchanged.append((digest, entry))
+            else:
+                rows_to_process.append((digest, row))
+        logging.info('%i rows are new or changed since the last run, and %i aren\'t.', len(rows_to_process),
+                     len(unchanged))
+        return rows_to_process, unchanged
+
+    def replace(self, entries):
+        """Replaces every entry with `entries`, a dictionary of {row hash: entry}."""
+        self._entries = dict(entries)
+
+    def save(self):
+        dirname = os.path.dirname(os.path.abspath(self._path))
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        temp_path = self._path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump({'version': _VERSION, 'target_language': self._target_language, 'output_dir': self._output_dir,
+                       'rows': self._entries}, f)
+        os.rename(temp_path, self._path)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""Test sync manifest module."""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import sync_manifest
+
+
+class TestSyncManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'sync.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_row_hash(self):
+        self.assertEqual(sync_manifest.row_hash(['water', 'מים']), sync_manifest.row_hash(['water', 'מים', '']))
+        self.assertNotEqual(sync_manifest.row_hash(['water', 'מים']), sync_manifest.row_hash(['water', 'מיים']))
+
+    def test_only_new_changed_and_unusable_rows_are_processed(self):
+        manifest = sync_manifest.SyncManifest(self.path)
+        rows = [['water', 'מים'], ['fire', 'אש'], ['ice', 'קרח']]
+        rows_to_process, unchanged = manifest.split_rows(rows)
+        self.assertEqual(rows, [row for _, row in rows_to_process])
+        self.assertEqual([], unchanged)
+        manifest.replace({digest: sync_manifest.make_entry(row[0], row[1], row[0] + '.png', row[1] + '.mp3')
+                          for digest, row in rows_to_process})
+        manifest.save()
+
+        manifest = sync_manifest.SyncManifest(self.path)
+        self.assertEqual(3, len(manifest))
+        new_rows = [['water', 'מים'], ['fire', 'אש!'], ['ice', 'קרח'], ['earth', 'אדמה']]
+        rows_to_process, unchanged = manifest.split_rows(
+            new_rows, is_usable=lambda entry: entry['english'] != 'ice')
+        self.assertEqual([['fire', 'אש!'], ['ice', 'קרח'], ['earth', 'אדמה']], [row for _, row in rows_to_process])
+        (_, entry), = unchanged
+        self.assertEqual(sync_manifest.make_entry('water', 'מים', 'water.png', 'מים.mp3'), entry)
+        # Entries come back as utf-8 encoded `str`s, like the rest of the program uses.
+        self.assertIsInstance(entry['translation'], str)
+
+    def test_ignores_other_target_languages(self):
+        manifest = sync_manifest.SyncManifest(self.path, target_language='iw')
+        rows_to_process, _ = manifest.split_rows([['water']])
+        manifest.replace({digest: sync_manifest.make_entry('water', 'מים', 'water.png', 'מים.mp3')
+                          for digest, _ in rows_to_process})
+        manifest.save()
+
+        self.assertEqual(1, len(sync_manifest.SyncManifest(self.path, target_language='iw')))
+        manifest = sync_manifest.SyncManifest(self.path, target_language='es')
+        self.assertEqual(0, len(manifest))
+        self.assertEqual([['water']], [row for _, row in manifest.split_rows([['water']])[0]])
+
+    def test_ignores_other_output_dirs(self):
+        manifest = sync_manifest.SyncManifest(self.path, output_dir='media')
+        rows_to_process, _ = manifest.split_rows([['water']])
+        manifest.replace({digest: sync_manifest.make_entry('water', 'מים', 'media/water.png', 'media/מים.mp3')
+                          for digest, _ in rows_to_process})
+        manifest.save()
+
+        self.assertEqual(1, len(sync_manifest.SyncManifest(self.path, output_dir=os.path.abspath('media'))))
+        self.assertEqual(0, len(sync_manifest.SyncManifest(self.path, output_dir='other_media')))
+
+
+if __name__ == '__main__':
+    unittest.main()
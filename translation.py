@@ -16,10 +16,24 @@ https://github.com/google/google-api-python-client/tree/master/samples/translate
 
 __author__ = 'shor.joel@gmail.com (Joel Shor)'
 
+import re
 import string
+import threading
+import unicodedata
 
 from googleapiclient.discovery import build
 
+import metrics
+import rate_limit
+
+
+# Where the API client fetches the API's description from, or `None` for its default. Benchmarks point this at a
+# local stand-in server.
+DISCOVERY_SERVICE_URL = None
+
+# The Google API client isn't thread-safe, so each thread keeps its own service object.
+_thread_local = threading.local()
+
 
 def _is_english(word):
     # NOTE: This is a hack for sorting between English and Hebrew, which have disjoint character sets. This will have
@@ -27,7 +41,52 @@ def _is_english(word):
     return set(word).issubset(set(string.printable))
 
 
-def get_translations(single_words, credentials, target_language='iw', max_words=100):
+def _get_service(credentials):
+    """Returns this thread's Translate service object, building it on first use."""
+    if not hasattr(_thread_local, 'services'):
+        _thread_local.services = {}
+    services = _thread_local.services
+    developer_key = credentials.translate.developerKey
+    if developer_key not in services:
+        # Build a service object for interacting with the API. Visit
+        # the Google APIs Console <http://code.google.com/apis/console>
+        # to get an API key for your own application.
+        kwargs = {'discoveryServiceUrl': DISCOVERY_SERVICE_URL} if DISCOVERY_SERVICE_URL else {}
+        services[developer_key] = build('translate', 'v2', developerKey=developer_key, **kwargs)
+    return services[developer_key]
+
+
+def _translate_words(words, credentials, source, target, max_words, cache):
+    """Translates a list of utf-8 words from `source` to `target`, only calling the API for words not in `cache`."""
+    keys = [(source, target, word) for word in words]
+    cached_translations = cache.get_many(keys) if cache is not None else {}
+    translations = {word: cached_translations[key].encode('utf-8')
+                    for word, key in zip(words, keys) if key in cached_translations}
+    words_to_translate = sorted(set(words) - set(translations))
+    metrics.increment('translation_cache_hits', len(translations))
+
+    new_translations = {}
+    for batch_i in xrange(0, len(words_to_translate), max_words):
+        cur_words = words_to_translate[batch_i: batch_i + max_words]
+        q = [x.decode('utf-8') for x in cur_words]
+        request = _get_service(credentials).translations().list(
+            source=source,
+            target=target,
+            q=q,
+        )
+        # The Translate API quota is counted in characters.
+        with metrics.timer('translation'):
+            response = rate_limit.get_limiter('translate').call(request.execute, cost=sum(len(x) for x in q))
+        cur_translations = [x['translatedText'].encode('utf-8') for x in response['translations']]
+        new_translations.update(zip(cur_words, cur_translations))
+    if cache is not None and new_translations:
+        cache.set_many({(source, target, word): translation for word, translation in new_translations.items()})
+    translations.update(new_translations)
+
+    return [translations[word] for word in words]
+
+
+def get_translations(single_words, credentials, target_language='iw', max_words=100, cache=None):
     """Translate list of words from English to target language or the reverse.
 
     Args:
@@ -35,6 +94,8 @@ def get_translations(single_words, credentials, target_language='iw', max_words=
         credentials: A object with Google Translate credentials.
         target_language: Language code of target language.
         max_words: Google translate API only translates a few words at a time, so batch them.
+        cache: An optional `disk_cache.DiskCache`. Words found in it skip the API entirely, and new translations are
+            added to it.
 
     Return:
         A 2-tuple of (English word list, translation word list).
@@ -45,30 +106,13 @@ def get_translations(single_words, credentials, target_language='iw', max_words=
     for word in single_words:
         english_words.append(word) if _is_english(word) else foreign_words.append(word)
 
-    # Build a service object for interacting with the API. Visit
-    # the Google APIs Console <http://code.google.com/apis/console>
-    # to get an API key for your own application.
-    service = build('translate', 'v2', developerKey=credentials.translate.developerKey)
     word_pairs = []
-    for batch_i in xrange(0, len(english_words), max_words):
-        cur_english_words = english_words[batch_i: batch_i + max_words]
-        translations = service.translations().list(
-            source='en',
-            target=target_language,
-            q=cur_english_words,
-        ).execute()
-        cur_foreign_words = [x['translatedText'].encode('utf-8') for x in translations['translations']]
-        word_pairs.extend(zip(cur_english_words, cur_foreign_words))
-    for batch_i in xrange(0, len(foreign_words), max_words):
-        cur_foreign_words = foreign_words[batch_i: batch_i + max_words]
-        decoded_foreign_words = [x.decode('utf-8') for x in cur_foreign_words]
-        translations = service.translations().list(
-            source=target_language,
-            target='en',
-            q=decoded_foreign_words,
-        ).execute()
-        cur_english_words = [x['translatedText'].encode('utf-8') for x in translations['translations']]
-        word_pairs.extend(zip(cur_english_words, cur_foreign_words))
+    word_pairs.extend(zip(
+        english_words,
+        _translate_words(english_words, credentials, 'en', target_language, max_words, cache)))
+    word_pairs.extend(zip(
+        _translate_words(foreign_words, credentials, target_language, 'en', max_words, cache),
+        foreign_words))
     english_words, translated_words = zip(*word_pairs)
 
     for word_list in [english_words, translated_words]:
@@ -79,25 +123,88 @@ def get_translations(single_words, credentials, target_language='iw', max_words=
     return english_words, translated_words
 
 
-def strip_diacritics(word_list):
+def _compile_marks(code_points):
+    """Compiles a set of code points into a regex that matches runs of them."""
+    code_points = sorted(set(code_points))
+    ranges = []
+    for code_point in code_points:
+        if ranges and ranges[-1][1] == code_point - 1:
+            ranges[-1][1] = code_point
+        else:
+            ranges.append([code_point, code_point])
+    return re.compile(u'[%s]+' % u''.join(
+        re.escape(unichr(start)) if start == end else u'%s-%s' % (re.escape(unichr(start)), re.escape(unichr(end)))
+        for start, end in ranges))
+
+
+def register_diacritic_marks(language, code_points, decompose=False):
+    """Adds (or replaces) the table of diacritic marks that `strip_diacritics` removes for a language.
+
+    Args:
+        language: A language code, as passed to `strip_diacritics`.
+        code_points: An iterable of the unicode code points to remove.
+        decompose: If `True`, split precomposed characters (ex `\xe9` into `e` and a combining accent) before stripping,
+            and recompose afterwards. This is needed for scripts, like Latin, where accented letters usually come
+            precomposed.
+    """
+    _DIACRITIC_TABLES[language] = (_compile_marks(code_points), decompose)
+
+
+def has_diacritic_marks(language):
+    """Whether `strip_diacritics` has a table of marks for `language`."""
+    return language in _DIACRITIC_TABLES
+
+
+# Per-language tables of marks to strip, precompiled into regexes, since the `re` module strips a large batch much
+# faster than Python-level loops or `unicode.translate`.
+_DIACRITIC_TABLES = {}
+# Hebrew cantillation marks and niqqud.
+register_diacritic_marks('iw', range(0x0591, 0x05C8))
+register_diacritic_marks('he', range(0x0591, 0x05C8))
+# Arabic harakat, Quranic annotation marks, and the superscript alef.
+register_diacritic_marks(
+    'ar', range(0x0610, 0x061B) + range(0x064B, 0x0660) + [0x0670] + range(0x06D6, 0x06DD) + range(0x06DF, 0x06E5) +
+    range(0x06E7, 0x06E9) + range(0x06EA, 0x06EE))
+# Latin combining diacritical marks.
+register_diacritic_marks('latin', range(0x0300, 0x0370), decompose=True)
+
+# Joins a batch of words into a single string, so the whole batch is stripped in one pass. It can't appear in a word.
+_WORD_SEPARATOR = '\x00'
+
+
+def strip_diacritics(word_list, language='iw'):
     """Strips words of diacritic marks.
 
     Args:
-        word_list: A list of Hebrew words, with diacritics.
+        word_list: A list of words, with diacritics. Words can be utf-8 encoded strings or unicode.
+        language: The language code whose table of marks to strip. See `register_diacritic_marks`.
 
     Returns:
-        A list of Hebrew words without diacritics.
+        A list of utf-8 encoded words without diacritics.
     """
-    def _strip_word(word):
-        if isinstance(word, str):
-            word = word.decode('utf-8')
-        else:
-            if not isinstance(word, unicode):
-                raise ValueError('Word input must be string or unicode. Instead, was %s' % type(word))
-        stripped_word = ''
-        for cur_letter in word:
-            cur_letter_unicode = ord(cur_letter)
-            if cur_letter_unicode < 1425 or cur_letter_unicode > 1479:
-                stripped_word += cur_letter
-        return stripped_word.encode('utf-8')
-    return [_strip_word(word) for word in word_list]
\ No newline at end of file
+    if language not in _DIACRITIC_TABLES:
+        raise ValueError('No diacritic marks registered for language `%s`. Known languages: %s' % (
+            language, sorted(_DIACRITIC_TABLES)))
+    marks, decompose = _DIACRITIC_TABLES[language]
+    if not word_list:
+        return []
+
+    try:
+        batch = _WORD_SEPARATOR.join(word_list)
+    except TypeError:
+        bad_types = set(type(word) for word in word_list if not isinstance(word, basestring))
+        raise ValueError('Word input must be string or unicode. Instead, was %s' % bad_types.pop())
+    except UnicodeDecodeError:
+        # A mix of unicode and non-ASCII utf-8 strings, so Python can't join them directly.
+        batch = _WORD_SEPARATOR.join(word.encode('utf-8') if isinstance(word, unicode) else word for word in word_list)
+    if isinstance(batch, str):
+        batch = batch.decode('utf-8')
+    if batch.count(_WORD_SEPARATOR) != len(word_list) - 1:
+        raise ValueError('Word input can\'t contain null characters.')
+
+    if decompose:
+        batch = unicodedata.normalize('NFD', batch)
+    batch = marks.sub(u'', batch)
+    if decompose:
+        batch = unicodedata.normalize('NFC', batch)
+    return batch.encode('utf-8').split(_WORD_SEPARATOR)
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+"""Benchmarks `translation.strip_diacritics` against the original character-by-character implementation.
+
+Run with:
+
+python translation_benchmark.py
+"""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+import argparse
+import time
+
+import translation
+
+
+def _legacy_strip_diacritics(word_list):
+    """The original implementation, which rebuilds each word one character at a time."""
+    def _strip_word(word):
+        word = word.decode('utf-8')
+        stripped_word = ''
+        for cur_letter in word:
+            cur_letter_unicode = ord(cur_letter)
+            if cur_letter_unicode < 1425 or cur_letter_unicode > 1479:
+                stripped_word += cur_letter
+        return stripped_word.encode('utf-8')
+    return [_strip_word(word) for word in word_list]
+
+
+def _time(fn, word_list):
+    start_time = time.time()
+    result = fn(word_list)
+    return time.time() - start_time, result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_words', default='1000,10000,100000,1000000',
+                        help='Comma-separated list of word list sizes to benchmark.')
+    args = parser.parse_args()
+    words = ['חוּלצָה', 'מִכְנָסַיִים', 'אַבָּא', 'מָיִם']
+    print('%10s %12s %12s %10s' % ('words', 'legacy secs', 'table secs', 'speedup'))
+    for num_words in [int(x) for x in args.num_words.split(',')]:
+        word_list = [words[i % len(words)] for i in xrange(num_words)]
+        legacy_secs, legacy_result = _time(_legacy_strip_diacritics, word_list)
+        table_secs, table_result = _time(translation.strip_diacritics, word_list)
+        assert legacy_result == table_result
+        print('%10i %12.3f %12.3f %9.1fx' % (num_words, legacy_secs, table_secs, legacy_secs / table_secs))
@@ -4,8 +4,15 @@
 __author__ = 'shor.joel@gmail.com (Joel Shor)'
 
 
+import os
+import tempfile
 import unittest
 
+from googleapiclient import discovery
+
+from credentials import Credentials, credentials
+import disk_cache
+import fake_servers
 import translation
 
 
@@ -19,6 +26,41 @@ class TestTranslations(unittest.TestCase):
             words_without_diacritics,
             translation.strip_diacritics(words_with_diacritics))
 
+    def test_strip_diacritics_other_scripts(self):
+        self.assertListEqual(['كتب', 'مدرسة'], translation.strip_diacritics(['كَتَبَ', 'مَدْرَسَة'], language='ar'))
+        self.assertListEqual(['cafe', 'nino', 'Uber'],
+                             translation.strip_diacritics(['café', u'ni\xf1o', 'U\xcc\x88ber'], language='latin'))
+
+    def test_get_translations_from_cache(self):
+        cache = disk_cache.DiskCache(os.path.join(tempfile.mkdtemp(), 'translations.sqlite'))
+        cache.set_many({
+            ('en', 'iw', 'water'): 'מים'.decode('utf-8'),
+            ('iw', 'en', 'אמא'): 'mother',
+        })
+
+        # Every word is cached, so this never touches the network.
+        english_words, translated_words = translation.get_translations(
+            ['water', 'אמא'], credentials, target_language='iw', cache=cache)
+        self.assertTupleEqual(('water', 'mother'), english_words)
+        self.assertTupleEqual(('מים', 'אמא'), translated_words)
+
+
+    def test_get_service_with_default_discovery_url(self):
+        # Without a `DISCOVERY_SERVICE_URL`, the client fetches the API description from its own default URL.
+        self.assertIsNone(translation.DISCOVERY_SERVICE_URL)
+        http = fake_servers.DiscoveryHttp()
+        real_build = translation.build
+        translation.build = lambda *args, **kwargs: real_build(*args, http=http, **kwargs)
+        try:
+            credentials = Credentials()
+            credentials.translate = Credentials()
+            credentials.translate.developerKey = 'default-discovery-url'
+            service = translation._get_service(credentials)
+        finally:
+            translation.build = real_build
+        self.assertTrue(hasattr(service, 'translations'))
+        self.assertEqual([discovery.DISCOVERY_URI.format(api='translate', apiVersion='v2')],
+                         [uri.split('?')[0] for uri in http.uris])
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,41 @@
+"""Benchmarks `main.WordTranslationPairs` lookups and removal as the word list grows.
+
+The time per row should stay roughly constant as the number of rows grows, i.e. the total time should scale linearly.
+Run with:
+
+python word_pairs_benchmark.py
+"""
+
+__author__ = 'shor.joel@gmail.com (Joel Shor)'
+
+
+import argparse
+import time
+
+import main
+
+
+def _benchmark(num_rows):
+    """Returns the seconds it takes to build, look up every word in, and remove half of a list of `num_rows` rows."""
+    rows = [('english%i' % i, 'translation%i' % i, 'extra%i' % i) for i in xrange(num_rows)]
+    start_time = time.time()
+    pairs = main.WordTranslationPairs(rows)
+    for english, translation, _ in rows:
+        pairs.get_translation(english)
+        pairs.get_english(translation)
+    # Like `main._remove_words` does for words without media.
+    for _, translation, _ in rows[::2]:
+        pairs.remove_translated_word(translation)
+    pairs.extra_info
+    return time.time() - start_time
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_rows', default='1000,10000,100000,500000',
+                        help='Comma-separated list of word list sizes to benchmark.')
+    args = parser.parse_args()
+    print('%10s %12s %12s' % ('rows', 'total secs', 'usecs/row'))
+    for num_rows in [int(x) for x in args.num_rows.split(',')]:
+        secs = _benchmark(num_rows)
+        print('%10i %12.3f %12.3f' % (num_rows, secs, 1e6 * secs / num_rows))